@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ####################################################################
+#  Copyright (C) 2013-2014 by Johannes Bauer, The University of 
+#  Hamburg
+#  http://www.tatome.de
+#  This file is part of the projection correction project.
+#
+#  This is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as 
+#  published by the Free Software Foundation; either  version 2 
+#  of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public  License 
+#  along with this file; if not, write to the
+#  Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+# ####################################################################
+
+
+"""
+Runs the whole pipeline (detection.py, combineDistortions.py, 
+regressDistortion.py, npyToCStructure.py) on a simulated camera and screen 
+(see simulatedCamera.py) and reports wall time and peak memory of each stage
+and the accuracy of the resulting lookup tables.
+"""
+
+import os
+import sys
+import math
+import time
+import tempfile
+import subprocess
+
+import numpy
+import yaml
+
+import logging
+logger = logging.getLogger(__name__)
+
+repository = os.path.dirname(os.path.abspath(__file__))
+
+def parseSize(text):
+    """ parses a size like '1280x800' into a tuple of ints. """
+    width,height = text.split('x')
+    return int(width), int(height)
+
+def oddAtLeast(n):
+    return n + 1 - n % 2
+
+def shotAngles(angleRange, count):
+    """ 
+    returns count angles evenly spaced over [-angleRange, angleRange], 
+    including 0, where the reference shot (0,0) is taken.
+    """
+    if count == 1:
+        return [0.]
+    return numpy.linspace(-angleRange, angleRange, count)
+
+def createConfig(base, args):
+    """
+    returns a copy of the config base with screen, camera, projectors and 
+    shots replaced according to the command line arguments args.
+    """
+    config = dict(base)
+    columns,rows = parseSize(args.projectors)
+    width,height = parseSize(args.projectorSize)
+    config['screen'] = {'width' : columns * width, 'height' : rows * height}
+    cameraWidth,cameraHeight = parseSize(args.camera)
+    config['camera'] = {
+        'width' : cameraWidth, 
+        'height' : cameraHeight,
+        'focallength' : args.focallength * cameraWidth / 1280.
+    }
+    config['projectors'] = {}
+    for column in range(columns):
+        for row in range(rows):
+            config['projectors']['p%d-%d' % (column, row)] = {
+                'iOffset' : column * width, 'jOffset' : row * height,
+                'width' : width, 'height' : height
+            }
+
+    # spread the shots evenly over the screen, such that the outermost shots
+    # just see the edges of the screen.
+    cameraFov = [
+        2 * math.degrees(math.atan(.5 * size / config['camera']['focallength']))
+            for size in (cameraWidth, cameraHeight)
+    ]
+    shots = []
+    yawShots,vergShots = [oddAtLeast(n) for n in parseSize(args.shots)]
+    yawRange = max(0., (args.fov[0] - cameraFov[0]) / 2.)
+    vergRange = max(0., (args.fov[1] - cameraFov[1]) / 2.)
+    for yaw in shotAngles(yawRange, yawShots):
+        for verg in shotAngles(vergRange, vergShots):
+            shots.append({
+                'angles' : [round(float(yaw), 2), round(float(verg), 2)],
+                'projectors' : sorted(config['projectors'])
+            })
+    config['detection'] = dict(config['detection'])
+    config['detection']['stepsize'] = args.stepsize
+    config['detection']['shots'] = shots
+    config['detection']['decoding'] = args.decoding
+    if args.adaptive:
+        adaptive = dict(config['detection'].get('adaptive', {}))
+        adaptive.update(enabled=True, stepsizes=args.adaptive)
+        adaptive.setdefault('blobsteps', 5)
+        adaptive.setdefault('sigma', .2)
+        adaptive.setdefault('blobspread', .1)
+        config['detection']['adaptive'] = adaptive
+    config['simulation'] = {
+        'fov' : list(args.fov),
+        'noise' : args.noise,
+        'vignetting' : args.vignetting,
+        'blur' : args.blur,
+        'poseError' : args.poseError,
+        'seed' : args.seed
+    }
+    return config
+
+def distortionFor(config):
+    import simulatedCamera
+    screenSize = config['screen']['width'],config['screen']['height']
+    return simulatedCamera.SyntheticDistortion(
+        screenSize, fov=config['simulation']['fov']
+    )
+
+def detect(config, outfilename):
+    """ run detection on the simulated camera and save the sightings. """
+    import detection
+    import simulatedCamera
+    screenSize = config['screen']['width'],config['screen']['height']
+    camera = simulatedCamera.SimulatedCamera(
+        screenSize,
+        (config['camera']['width'], config['camera']['height']),
+        config['camera']['focallength'],
+        distortionFor(config),
+        noise=config['simulation']['noise'],
+        vignetting=config['simulation']['vignetting'],
+        blur=config['simulation']['blur'],
+        poseError=config['simulation']['poseError'],
+        seed=config['simulation']['seed']
+    )
+    data,statistics = detection.detectShots(config, camera, camera)
+    numpy.savez(outfilename, data=data, config=yaml.dump(config))
+    statistics['sightings'] = len(data)
+    with open(outfilename + '.stats.yaml', 'w') as statsfile:
+        yaml.dump(statistics, statsfile)
+
+def runStage(name, command, workdir):
+    """
+    run a command in workdir and return its wall time and peak memory.
+    """
+    logger.info("Running %s: %s", name, ' '.join(command))
+    start = time.time()
+    process = subprocess.Popen(command, cwd=workdir)
+    pid,status,usage = os.wait4(process.pid, 0)
+    wallTime = time.time() - start
+    if status != 0:
+        raise RuntimeError("%s failed with status %d." % (name, status))
+    # ru_maxrss is in kilobytes on Linux.
+    return {'stage' : name, 'time' : wallTime, 'memory' : usage.ru_maxrss / 1024.}
+
+def tableAccuracy(config, projector, tablefile):
+    """
+    compare the lookup tables in tablefile with the ground truth.
+
+    returns the RMS and maximal error in degrees of yaw and vergence.
+    """
+    tables = numpy.load(tablefile)['tables']
+    pconfig = config['projectors'][projector]
+    aperture = numpy.radians(config['opengl_setup']['aperture'])
+    scale = .5/numpy.tan(.5*aperture)
+    recovered = numpy.degrees(numpy.arctan((tables - .5) / scale))
+
+    i,j = numpy.mgrid[0:pconfig['width'], 0:pconfig['height']]
+    truth = numpy.degrees(distortionFor(config).angles(
+        i + pconfig['iOffset'], j + pconfig['jOffset']
+    ))
+    result = {}
+    for axis,name in enumerate(('yaw', 'vergence')):
+        error = recovered[:,:,axis] - truth[axis]
+        result[name] = {
+            'rms' : float(numpy.sqrt(numpy.mean(error**2))),
+            'max' : float(numpy.abs(error).max())
+        }
+    return result
+
+def benchmark(config, workdir, solver='greedy'):
+    """ 
+    run all stages in workdir and return a report.
+
+    solver -- solver for combineDistortions.py (see Converter).
+    """
+    with open(os.path.join(workdir, 'config.yaml'), 'w') as configfile:
+        yaml.dump(config, configfile)
+
+    python = sys.executable
+    script = lambda name: os.path.join(repository, name)
+    stages = [runStage(
+        'detection', 
+        [python, script('benchmark.py'), '--detect', '-o', workdir], workdir
+    )]
+    stages.append(runStage(
+        'combination',
+        [python, script('combineDistortions.py'), '-c', 'config.yaml', 
+         '-i', 'distortion.npz', '-s', solver], 
+        workdir
+    ))
+    accuracy = {}
+    for projector in sorted(config['projectors']):
+        tablefile = 'table-%s.npz' % projector
+        stages.append(runStage(
+            'regression %s' % projector,
+            [python, script('regressDistortion.py'), '-i', projector, 
+             '-n', tablefile], 
+            workdir
+        ))
+        stages.append(runStage(
+            'export %s' % projector,
+            [python, script('npyToCStructure.py'), '-i', tablefile,
+             '-o', 'table-%s.bin' % projector],
+            workdir
+        ))
+        accuracy[projector] = tableAccuracy(
+            config, projector, os.path.join(workdir, tablefile)
+        )
+
+    with open(os.path.join(workdir, 'distortion.npz.stats.yaml')) as statsfile:
+        detection = yaml.load(statsfile)
+    return {'stages' : stages, 'detection' : detection, 'accuracy' : accuracy}
+
+def printReport(report):
+    print("%-30s %10s %12s" % ('stage', 'time (s)', 'memory (MB)'))
+    for stage in report['stages']:
+        print("%-30s %10.2f %12.1f" % (stage['stage'], stage['time'], stage['memory']))
+    print("total %35.2f" % sum(stage['time'] for stage in report['stages']))
+    print("")
+    print("detection: %(frames)d frames, %(snapshots)d snapshots, "
+          "%(sightings)d sightings" % report['detection'])
+    print("")
+    print("%-15s %10s %10s %10s %10s" % (
+        'projector', 'yaw rms', 'yaw max', 'verg rms', 'verg max'))
+    for projector,accuracy in sorted(report['accuracy'].items()):
+        print("%-15s %10.4f %10.4f %10.4f %10.4f" % (
+            projector, accuracy['yaw']['rms'], accuracy['yaw']['max'],
+            accuracy['vergence']['rms'], accuracy['vergence']['max']
+        ))
+    print("(errors in degrees)")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        "Benchmarks the calibration pipeline on a simulated camera."
+    )
+    parser.add_argument('-c', dest='configfile', type=str, default='config.yaml',
+                        help='config providing all settings not given here')
+    parser.add_argument('-o', dest='workdir', type=str, default=None,
+                        help='directory for all intermediate files')
+    parser.add_argument('-p', dest='projectors', type=str, default='2x2',
+                        help='projector columns x rows')
+    parser.add_argument('-s', dest='projectorSize', type=str, default='1280x800')
+    parser.add_argument('-k', dest='camera', type=str, default='1280x720',
+                        help='camera resolution')
+    parser.add_argument('-f', dest='focallength', type=float, default=1929.,
+                        help='focal length at a horizontal resolution of 1280')
+    parser.add_argument('-n', dest='shots', type=str, default='9x3',
+                        help='shots horizontally x vertically (made odd)')
+    parser.add_argument('--stepsize', dest='stepsize', type=int, default=10)
+    parser.add_argument('--adaptive', dest='adaptive', type=int, nargs='+',
+                        default=None, help='detect adaptively with these '
+                                           'stepsizes, coarse to fine')
+    parser.add_argument('--decoding', dest='decoding', type=str, default='hard',
+                        choices=('hard', 'soft'))
+    parser.add_argument('--solver', dest='solver', type=str, default='greedy',
+                        choices=('greedy', 'joint'),
+                        help='solver for combining shots')
+    parser.add_argument('--fov', dest='fov', type=float, nargs=2, 
+                        default=(150., 60.), help='field of view of the screen')
+    parser.add_argument('--noise', dest='noise', type=float, default=2.)
+    parser.add_argument('--vignetting', dest='vignetting', type=float, default=.3)
+    parser.add_argument('--blur', dest='blur', type=float, default=1.)
+    parser.add_argument('--pose-error', dest='poseError', type=float, default=.2)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--detect', dest='detectOnly', action='store_true',
+                        help='only run detection with the config in the '
+                             'working directory (used internally)')
+    args = parser.parse_args()
+
+    if args.detectOnly:
+        config = yaml.load(open(os.path.join(args.workdir, 'config.yaml')))
+        detect(config, os.path.join(args.workdir, 'distortion.npz'))
+        sys.exit(0)
+
+    config = createConfig(yaml.load(open(args.configfile)), args)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='projection-benchmark-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    logger.info("Working in %s", workdir)
+
+    report = benchmark(config, workdir, args.solver)
+    with open(os.path.join(workdir, 'report.yaml'), 'w') as reportfile:
+        yaml.dump(report, reportfile)
+    printReport(report)
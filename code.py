@@ -22,6 +22,7 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 # ####################################################################
 
+import math
 import numpy
 import itertools
 
@@ -38,6 +39,9 @@ class Code(object):
         self.code = list(itertools.combinations(range(bits), bits/2))
         self.lookupMap = dict(zip(self.code,itertools.count()))
         self.wordlength = bits
+
+    def __len__(self):
+        return len(self.code)
     
     def encode(self, n):
         if n > len(self.code):
@@ -60,33 +64,330 @@ class Code(object):
         else:
             return None
 
+    def encode_many(self, numbers):
+        """
+        numbers -- array of ints smaller than len(self).
+
+        returns an array of the code words of the given numbers as bitmasks
+        (bit s is set if s is one of the indices in the code word).
+        """
+        words = numpy.array(self.code, dtype=numpy.int64).reshape(len(self), -1)
+        return (numpy.int64(1) << words[numpy.asarray(numbers)]).sum(axis=-1)
+
+    def lookup_many(self, masks):
+        """
+        masks -- array of code words as bitmasks (see encode_many).
+
+        returns an array of the numbers with the given code words, or -1 where
+        a bitmask is not a code word.
+        """
+        masks = numpy.asarray(masks, dtype=numpy.int64)
+        numbers = numpy.empty(masks.shape, dtype=numpy.int64)
+        for index,mask in numpy.ndenumerate(masks):
+            word = tuple(s for s in range(self.wordlength) if mask >> s & 1)
+            number = self.lookup(word) if mask >> self.wordlength == 0 else None
+            numbers[index] = -1 if number is None else number
+        return numbers
+
+def binomial(n, k):
+    """ returns n choose k as an int. """
+    if k < 0 or k > n:
+        return 0
+    result = 1
+    for m in range(1, min(k, n - k) + 1):
+        result = result * (n - m + 1) // m
+    return result
+
+class CombinatorialCode(object):
+    """
+    The same kind of code as Code, but without any tables of code words:
+    words are ranked and unranked arithmetically using the combinatorial 
+    number system, ie. the code word with ones at indices c_1 < ... < c_k has
+    the number binomial(c_1,1) + ... + binomial(c_k,k).  Words are thus 
+    numbered in colexicographic order, not in the order used by Code.
+
+    The *_many methods represent code words as int64 bitmasks in which bit s
+    is set if s is one of the indices in the word, and work on whole numpy
+    arrays at once.
+    """
+    def __init__(self, bits):
+        if bits > 63:
+            raise ValueError("Code words of more than 63 bits are not supported.")
+        self.wordlength = bits
+        self.ones = bits // 2
+        # binomials[n,k] == binomial(n,k) for all n,k we'll ever need.
+        self.binomials = numpy.array([
+            [binomial(n, k) for k in range(self.ones + 1)]
+                for n in range(bits + 1)
+        ], dtype=numpy.int64)
+        self.size = binomial(bits, self.ones)
+
+    def __len__(self):
+        return self.size
+
+    def encode(self, n):
+        """ returns the code word of n as a tuple of indices of ones. """
+        if not 0 <= n < self.size:
+            raise ValueError(
+                "This code has only %d elements.  Requested: %d." % (self.size, n)
+            )
+        word = []
+        remaining = self.ones
+        for s in range(self.wordlength - 1, -1, -1):
+            if remaining > 0 and binomial(s, remaining) <= n:
+                n -= binomial(s, remaining)
+                remaining -= 1
+                word.append(s)
+        return tuple(reversed(word))
+
+    def lookup(self, c):
+        """
+        c -- a tuple of indices.
+
+        return the number in whose binary code exactly the indices in c are
+        ones, or None if there is no such number.
+        """
+        c = sorted(c)
+        if len(c) != self.ones or len(set(c)) != len(c) or \
+                (c and not 0 <= c[0] <= c[-1] < self.wordlength):
+            return None
+        return sum(binomial(s, k + 1) for k,s in enumerate(c))
+
+    def encode_many(self, numbers):
+        """
+        numbers -- array of ints smaller than len(self).
+
+        returns an array of the code words of the given numbers as bitmasks.
+        """
+        remainders = numpy.array(numbers, dtype=numpy.int64)
+        if ((remainders < 0) | (remainders >= self.size)).any():
+            raise ValueError("This code has only %d elements." % self.size)
+        masks = numpy.zeros(remainders.shape, dtype=numpy.int64)
+        remaining = numpy.empty(remainders.shape, dtype=numpy.int64)
+        remaining[...] = self.ones
+        for s in range(self.wordlength - 1, -1, -1):
+            b = self.binomials[s][remaining]
+            one = (remaining > 0) & (b <= remainders)
+            masks[one] |= numpy.int64(1) << s
+            remainders[one] -= b[one]
+            remaining[one] -= 1
+        return masks
+
+    def lookup_many(self, masks):
+        """
+        masks -- array of code words as bitmasks (see encode_many).
+
+        returns an array of the numbers with the given code words, or -1 where
+        a bitmask is not a code word (ie. has the wrong number of ones).
+        """
+        masks = numpy.asarray(masks, dtype=numpy.int64)
+        numbers = numpy.zeros(masks.shape, dtype=numpy.int64)
+        count = numpy.zeros(masks.shape, dtype=numpy.int64)
+        for s in range(self.wordlength):
+            one = (masks >> s) & 1 == 1
+            count += one
+            numbers[one] += self.binomials[s][numpy.minimum(count[one], self.ones)]
+        numbers[(count != self.ones) | (masks >> self.wordlength != 0)] = -1
+        return numbers
+
 def codeForLength(n):
     """ Create a code with a certain number of words. """
     logger.debug("Creating code for %d words.", n)
-    def codeLength(k):
-        l = len(list(itertools.combinations(range(k), k/2)))
-        return l
+    if n <= 1:
+        return CombinatorialCode(0)
+
+    # binomial(k,k/2) <= 2**k, so we need at least log2(n) bits.  Since 
+    # binomial(k,k/2) >= 2**k/(k+1), only a few more will ever be necessary.
+    k = int(math.floor(math.log(n, 2)))
+    while binomial(k, k // 2) < n:
+        k += 1
+    return CombinatorialCode(k)
+
+class RobustCode(object):
+    """
+    A constant-weight code like CombinatorialCode, but with a minimum 
+    Hamming distance of four between code words: of all words with 
+    wordlength/2 ones, it uses only those in which the sum of the indices of
+    the ones has a certain residue modulo the wordlength.  Moving one of the
+    ones of a word changes that sum by less than the wordlength, so no two 
+    code words differ by moving a single one.
+
+    Apart from exact lookups, correct_many finds the most likely code word
+    for soft (analog) bits, correcting one moved one.
+    """
+    def __init__(self, bits):
+        self.base = CombinatorialCode(bits)
+        self.wordlength = bits
+        self.ones = self.base.ones
+        masks = self.base.encode_many(numpy.arange(len(self.base)))
+        sums = numpy.zeros(masks.shape, dtype=numpy.int64)
+        for s in range(bits):
+            sums += s * ((masks >> s) & 1)
+        residues = sums % max(bits, 1)
+        self.residue = numpy.bincount(residues).argmax()
+        # the ranks (in self.base) of our code words, in ascending order.
+        self.ranks = numpy.nonzero(residues == self.residue)[0]
+        self.size = len(self.ranks)
+
+    def __len__(self):
+        return self.size
+
+    def encode(self, n):
+        """ returns the code word of n as a tuple of indices of ones. """
+        if not 0 <= n < self.size:
+            raise ValueError(
+                "This code has only %d elements.  Requested: %d." % (self.size, n)
+            )
+        return self.base.encode(self.ranks[n])
+
+    def lookup(self, c):
+        """
+        c -- a tuple of indices.
+
+        return the number in whose binary code exactly the indices in c are
+        ones, or None if there is no such number.
+        """
+        rank = self.base.lookup(c)
+        if rank is None:
+            return None
+        n = numpy.searchsorted(self.ranks, rank)
+        if n < self.size and self.ranks[n] == rank:
+            return int(n)
+        return None
+
+    def encode_many(self, numbers):
+        """
+        numbers -- array of ints smaller than len(self).
 
-    for k in range(n):
-        if codeLength(k) >= n:
-            return Code(k)
+        returns an array of the code words of the given numbers as bitmasks.
+        """
+        numbers = numpy.asarray(numbers, dtype=numpy.int64)
+        if ((numbers < 0) | (numbers >= self.size)).any():
+            raise ValueError("This code has only %d elements." % self.size)
+        return self.base.encode_many(self.ranks[numbers])
+
+    def lookup_many(self, masks):
+        """
+        masks -- array of code words as bitmasks (see encode_many).
+
+        returns an array of the numbers with the given code words, or -1 where
+        a bitmask is not a code word.
+        """
+        ranks = self.base.lookup_many(masks)
+        numbers = numpy.minimum(
+            numpy.searchsorted(self.ranks, ranks), max(self.size - 1, 0)
+        )
+        if self.size == 0:
+            return numpy.zeros(ranks.shape, dtype=numpy.int64) - 1
+        numbers[(ranks < 0) | (self.ranks[numbers] != ranks)] = -1
+        return numbers
+
+    def correct_many(self, soft):
+        """
+        soft -- (N x wordlength) array of soft bits: the larger soft[n,s], 
+            the likelier bit s of word n is one.
+
+        returns an array of the bitmasks of the most likely code words (or 0
+        where there is no code word within one moved one of the hard 
+        decision), an array of their contrasts -- the mean of the soft bits 
+        which are ones minus the mean of those which are zeros -- and an
+        array of their confidences: the difference between the smallest soft
+        bit which is one and the largest which is zero, relative to the 
+        contrast.  Contrast and confidence disregard the two bits changed in
+        correcting a word.  A fourth array is True where a word was 
+        corrected, ie. where the hard decision was not a code word.
+        """
+        soft = numpy.asarray(soft)
+        count,bits = soft.shape
+        rows = numpy.arange(count)[:,None]
+        # hard decision: the ones are the largest soft bits.
+        ones = numpy.argsort(soft, axis=1)[:,bits - self.ones:]
+        masks = (numpy.int64(1) << ones).sum(axis=1)
+        residues = (ones.sum(axis=1) - self.residue) % bits
+
+        # Otherwise, moving the one at p to q = p - residue (mod bits) yields
+        # a code word if q is a zero.  Choose the least unlikely such move.
+        q = (ones - residues[:,None]) % bits
+        cost = soft[rows, ones] - soft[rows, q]
+        cost[((masks[:,None] >> q) & 1) == 1] = numpy.inf
+        best = numpy.argmin(cost, axis=1)
+        move = (residues != 0) & numpy.isfinite(cost[rows[:,0], best])
+        p,q = ones[move, best[move]],q[move, best[move]]
+        masks[move] += (numpy.int64(1) << q) - (numpy.int64(1) << p)
+        masks[(residues != 0) & ~move] = 0
+
+        bitsSet = ((masks[:,None] >> numpy.arange(bits)) & 1) == 1
+        moved = numpy.zeros(soft.shape, dtype=bool)
+        moved[numpy.nonzero(move)[0], p] = True
+        moved[numpy.nonzero(move)[0], q] = True
+        ones = bitsSet & ~moved
+        zeros = ~bitsSet & ~moved
+        contrast = (
+            numpy.where(ones, soft, 0).sum(axis=1) / ones.sum(axis=1).clip(1) -
+            numpy.where(zeros, soft, 0).sum(axis=1) / zeros.sum(axis=1).clip(1)
+        )
+        margin = (
+            numpy.where(ones, soft, numpy.inf).min(axis=1) - 
+            numpy.where(zeros, soft, -numpy.inf).max(axis=1)
+        )
+        confidence = margin / numpy.maximum(contrast, 1e-9)
+        confidence[masks == 0] = -numpy.inf
+        contrast[masks == 0] = 0
+        return masks, contrast, confidence, move
+
+def robustCodeForLength(n):
+    """ Create a RobustCode with a certain number of words. """
+    logger.debug("Creating robust code for %d words.", n)
+    # a RobustCode has at least binomial(k,k/2)/k words.
+    k = max(int(math.floor(math.log(max(n, 1), 2))), 2)
+    while binomial(k, k // 2) < n * k:
+        k += 1
+    while k > 2 and binomial(k - 1, (k - 1) // 2) >= n * k:
+        k -= 1
+    code = RobustCode(k)
+    while len(code) < n:
+        code = RobustCode(code.wordlength + 1)
+    return code
+
+def probeCount(size, stepsize):
+    """
+    returns the number of pixel numbers a CodeImageIterator for an image of
+    the given size and stepsize needs, ie. the number of the last probed 
+    pixel plus one.
+    """
+    columns = (size[0] + size[0] % stepsize) / stepsize
+    return columns * ((size[1] - 1) / stepsize) + (size[0] - 1) / stepsize + 1
 
 class CodeImageIterator(object):
     """ 
     Generates a sequence of cv2 images (binary arrays) in which numbered pixels
     flicker their respective number in a binary code.
     """
-    def __init__(self, size, stepsize):
+    def __init__(self, size, stepsize, code=None, firstNumber=0, robust=False):
         """
         size -- size of the image -- tuple (width,height) of ints.
         stepsize -- only one in every stepsize pixels horizontally and 
             vertically flickers its code.
+        code -- optional code to share with other iterators.  Pixel number n
+            then flickers the code word of firstNumber + n.  By default, a 
+            code just large enough for the image is created.
+        robust -- if True, the default code is a RobustCode.
         """
         self.stepsize = stepsize
         self.imageSize = size
         self.size = size[0] + size[0] % stepsize, size[1] + size[1] % stepsize
-        self.code = codeForLength((size[0] / stepsize) * (size[1] / stepsize))
         self.counter = 0
+        self._bitPlanes = None
+        self.firstNumber = firstNumber
+        if code is None and robust:
+            self.code = robustCodeForLength(probeCount(size, stepsize))
+            self.count = probeCount(size, stepsize)
+        elif code is None:
+            self.code = codeForLength((size[0] / stepsize) * (size[1] / stepsize))
+            self.count = len(self.code) - firstNumber
+        else:
+            self.code = code
+            self.count = probeCount(size, stepsize)
     
     def ravel(self,x,y):
         x /= self.stepsize
@@ -98,27 +399,84 @@ class CodeImageIterator(object):
         y = (number / (self.size[0] / self.stepsize)) * self.stepsize
         return x,y
     
+    def probeNumbers(self):
+        """
+        returns the numbers of the probed pixels as a (rows x columns) array,
+        laid out like the probed pixels in the image.
+        """
+        y,x = numpy.mgrid[
+            0:self.imageSize[1]:self.stepsize,
+            0:self.imageSize[0]:self.stepsize
+        ]
+        return self.ravel(x,y)
+
+    def bitPlanes(self):
+        """
+        returns a (wordlength x rows x columns) boolean array: entry 
+        [counter,r,c] is True if the probed pixel in row r and column c of the
+        probe grid is bright in image number counter.
+
+        The array is computed once and cached.
+        """
+        if self._bitPlanes is None:
+            numbers = self.probeNumbers()
+            planes = numpy.zeros(
+                (self.code.wordlength,) + numbers.shape, dtype=bool
+            )
+            valid = numbers < self.count
+            masks = self.code.encode_many(numbers[valid] + self.firstNumber)
+            for counter in range(self.code.wordlength):
+                planes[counter][valid] = (masks >> counter) & 1
+            self._bitPlanes = planes
+        return self._bitPlanes
+
+    def image(self, counter, out=None):
+        """
+        returns image number counter.
+
+        out -- optional (height x width) array to render the image into.
+        """
+        if out is None:
+            out = numpy.zeros((self.imageSize[1], self.imageSize[0]))
+        else:
+            out[:] = 0
+        out[::self.stepsize, ::self.stepsize] = self.bitPlanes()[counter]
+        return out
+
     def generator(self):
         """
             returns a generator of images.
         """
         for counter in range(self.code.wordlength):
-            def brightP(x, y):
-                if x % self.stepsize == 0  and y % self.stepsize == 0:
-                    i = self.ravel(x,y)
-                    return 1. if counter in self.code.encode(i) else 0.
-                else:
-                    return 0.
-            yield (
-                numpy.array([[brightP(x,y) 
-                    for x in range(self.imageSize[0])] 
-                        for y in range(self.imageSize[1])])
-            )
+            yield self.image(counter)
+
+    def patternStack(self, dtype=numpy.float):
+        """
+        returns all images at once as a (wordlength x height x width) array.
+        """
+        stack = numpy.zeros(
+            (self.code.wordlength, self.imageSize[1], self.imageSize[0]),
+            dtype=dtype
+        )
+        stack[:, ::self.stepsize, ::self.stepsize] = self.bitPlanes()
+        return stack
     
     def allPixels(self):
         i,j = numpy.mgrid[0:self.imageSize[1],0:self.imageSize[0]]
         return ((i % self.stepsize == 0) & (j % self.stepsize == 0)).astype(float)
 
+    def lookupPixels(self, masks):
+        """
+        masks -- array of code words as bitmasks (see 
+            CombinatorialCode.encode_many).
+        returns a boolean array marking those masks which are code words and
+        arrays of the horizontal and vertical indices of their pixels.
+        """
+        numbers = self.code.lookup_many(masks) - self.firstNumber
+        valid = (numbers >= 0) & (numbers < self.count)
+        x,y = self.unravel(numbers[valid])
+        return valid, x, y
+
     def lookupPixel(self, word):
         """
         word : tuple of indices of ones in a word.   
@@ -126,12 +484,202 @@ class CodeImageIterator(object):
         code.
         """
         number = self.code.lookup(word)
-        if number is not None:
-            x,y = self.unravel(number)
+        if number is not None and 0 <= number - self.firstNumber < self.count:
+            x,y = self.unravel(number - self.firstNumber)
             return x, y
         else:
             return None
 
+class PixelListImageIterator(object):
+    """
+    Like CodeImageIterator, but the flickering pixels are given explicitly
+    instead of lying on a regular grid.  By default, pixel number n of the 
+    list flickers code word n.
+    """
+    def __init__(self, size, x, y, numbers=None, robust=False):
+        """
+        size -- size of the image -- tuple (width,height) of ints.
+        x,y -- arrays of the horizontal and vertical indices of the pixels
+            to flicker.
+        numbers -- optional array of the numbers of the code words to 
+            flicker in each pixel.  Pixels may share numbers if they can be
+            told apart otherwise (but then, lookupPixels can't be used).
+        robust -- if True, use a RobustCode.
+        """
+        self.imageSize = size
+        self.x = numpy.asarray(x, dtype=int)
+        self.y = numpy.asarray(y, dtype=int)
+        if numbers is None:
+            self.numbers = numpy.arange(len(self.x))
+        else:
+            self.numbers = numpy.asarray(numbers, dtype=int)
+        self.unique = numbers is None
+        self.count = self.numbers.max() + 1 if len(self.numbers) else 0
+        # a single word would have no bits and never light up its pixels.
+        if robust:
+            self.code = robustCodeForLength(max(self.count, 2))
+        else:
+            self.code = codeForLength(max(self.count, 2))
+        self._bitPlanes = None
+
+    def bitPlanes(self):
+        """
+        returns a (wordlength x pixels) boolean array: entry [counter,n] is
+        True if the n-th pixel of the list is bright in image number counter.
+        """
+        if self._bitPlanes is None:
+            masks = self.code.encode_many(self.numbers)
+            self._bitPlanes = numpy.array([
+                (masks >> counter) & 1
+                    for counter in range(self.code.wordlength)
+            ], dtype=bool).reshape((self.code.wordlength, len(self.numbers)))
+        return self._bitPlanes
+
+    def image(self, counter, out=None):
+        """
+        returns image number counter.
+
+        out -- optional (height x width) array to render the image into.
+        """
+        if out is None:
+            out = numpy.zeros((self.imageSize[1], self.imageSize[0]))
+        else:
+            out[:] = 0
+        out[self.y, self.x] = self.bitPlanes()[counter]
+        return out
+
+    def generator(self):
+        """
+            returns a generator of images.
+        """
+        for counter in range(self.code.wordlength):
+            yield self.image(counter)
+
+    def patternStack(self, dtype=numpy.float):
+        """
+        returns all images at once as a (wordlength x height x width) array.
+        """
+        stack = numpy.zeros(
+            (self.code.wordlength, self.imageSize[1], self.imageSize[0]),
+            dtype=dtype
+        )
+        stack[:, self.y, self.x] = self.bitPlanes()
+        return stack
+
+    def allPixels(self):
+        image = numpy.zeros((self.imageSize[1], self.imageSize[0]))
+        image[self.y, self.x] = 1
+        return image
+
+    def lookupPixels(self, masks):
+        """
+        masks -- array of code words as bitmasks (see
+            CombinatorialCode.encode_many).
+        returns a boolean array marking those masks which are code words of
+        listed pixels and arrays of the horizontal and vertical indices of
+        their pixels.
+        """
+        if not self.unique:
+            raise ValueError("Pixels share code words and can't be looked up.")
+        numbers = self.code.lookup_many(masks)
+        valid = (numbers >= 0) & (numbers < self.count)
+        numbers = numbers[valid]
+        return valid, self.x[numbers], self.y[numbers]
+
+class MultiCodeImageIterator(object):
+    """
+    Like CodeImageIterator, but for several disjoint regions of one image, 
+    typically the parts of the screen covered by different projectors.  All
+    regions share one code: the pixels of region r flicker the code words of
+    numbers firstNumbers[r] to firstNumbers[r] + counts[r] - 1, so the 
+    region is encoded in the code word, too.
+    """
+    def __init__(self, size, regions, stepsize, robust=False):
+        """
+        size -- size of the whole image -- tuple (width,height) of ints.
+        regions -- list of regions, each a tuple (offset, size) of tuples
+            (i,j) and (width,height) of ints.
+        stepsize -- only one in every stepsize pixels horizontally and 
+            vertically flickers its code (counted from each region's offset).
+        robust -- if True, the shared code is a RobustCode.
+        """
+        self.imageSize = size
+        self.regions = regions
+        self.stepsize = stepsize
+        counts = [probeCount(rsize, stepsize) for offset,rsize in regions]
+        self.firstNumbers = numpy.cumsum([0] + counts)[:-1]
+        if robust:
+            self.code = robustCodeForLength(sum(counts))
+        else:
+            self.code = codeForLength(sum(counts))
+        self.iterators = [
+            CodeImageIterator(rsize, stepsize, self.code, first) 
+                for (offset,rsize),first in zip(regions, self.firstNumbers)
+        ]
+
+    def views(self, image):
+        """ returns views of the regions in image. """
+        return [
+            image[offset[1]:offset[1]+rsize[1], offset[0]:offset[0]+rsize[0]]
+                for offset,rsize in self.regions
+        ]
+
+    def image(self, counter, out=None):
+        """
+        returns image number counter.
+
+        out -- optional (height x width) array to render the image into.
+        """
+        if out is None:
+            out = numpy.zeros((self.imageSize[1], self.imageSize[0]))
+        else:
+            out[:] = 0
+        for iterator,view in zip(self.iterators, self.views(out)):
+            iterator.image(counter, out=view)
+        return out
+
+    def generator(self):
+        """
+            returns a generator of images.
+        """
+        for counter in range(self.code.wordlength):
+            yield self.image(counter)
+
+    def patternStack(self, dtype=numpy.float):
+        """
+        returns all images at once as a (wordlength x height x width) array.
+        """
+        stack = numpy.zeros(
+            (self.code.wordlength, self.imageSize[1], self.imageSize[0]),
+            dtype=dtype
+        )
+        for iterator,(offset,rsize) in zip(self.iterators, self.regions):
+            stack[:, offset[1]:offset[1]+rsize[1], offset[0]:offset[0]+rsize[0]] = \
+                iterator.patternStack(dtype)
+        return stack
+
+    def lookupPixels(self, masks):
+        """
+        masks -- array of code words as bitmasks (see 
+            CombinatorialCode.encode_many).
+        returns a boolean array marking those masks which are code words of 
+        pixels in any region, and arrays of the regions' indices and the 
+        horizontal and vertical indices of the pixels within their regions.
+        """
+        numbers = self.code.lookup_many(masks)
+        region = numpy.searchsorted(self.firstNumbers, numbers, side='right') - 1
+        valid = numpy.zeros(numbers.shape, dtype=bool)
+        x = numpy.zeros(numbers.shape, dtype=int)
+        y = numpy.zeros(numbers.shape, dtype=int)
+        for r,iterator in enumerate(self.iterators):
+            inRegion = (numbers >= 0) & (region == r)
+            local = numbers[inRegion] - iterator.firstNumber
+            found = local < iterator.count
+            idx = numpy.nonzero(inRegion)[0][found]
+            valid[idx] = True
+            x[idx],y[idx] = iterator.unravel(local[found])
+        return valid, region[valid], x[valid], y[valid]
+
 if __name__ == "__main__":
     # simple test: display images one after another.
     logging.basicConfig(level=logging.DEBUG)
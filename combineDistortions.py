@@ -30,13 +30,16 @@ import os
 
 import collections
 
+from multiprocessing.pool import ThreadPool
+
 import numpy
-import csv
 import yaml
 
 import logging
 
 import conversion
+import grouping
+import store
 
 logger = logging.getLogger(__name__)
 
@@ -49,153 +52,474 @@ class Converter(object):
     Assumes an approximately linear lens.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, solver='greedy', processes=None, csv=False):
         """
         config -- a nested dictionary specifying parameters of screen and
                   camera.
+        solver -- how to estimate the camera rotations of the shots: 
+                  'greedy' integrates shots one by one, from the center 
+                  outward, each relative to all shots integrated before.  
+                  'joint' estimates the offsets between all pairs of 
+                  overlapping shots and solves for all rotations at once 
+                  (see solveJointly).
+        processes -- number of threads used to compare shots in the 'joint'
+                  solver.  Defaults to the number of CPUs.
+        csv -- also export each projector's mapping as a CSV file (see 
+                  convert).
         """
+        if solver not in ('greedy', 'joint'):
+            raise ValueError("Unknown solver: %s" % solver)
         self.config = config
         self.focallength = config['camera']['focallength']
+        self.roll = 0.
+        self.solver = solver
+        self.processes = processes
+        self.csv = csv
     
     def setFocallength(self, focallength):
         self.focallength = focallength
-    
-    def __selectByOffset__(self, data, offsets):
-        truths = (data[:,4] == offsets[0]) * (data[:,5] == offsets[1])
-        return data[numpy.where(truths)][:,0:4]
 
-    def convert(self, data):
-        """
-        Main method of this class.  See class comment.
-
-        data -- (Nx6) array of sightings of pixels in various shots.
-                Entries should be (x,y,i,j,yaw,verg), where 
-                
-                    x,y are horizontal and vertical coordinates in the camera
-                        image
-
-                    i,j are horizontal and vertical coordinates in the 
-                        projected image
+    def setRoll(self, roll):
+        """ roll -- rotation of the camera around its optical axis (radians). """
+        self.roll = roll
 
-                    yaw,verg are nominal horizontal and vertical angles of 
-                        camera rotation in the respective shot.  These are 
-                        used only to identify mappings belonging to the same 
-                        shot: We don't trust these values but rather estimate 
-                        them for all but the one shot where yaw=verg=0, which
-                        is the anchor relative to which all other angles are 
-                        estimated.
+    def calibrate(self, data, focallengths, rolls):
+        """
+        choose the focal length and roll under which the viewing angles of 
+        pixels seen in more than one shot agree best, and use them from now
+        on.
+
+        Under each candidate, the sightings of each shot are converted to 
+        angles with the shot's nominal yaw and vergence, so that the shots
+        overlap.  The disagreement of a candidate is the median distance 
+        between the angles of a pixel in two shots, after removing the 
+        median offset between the shots (the error of the nominal pose), 
+        times the focal length.  Everything independent of focal length and
+        roll (grouping by shot, overlaps between shots) is computed once; 
+        per candidate, only the conversion to angles and the residuals are.
+
+        data -- sightings as for convert.
+        focallengths -- candidate focal lengths.
+        rolls -- candidate rolls (radians).
+
+        returns the chosen focal length and roll and an array of the 
+        disagreements (in camera pixels) of all combinations of candidates.
         """
         imageSize = self.config['camera']['width'],self.config['camera']['height']
-        screenSize = self.config['screen']['width'],self.config['screen']['height']
-
-        # This could be tweaked/estimated in case the camera doesn't
-        # rotate along the chip's horizontal axis.
-        roll = 0.0
-
-        dataset = {} # camera poses -> lists of mappings
-
-        neutralConversion = conversion.Conversion(
-            imageSize, 0, 0, roll, self.focallength
+        height = self.config['screen']['height']
+
+        shots = grouping.Groups(data[:,4], data[:,5])
+        pixels = []
+        for rows in numpy.split(shots.order, shots.starts[1:]):
+            index,positions = uniquePixels(data[rows,2], data[rows,3], height)
+            pixels.append((SparseMapping(index, None), rows[positions]))
+
+        # the rows of data of the pixels seen in each pair of shots.
+        first,second,pairIds = [],[],[]
+        for a,(mappingA,rowsA) in enumerate(pixels):
+            for mappingB,rowsB in pixels[a + 1:]:
+                mine,theirs = mappingA.overlap(mappingB)
+                if len(mine) > 20:
+                    first.append(rowsA[mine])
+                    second.append(rowsB[theirs])
+                    pairIds.append(numpy.zeros(len(mine), dtype=int) + len(pairIds))
+        if not pairIds:
+            raise ValueError("No two shots overlap.  Can't calibrate.")
+        logger.info(
+            "Calibrating on %d pairs of overlapping shots.", len(pairIds)
         )
+        rows,inverse = numpy.unique(
+            numpy.concatenate(first + second), return_inverse=True
+        )
+        first,second = numpy.split(inverse, 2)
+        pairs = grouping.Groups(numpy.concatenate(pairIds))
+        pairOf = pairs.inverse()
+
+        # the sightings by shot, to be converted under each shot's pose.
+        shotOf = shots.inverse()[rows]
+        byShot = numpy.argsort(shotOf, kind='mergesort')
+        points = numpy.split(
+            data[rows[byShot],0:2].transpose(), 
+            numpy.cumsum(numpy.bincount(shotOf, minlength=len(shots)))[:-1], 
+            axis=1
+        )
+        yaws,vergences = numpy.radians(shots.keys)
+
+        disagreement = numpy.zeros((len(focallengths), len(rolls)))
+        angles = numpy.empty((2, len(rows)))
+        for f,focallength in enumerate(focallengths):
+            for r,roll in enumerate(rolls):
+                candidate = conversion.Conversions(
+                    imageSize, yaws, vergences, roll, focallength
+                )
+                angles[:,byShot] = numpy.concatenate(
+                    candidate.convert(points), axis=1
+                )
+                residuals = [
+                    diff - pairs.median(diff)[pairOf]
+                    for diff in angles[:,first] - angles[:,second]
+                ]
+                # in units of camera pixels, lest longer focal lengths win 
+                # just by making all angles smaller.
+                disagreement[f,r] = focallength * \
+                        numpy.median(numpy.hypot(*residuals))
+                logger.debug(
+                    "Focal length %f, roll %f: disagreement %f pixels.", 
+                    focallength, math.degrees(roll), disagreement[f,r]
+                )
 
-        # sort offsets such that we start near the center and move outward.
-        # A more sophisticated algorithm could be thought of, but this works 
-        # in practice (as long as there is sufficient overlap between shots.
-        allOffsets = set(tuple(d[4:6]) for d in data)
-        allOffsets = sorted(allOffsets, key=lambda p: (p[0]**2+p[1]**2))
-        for offsets in allOffsets:
-            datapoints = self.__selectByOffset__(data, offsets)
-
-            datapoints.transpose()[0:2] = neutralConversion.convert(
-                datapoints[:,0:2].transpose()
-            )
-
-            dataset[offsets] = datapoints
+        f,r = numpy.unravel_index(numpy.argmin(disagreement), disagreement.shape)
+        logger.info(
+            "Chose focal length %f, roll %f (disagreement %f pixels).",
+            focallengths[f], math.degrees(rolls[r]), disagreement[f,r]
+        )
+        self.setFocallength(focallengths[f])
+        self.setRoll(rolls[r])
+        return focallengths[f], rolls[r], disagreement
+    
+    def integrateGreedily(self, dataset):
+        """
+        estimate the camera rotation of each shot relative to the (0,0) shot
+        and all shots integrated before it, from the center outward.
 
-        # create one array marking mapped pixels per perspective
-        for offsets,datapoints in dataset.iteritems():
-            points = numpy.zeros(screenSize + (2,), dtype=float)
-            hits = numpy.zeros(screenSize + (2,), dtype=int)
-            for x,y,i,j in datapoints:
-                points[i,j] = (x,y)
-                hits[i,j] = True,True
-            dataset[offsets] = (points, hits)
+        dataset -- dictionary of camera poses (yaw,verg) to SparseMappings.
+            Their angles are shifted by the estimated rotations.
 
+        returns a SparseMapping of the averaged angles of all pixels.
+        """
         # Determine yaw, verg of each perspective wrt. 0,0 perspective,
         # integrate datasets.
-        globalMapping,globalHits = dataset[0.,0.]
-        del(dataset[0.,0.])
-        def integrate(mappingArray, hits):
+        dataset = dict(dataset)
+        globalMapping = dataset.pop((0.,0.))
+        def integrate(mapping):
             # guess the camera rotation wrt. (0,0)
-            guessYaw,guessVerg = guessOffsets((globalMapping,globalHits),(mappingArray,hits))
+            guessYaw,guessVerg = guessOffsets(globalMapping, mapping)
             if guessYaw is not None and guessVerg is not None:
                 logger.info(
                     "Before: Guess for nominal offsets %s: (%f, %f)", offsets,
                      math.degrees(guessYaw), math.degrees(guessVerg)
                 )
 
-                mappingArray[:,:,0] += guessYaw
-                mappingArray[:,:,1] += guessVerg
-                guessYaw,guessVerg = guessOffsets((globalMapping,globalHits),(mappingArray, hits))
+                mapping.angles[:,0] += guessYaw
+                mapping.angles[:,1] += guessVerg
 
                 # Compute average of viewing angles of projected pixels under different camera
                 # rotations.
-                globalMapping[:,:,:] = (globalMapping * globalHits + mappingArray * hits)
-                globalHits[:,:,:] = globalHits + hits
-                globalMapping[:,:,:] /= globalHits + (globalHits == 0)
+                globalMapping.merge(mapping)
             else:
                 logger.info("Cannot map data for nominal offsets %s: too little overlap.", offsets)
 
-        def guessOffsets((zeroDist,zeroHits),(dist,hits)):
+        def guessOffsets(zeroMapping, mapping):
             """
             Guess the camera rotation (the offset) between straight ahead 
             ((0,0) rotation) and a given set of observed projector coordinate 
             to camera image mappings.
 
-            zeroDist -- collection of projector coordinates and corresponding
-                viewing angles relative to (0,0).
-            zeroHist -- array of ints in which non-zero indicate pixels which are
-                mapped in zeroDist
-            dist -- collection of projector coordinates and corresponding 
-                viewing angles under the camera rotation to be estimated.
-            hits -- bitmap marking those pixels in the projected image which
-                have a mapping under dist.
+            zeroMapping -- SparseMapping of projector coordinates and 
+                corresponding viewing angles relative to (0,0).
+            mapping -- SparseMapping of projector coordinates and 
+                corresponding viewing angles under the camera rotation to be
+                estimated.
             """
 
             # determine overlap
-            overlap = zeroHits * hits
-            overlap = numpy.nonzero(overlap[:,:,0])
-            logger.debug("Number of overlapping pixels: %d", len(overlap[0]))
-            if len(overlap[0]) > 20:
-                diffs = zeroDist - dist
-                yawDiffs = diffs[:,:,0][overlap]
-                vergDiffs  = diffs[:,:,1][overlap]
-                guessYaw = numpy.mean(yawDiffs)    # mean of longitudinal differences
-                guessVerg  = numpy.mean(vergDiffs)    # mean of latitudinal differences
+            mine,theirs = zeroMapping.overlap(mapping)
+            logger.debug("Number of overlapping pixels: %d", len(mine))
+            if len(mine) > 20:
+                diffs = zeroMapping.angles[mine] - mapping.angles[theirs]
+                guessYaw = numpy.mean(diffs[:,0])    # mean of longitudinal differences
+                guessVerg  = numpy.mean(diffs[:,1])    # mean of latitudinal differences
                 return guessYaw, guessVerg
             else:
                 logger.warn("No overlap.")
                 return None,None
             
-        for offsets in sorted(dataset, key=lambda p: (abs(p[0]),abs(p[1]))):
+        for offsets in sorted(dataset, key=lambda p: (abs(p[0]),abs(p[1]),p)):
             logger.debug("Integrating data from offsets %s", offsets)
-            mappingArray,hits = dataset[offsets]
-            integrate(mappingArray, hits)
+            integrate(dataset[offsets])
+        return globalMapping
+
+    def solveJointly(self, dataset):
+        """
+        estimate the camera rotations of all shots at once: the median
+        difference of the angles of the pixels seen in each pair of 
+        overlapping shots is computed (in parallel), and the rotations are 
+        the weighted least-squares solution of all these pairwise offsets, 
+        with the (0,0) shot fixed.  Shots not connected to the (0,0) shot by
+        a chain of overlaps are dropped.  All shots are then averaged in one
+        pass.
+
+        dataset -- dictionary of camera poses (yaw,verg) to SparseMappings.
+            Their angles are shifted by the estimated rotations.
+
+        returns a SparseMapping of the averaged angles of all pixels.
+        """
+        poses = sorted(dataset)
+        anchor = poses.index((0.,0.))
+        pairs = [
+            (a, b) for a in range(len(poses)) for b in range(a + 1, len(poses))
+        ]
+        pool = ThreadPool(self.processes)
+        try:
+            overlaps = pool.map(
+                lambda pair: pairOffset(
+                    dataset[poses[pair[0]]], dataset[poses[pair[1]]]
+                ),
+                pairs
+            )
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        edges = [
+            (a, b, count, offset) 
+                for (a, b),(count, offset) in zip(pairs, overlaps) 
+                    if count > 20
+        ]
+        logger.info(
+            "%d of %d pairs of shots overlap.", len(edges), len(pairs)
+        )
+
+        # only shots connected to the anchor can be placed.
+        connected = set([anchor])
+        grown = True
+        while grown:
+            grown = False
+            for a,b,count,offset in edges:
+                if (a in connected) != (b in connected):
+                    connected.update((a, b))
+                    grown = True
+        for n,pose in enumerate(poses):
+            if n not in connected:
+                logger.info("Cannot map data for nominal offsets %s: too little overlap.", pose)
+
+        # rotation[b] - rotation[a] = offset of each edge, weighted by the 
+        # square root of the overlap, rotation[anchor] = 0.
+        unknowns = sorted(connected - set([anchor]))
+        column = dict((n, c) for c,n in enumerate(unknowns))
+        edges = [e for e in edges if e[0] in connected]
+        A = numpy.zeros((len(edges), len(unknowns)))
+        B = numpy.zeros((len(edges), 2))
+        for row,(a,b,count,offset) in enumerate(edges):
+            weight = math.sqrt(count)
+            if b in column:
+                A[row, column[b]] = weight
+            if a in column:
+                A[row, column[a]] = -weight
+            B[row] = weight * offset
+        rotations = numpy.zeros((len(poses), 2))
+        if unknowns:
+            rotations[unknowns] = numpy.linalg.lstsq(A, B, rcond=-1)[0]
+
+        for n in sorted(connected):
+            logger.info(
+                "Guess for nominal offsets %s: (%f, %f)", poses[n],
+                math.degrees(rotations[n,0]), math.degrees(rotations[n,1])
+            )
+            dataset[poses[n]].angles += rotations[n]
+
+        # average all shots in one pass.
+        mappings = [dataset[poses[n]] for n in sorted(connected)]
+        index = numpy.concatenate([m.index for m in mappings])
+        angles = numpy.concatenate([m.angles for m in mappings])
+        pixels = grouping.Groups(index)
+        return SparseMapping(pixels.keys[0], pixels.mean(angles), pixels.counts)
+
+    def convert(self, data, source=None):
+        """
+        Main method of this class.  See class comment.
+
+        The mapping of each projector is written to the directory 
+        combinedMappingPattern % projector, one .npy file per column (yaw, 
+        vergence, i, j, hits) with a header (see store.writeMapping), and, 
+        if requested, exported to the CSV file 
+        combinedDistortionFilePattern % projector.
+
+        data -- (Nx6) array of sightings of pixels in various shots.
+                Entries should be (x,y,i,j,yaw,verg), where 
+                
+                    x,y are horizontal and vertical coordinates in the camera
+                        image
+
+                    i,j are horizontal and vertical coordinates in the 
+                        projected image
+
+                    yaw,verg are nominal horizontal and vertical angles of 
+                        camera rotation in the respective shot.  These are 
+                        used only to identify mappings belonging to the same 
+                        shot: We don't trust these values but rather estimate 
+                        them for all but the one shot where yaw=verg=0, which
+                        is the anchor relative to which all other angles are 
+                        estimated.
+        source -- where data came from, recorded in the mappings' headers.
+        """
+        imageSize = self.config['camera']['width'],self.config['camera']['height']
+        screenSize = self.config['screen']['width'],self.config['screen']['height']
+
+        # The roll is zero unless the camera doesn't rotate along the chip's
+        # horizontal axis (see setRoll and calibrate).
+        neutralConversion = conversion.Conversion(
+            imageSize, 0, 0, self.roll, self.focallength
+        )
+
+        # group the mappings by camera pose in one pass: sort them once, 
+        # convert all of them at once, and take a view of each pose's part.
+        shots = grouping.Groups(data[:,4], data[:,5])
+        datapoints = shots.sort(data[:,0:4])
+        neutralConversion.convert(
+            datapoints[:,0:2].transpose(), out=datapoints[:,0:2].transpose()
+        )
+        # camera poses -> mappings
+        dataset = dict(zip(
+            zip(*shots.keys), numpy.split(datapoints, shots.starts[1:])
+        ))
+
+        # create one sparse mapping per perspective
+        for offsets,datapoints in dataset.iteritems():
+            dataset[offsets] = sparseMapping(datapoints, screenSize[1])
+
+        if self.solver == 'joint':
+            globalMapping = self.solveJointly(dataset)
+        else:
+            globalMapping = self.integrateGreedily(dataset)
 
         # write outfiles, create visualization
-        pconfig = config['projectors']
+        allI,allJ = globalMapping.pixels(screenSize[1])
+        pconfig = self.config['projectors']
         for projector in pconfig:
             logger.info("Writing data for projector %s" % projector)
             iOffset = pconfig[projector]['iOffset']
             jOffset = pconfig[projector]['jOffset']
             width = pconfig[projector]['width']
             height = pconfig[projector]['height']
-            with open(config['combinedDistortionFilePattern'] % projector, 'w') as outfile:
-                writer = csv.writer(outfile)
-                for i,j in numpy.transpose(numpy.nonzero(globalHits[:,:,0])):
-                    if iOffset <= i < iOffset + width and jOffset <= j < jOffset + height:
-                        x,y = globalMapping[i,j]
-                        writer.writerow([x,y,i,j])
+            mine = (iOffset <= allI) & (allI < iOffset + width) & \
+                   (jOffset <= allJ) & (allJ < jOffset + height)
+            yaw,vergence = globalMapping.angles[mine].transpose()
+            columns = [
+                ('yaw', yaw), ('vergence', vergence), 
+                ('i', allI[mine]), ('j', allJ[mine]), 
+                ('hits', globalMapping.hits[mine])
+            ]
+            store.writeMapping(
+                store.mappingPattern(self.config) % projector, columns, {
+                    'projector' : projector,
+                    'config' : self.config,
+                    'provenance' : {
+                        'source' : source,
+                        'sightings' : len(data),
+                        'shots' : len(shots),
+                        'solver' : self.solver,
+                        'focallength' : float(self.focallength),
+                        'roll' : float(self.roll),
+                    }
+                }
+            )
+            if self.csv:
+                numpy.savetxt(
+                    self.config['combinedDistortionFilePattern'] % projector, 
+                    numpy.column_stack([column for name,column in columns[0:4]]),
+                    fmt=['%r', '%r', '%d', '%d'], delimiter=','
+                )
+
+class SparseMapping(object):
+    """
+    Viewing angles of a set of projector pixels.  Pixels are identified by 
+    their linear index i * height + j in the projection image and kept sorted
+    by it, so memory and time scale with the number of pixels mapped rather 
+    than with the size of the projection image.
+    """
+
+    def __init__(self, index, angles, hits=None):
+        """
+        index -- sorted array of unique linear pixel indices.
+        angles -- (N x 2) array of the viewing angles (yaw,verg) of the 
+            pixels.
+        hits -- number of mappings averaged into each pixel's angles.  
+            Defaults to one for each pixel.
+        """
+        self.index = index
+        self.angles = angles
+        if hits is None:
+            hits = numpy.ones(len(index), dtype=int)
+        self.hits = hits
+
+    def __len__(self):
+        return len(self.index)
+
+    def pixels(self, height):
+        """ returns the horizontal and vertical coordinates of the pixels. """
+        return self.index // height, self.index % height
+
+    def overlap(self, other):
+        """
+        returns the positions in self and in other of the pixels mapped in 
+        both, in order of their indices.
+        """
+        if len(self) == 0:
+            return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+        positions = numpy.searchsorted(self.index, other.index)
+        positions = numpy.minimum(positions, len(self) - 1)
+        both = self.index[positions] == other.index
+        return positions[both], numpy.nonzero(both)[0]
+
+    def merge(self, other):
+        """
+        average the angles of other into self, weighted by their hits, and
+        add the pixels mapped only in other.
+        """
+        mine,theirs = self.overlap(other)
+        hits = self.hits[mine]
+        otherHits = other.hits[theirs]
+        self.angles[mine] = (
+            self.angles[mine] * hits[:,None] + other.angles[theirs] * otherHits[:,None]
+        ) / (hits + otherHits)[:,None]
+        self.hits[mine] = hits + otherHits
+
+        new = numpy.ones(len(other), dtype=bool)
+        new[theirs] = False
+        index = numpy.concatenate((self.index, other.index[new]))
+        order = numpy.argsort(index, kind='mergesort')
+        self.index = index[order]
+        self.angles = numpy.concatenate((self.angles, other.angles[new]))[order]
+        self.hits = numpy.concatenate((self.hits, other.hits[new]))[order]
+
+def pairOffset(first, second):
+    """
+    returns the number of pixels mapped in both of two SparseMappings and 
+    the median difference of their angles in first and in second.
+    """
+    if len(first) == 0 or len(second) == 0 or \
+            first.index[-1] < second.index[0] or second.index[-1] < first.index[0]:
+        return 0, numpy.zeros(2)
+    mine,theirs = first.overlap(second)
+    if len(mine) == 0:
+        return 0, numpy.zeros(2)
+    return len(mine), numpy.median(
+        first.angles[mine] - second.angles[theirs], axis=0
+    )
+
+def uniquePixels(i, j, height):
+    """
+    returns the sorted unique linear indices of the pixels i,j in a 
+    projection image of the given height and, for each, the position in i,j
+    of the last occurrence of that pixel.
+    """
+    index = i.astype(numpy.int64) * height + j.astype(numpy.int64)
+    order = numpy.argsort(index, kind='mergesort')
+    index = index[order]
+    last = numpy.append(index[1:] != index[:-1], True)
+    return index[last], order[last]
+
+def sparseMapping(datapoints, height):
+    """
+    returns a SparseMapping of the given (N x 4) array of mappings 
+    (yaw,verg,i,j) in a projection image of the given height.  Of several 
+    mappings of one pixel, the last one is used.
+    """
+    index,positions = uniquePixels(datapoints[:,2], datapoints[:,3], height)
+    return SparseMapping(index, datapoints[positions,0:2].copy())
 
 
 if __name__ == '__main__':
@@ -206,11 +530,43 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', dest='configfile', type=str, default='config.yaml')
     parser.add_argument('-i', dest='infile', type=str, required=True)
+    parser.add_argument('-s', dest='solver', type=str, default='greedy',
+                        choices=('greedy', 'joint'),
+                        help='how to estimate the camera rotations of shots')
+    parser.add_argument('-p', dest='processes', type=int, default=None,
+                        help='threads for comparing shots (joint solver)')
+    parser.add_argument('--csv', dest='csv', action='store_true',
+                        help='also export the mappings as CSV files')
+    parser.add_argument('--focallengths', dest='focallengths', type=float, 
+                        nargs=3, default=None, metavar=('FROM', 'TO', 'COUNT'),
+                        help='calibrate the focal length among these')
+    parser.add_argument('--rolls', dest='rolls', type=float, nargs=3,
+                        default=None, metavar=('FROM', 'TO', 'COUNT'),
+                        help='calibrate the roll (degrees) among these')
     args = parser.parse_args()
 
     config = yaml.load(open(args.configfile))
 
-    converter = Converter(config)
-
-    infile = numpy.load(args.infile)
-    converter.convert(infile['data'])
+    converter = Converter(config, args.solver, args.processes, args.csv)
+
+    if os.path.isdir(args.infile):
+        detectionStore = store.DetectionStore(args.infile)
+        missing = detectionStore.missing()
+        if missing:
+            logger.warn("%d chunks still missing in %s.", len(missing), args.infile)
+        data = detectionStore.load()
+    else:
+        infile = numpy.load(args.infile)
+        data = infile['data']
+
+    if args.focallengths or args.rolls:
+        focallengths = [converter.focallength]
+        if args.focallengths:
+            start,stop,count = args.focallengths
+            focallengths = numpy.linspace(start, stop, int(count))
+        rolls = [0.]
+        if args.rolls:
+            start,stop,count = args.rolls
+            rolls = numpy.radians(numpy.linspace(start, stop, int(count)))
+        converter.calibrate(data, focallengths, rolls)
+    converter.convert(data, args.infile)
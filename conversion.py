@@ -47,14 +47,21 @@ class Conversion(object):
             yaw, vergence, roll, focallength
         )
 
-        self.x = self.rotate(norm[0], norm[1], yaw)
-        self.y = self.rotate(norm[1], self.x, -vergence)
+        x = self.rotate(norm[0], norm[1], yaw)
+        y = self.rotate(norm[1], x, -vergence)
+        z = numpy.cross(x,y)
+        self.x = self.rotate(x, z, roll)
+        self.y = self.rotate(y, z, roll)
         self.normal = numpy.cross(self.x,self.y) * focallength
+        self.focallength = focallength
         self.imageSize = imageSize
         logger.debug("x: %s\ny: %s\nz: %s",  self.x,self.y,self.normal)
-    
-    def __vectorLength__(self, vector):
-        return numpy.sqrt(numpy.sum(numpy.square(vector), axis=0))
+
+        # maps (x,y,1) of image coordinates relative to the image center to 
+        # the direction of the line of sight.
+        self.center = numpy.array([[imageSize[0]/2], [imageSize[1]/2]])
+        self.matrix = numpy.column_stack((self.x, self.y, self.normal))
+        self.matrix[:,2] -= numpy.dot(self.matrix[:,0:2], self.center[:,0])
     
     def rotate(self, v, k, theta):
         '''
@@ -63,20 +70,179 @@ class Conversion(object):
         cth = math.cos(theta)
         return v * cth + numpy.cross(k,v) * math.sin(theta)
 
-    def convert(self, point):
+    def convert(self, point, out=None):
         """
         point -- (2 x n) array of horizontal and vertical image coordinates.
-        returns viewing angles of the image coordinates.
+            It is not modified.
+        out -- optional (2 x n) array to write the result to.  May be point.
+        returns (2 x n) array of viewing angles (yaw and vergence) of the 
+        image coordinates.
+        """
+        initial = numpy.dot(self.matrix[:,0:2], point)
+        initial += self.matrix[:,2:3]
+        if out is None:
+            out = numpy.empty((2, initial.shape[1]))
+
+        yaw,vergence = out
+        numpy.arctan2(initial[0], initial[2], out=yaw)
+        # vergence is arcsin(y / length) = arctan2(y, length in the x-z plane)
+        numpy.hypot(initial[0], initial[2], out=initial[0])
+        numpy.arctan2(initial[1], initial[0], out=vergence)
+        return out
+
+    def invert(self, angles, out=None):
+        """
+        angles -- (2 x n) array of viewing angles (yaw and vergence).
+        out -- optional (2 x n) array to write the result to.  May be angles.
+        returns (2 x n) array of horizontal and vertical image coordinates 
+        at which the given viewing angles are seen (the inverse of convert).
+        Coordinates of directions behind the camera are nan.
+        """
+        yaw,vergence = angles
+        direction = numpy.empty((3, len(yaw)))
+        numpy.sin(yaw, out=direction[0])
+        numpy.cos(yaw, out=direction[2])
+        numpy.sin(vergence, out=direction[1])
+        cosVergence = numpy.cos(vergence)
+        direction[0] *= cosVergence
+        direction[2] *= cosVergence
+        if out is None:
+            out = numpy.empty((2, len(yaw)))
+
+        depth = numpy.dot(self.normal, direction)
+        behind = ~(depth > 0)
+        depth[behind] = numpy.nan
+        scale = numpy.divide(self.focallength**2, depth, out=depth)
+        numpy.multiply(
+            numpy.dot(self.matrix[:,0:2].transpose(), direction), scale, out=out
+        )
+        out += self.center
+        return out
+
+class Conversions(object):
+    """
+    Conversion of image coordinates to viewing angles and back under a 
+    stack of camera poses.  The poses' matrices are stacked, so all poses
+    are applied at once rather than one Conversion after the other.
+    """
+    def __init__(self, imageSize, yaws, vergences, rolls, focallengths):
+        """
+        imageSize -- size of the camera image.
+        yaws, vergences, rolls, focallengths -- the poses, as for Conversion.
+            Scalars are used for all poses.
         """
-        x,y = point
-        x -= self.imageSize[0]/2
-        y -= self.imageSize[1]/2
+        poses = numpy.broadcast_arrays(yaws, vergences, rolls, focallengths)
+        self.conversions = [
+            Conversion(imageSize, *pose) 
+            for pose in zip(*[numpy.ravel(p) for p in poses])
+        ]
+        # (poses x 3 x 3) matrices, (poses x 3) normals and focal lengths.
+        self.matrices = numpy.array([c.matrix for c in self.conversions])
+        self.normals = numpy.array([c.normal for c in self.conversions])
+        self.focallengths = numpy.array([c.focallength for c in self.conversions])
+        self.center = numpy.array([imageSize[0]/2, imageSize[1]/2], dtype=float)
 
-        def extend(a):
-            return numpy.tile(a,(3,1)).transpose()
-        initial = (extend(x)*self.x + extend(y)*self.y + self.normal).transpose()
-        length = self.__vectorLength__(initial)
-        yaw = numpy.arctan2(initial[0],initial[2])
-        vergence = numpy.arcsin(initial[1]/length)
+    def __len__(self):
+        return len(self.conversions)
+
+    def __getitem__(self, pose):
+        return self.conversions[pose]
+
+    def __batch__(self, points):
+        """
+        returns the points as one (2 x N) array and the pose of each point,
+        or None if the same (2 x n) array is to be used under every pose.
+        """
+        if isinstance(points, numpy.ndarray) and points.ndim == 2:
+            return points, None
+        if len(points) != len(self):
+            raise ValueError("Need one array of points per pose (%d)." % len(self))
+        lengths = [numpy.shape(p)[1] for p in points]
+        pose = numpy.repeat(numpy.arange(len(self)), lengths)
+        return numpy.concatenate(points, axis=1), pose
+
+    def __unbatch__(self, result, pose, points, out):
+        """
+        returns result in the shape of the input points, written to out if
+        given.
+        """
+        if pose is None:
+            if out is None:
+                return result
+            out[...] = result
+            return out
+        parts = numpy.split(result, numpy.cumsum(
+            [numpy.shape(p)[1] for p in points])[:-1], axis=1)
+        if out is None:
+            return parts
+        if len(out) != len(self):
+            raise ValueError("Need one output per pose (%d)." % len(self))
+        for o,part in zip(out, parts):
+            o[...] = part
+        return out
+
+    def convert(self, points, out=None):
+        """
+        points -- sequence of (2 x n_k) arrays of image coordinates, one per 
+            pose, or one (2 x n) array to convert under every pose.
+        out -- optional sequence of (2 x n_k) arrays, or (poses x 2 x n) 
+            array, to write the results to.
+        returns list of (2 x n_k) arrays of viewing angles, or a 
+        (poses x 2 x n) array if points is a single array.
+        """
+        batch,pose = self.__batch__(points)
+        if pose is None:
+            # (3 x poses x n) lines of sight.
+            initial = numpy.einsum('pij,jn->ipn', self.matrices[:,:,0:2], batch)
+            initial += self.matrices[:,:,2].T[:,:,None]
+        else:
+            # (3 x N) lines of sight, each under its own pose.
+            matrices = self.matrices[pose]
+            initial = numpy.einsum('nij,jn->in', matrices[:,:,0:2], batch)
+            initial += matrices[:,:,2].T
+
+        result = numpy.empty((2,) + initial.shape[1:])
+        numpy.arctan2(initial[0], initial[2], out=result[0])
+        numpy.hypot(initial[0], initial[2], out=initial[0])
+        numpy.arctan2(initial[1], initial[0], out=result[1])
+        if pose is None:
+            result = result.transpose(1, 0, 2)
+        return self.__unbatch__(result, pose, points, out)
+
+    def invert(self, angles, out=None):
+        """
+        angles -- sequence of (2 x n_k) arrays of viewing angles, one per 
+            pose, or one (2 x n) array to invert under every pose.
+        out -- optional sequence of (2 x n_k) arrays, or (poses x 2 x n) 
+            array, to write the results to.
+        returns list of (2 x n_k) arrays of image coordinates (see 
+        Conversion.invert), or a (poses x 2 x n) array if angles is a 
+        single array.
+        """
+        batch,pose = self.__batch__(angles)
+        yaw,vergence = batch
+        cosVergence = numpy.cos(vergence)
+        direction = numpy.array([
+            numpy.sin(yaw) * cosVergence,
+            numpy.sin(vergence),
+            numpy.cos(yaw) * cosVergence
+        ])
+        if pose is None:
+            depth = numpy.dot(self.normals, direction)
+            result = numpy.einsum('pji,jn->pin', self.matrices[:,:,0:2], direction)
+            focallengths = self.focallengths[:,None]
+        else:
+            depth = numpy.einsum('nj,jn->n', self.normals[pose], direction)
+            result = numpy.einsum('nji,jn->in', self.matrices[pose][:,:,0:2], direction)
+            focallengths = self.focallengths[pose]
 
-        return (yaw,vergence)
+        behind = ~(depth > 0)
+        depth[behind] = numpy.nan
+        scale = numpy.divide(focallengths**2, depth, out=depth)
+        if pose is None:
+            result *= scale[:,None,:]
+            result += self.center[None,:,None]
+        else:
+            result *= scale
+            result += self.center[:,None]
+        return self.__unbatch__(result, pose, angles, out)
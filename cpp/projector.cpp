@@ -24,29 +24,140 @@
 #include <stdio.h>
 #include <cstring>
 #include <assert.h>
+#include <math.h>
+#include <stdexcept>
 
 #include "projector.h"
 
+// Files written by npyToCStructure.py in the compact format start with this
+// magic; files in the original format start with the table width.
+static const char COMPACT_MAGIC[4] = {'P', 'T', 'B', 'L'};
+static const int COMPACT_VERSION = 1;
+
+enum Encoding {
+	ENCODING_FLOAT64 = 0,
+	ENCODING_FLOAT32 = 1,
+	ENCODING_FLOAT16 = 2,
+	ENCODING_FIXED16 = 3
+};
+
+enum Interpolation {
+	INTERPOLATION_NONE = 0,
+	INTERPOLATION_BILINEAR = 1
+};
+
+static double
+halfToDouble(unsigned short half) {
+	int sign = (half >> 15) ? -1 : 1;
+	int exponent = (half >> 10) & 0x1f;
+	int mantissa = half & 0x3ff;
+	if(exponent == 0) {
+		return sign * ldexp(mantissa, -24);
+	} else if(exponent == 0x1f) {
+		return mantissa ? NAN : sign * INFINITY;
+	}
+	return sign * ldexp(mantissa + 1024, exponent - 25);
+}
+
+// Reads count items of the given size from f or throws.  Unlike 
+// assert(fread(...)), the read is not compiled out with NDEBUG.
+static void
+readOrFail(void *ptr, size_t size, size_t count, FILE *f, const char *what) {
+	if(fread(ptr, size, count, f) != count) {
+		throw std::runtime_error(std::string("Truncated lookup table file: could not read ") + what);
+	}
+}
+
+static void
+failUnless(bool condition, const char *message) {
+	if(!condition) {
+		throw std::runtime_error(std::string("Invalid lookup table file: ") + message);
+	}
+}
+
 Projector::Projector(std::string datafile) {
 	fprintf(stderr, "Initializing projector from file : %s\n", datafile.c_str());
 	strcpy(name, datafile.c_str());
 	FILE *f = fopen(datafile.c_str(), "rb");
-	assert(f);
+	if(!f) {
+		throw std::runtime_error("Could not open lookup table file " + datafile);
+	}
 
-	assert(fread(&width,  sizeof(int), 1, f));
-	assert(fread(&height, sizeof(int), 1, f));
-	assert(fread(&iOffset, sizeof(int), 1, f));
-	assert(fread(&jOffset, sizeof(int), 1, f));
+	azimuthLookupTable = NULL;
+	elevationLookupTable = NULL;
+	try {
+		readTables(f);
+	} catch(...) {
+		fclose(f);
+		delete[] azimuthLookupTable;
+		delete[] elevationLookupTable;
+		throw;
+	}
+	fclose(f);
+}
+
+void
+Projector::readTables(FILE *f) {
+	char magic[4];
+	readOrFail(magic, sizeof(char), 4, f, "header");
 
+	if(memcmp(magic, COMPACT_MAGIC, 4)) {
+		memcpy(&width, magic, sizeof(int));
+		readOrFail(&height, sizeof(int), 1, f, "height");
+		readOrFail(&iOffset, sizeof(int), 1, f, "offsets");
+		readOrFail(&jOffset, sizeof(int), 1, f, "offsets");
+		failUnless(width > 0 && height > 0, "table size");
+		step = 1;
+		sampledWidth = width;
+		sampledHeight = height;
 
-	azimuthLookupTable = new double[width * height];
-	assert(azimuthLookupTable);
-	readLookupTable(f, azimuthLookupTable);
+		azimuthLookupTable = new double[width * height];
+		assert(azimuthLookupTable);
+		readLookupTable(f, azimuthLookupTable);
 
-	elevationLookupTable = new double[width * height];
-	assert(elevationLookupTable);
-	readLookupTable(f, elevationLookupTable);
+		elevationLookupTable = new double[width * height];
+		assert(elevationLookupTable);
+		readLookupTable(f, elevationLookupTable);
 
+	} else {
+		int version, encoding, interpolation;
+		readOrFail(&version, sizeof(int), 1, f, "version");
+		failUnless(version == COMPACT_VERSION, "unsupported version");
+		readOrFail(&width,  sizeof(int), 1, f, "width");
+		readOrFail(&height, sizeof(int), 1, f, "height");
+		readOrFail(&iOffset, sizeof(int), 1, f, "offsets");
+		readOrFail(&jOffset, sizeof(int), 1, f, "offsets");
+		readOrFail(&encoding, sizeof(int), 1, f, "encoding");
+		readOrFail(&step, sizeof(int), 1, f, "step");
+		readOrFail(&interpolation, sizeof(int), 1, f, "interpolation");
+		readOrFail(&sampledWidth, sizeof(int), 1, f, "sampled width");
+		readOrFail(&sampledHeight, sizeof(int), 1, f, "sampled height");
+		failUnless(width > 0 && height > 0, "table size");
+		failUnless(step >= 1, "step");
+		failUnless(encoding >= ENCODING_FLOAT64 && encoding <= ENCODING_FIXED16, "unknown encoding");
+		failUnless(interpolation == (step > 1 ? INTERPOLATION_BILINEAR : INTERPOLATION_NONE),
+				"unsupported interpolation");
+		// samples every step pixels, up to the first at or beyond the last 
+		// pixel.
+		failUnless(sampledWidth == (width - 1 + step - 1) / step + 1 &&
+				sampledHeight == (height - 1 + step - 1) / step + 1,
+				"sampled size does not match size and step");
+
+		// offset, scale, and worst-case error against the full table of
+		// the azimuth and elevation tables.
+		double header[6];
+		readOrFail(header, sizeof(double), 6, f, "scales");
+		fprintf(stderr, "Compact lookup tables: step %d, worst-case error azimuth %g, elevation %g\n",
+				step, header[2], header[5]);
+
+		azimuthLookupTable = new double[sampledWidth * sampledHeight];
+		assert(azimuthLookupTable);
+		readCompactLookupTable(f, encoding, header[0], header[1], azimuthLookupTable);
+
+		elevationLookupTable = new double[sampledWidth * sampledHeight];
+		assert(elevationLookupTable);
+		readCompactLookupTable(f, encoding, header[3], header[4], elevationLookupTable);
+	}
 }
 
 Projector::~Projector() {
@@ -57,14 +168,89 @@ Projector::~Projector() {
 void
 Projector::readLookupTable(FILE *f, double *table) {
 	for(int i = 0; i < width; i++) {
-		fread(&(table[i * height]), sizeof(double), height, f);
+		readOrFail(&(table[i * height]), sizeof(double), height, f, "lookup table");
+	}
+}
+
+void
+Projector::readCompactLookupTable(FILE *f, int encoding, double offset, double scale, double *table) {
+	int size = sampledWidth * sampledHeight;
+	if(encoding == ENCODING_FLOAT64) {
+		readOrFail(table, sizeof(double), size, f, "lookup table");
+	} else if(encoding == ENCODING_FLOAT32) {
+		float *samples = new float[size];
+		try {
+			readOrFail(samples, sizeof(float), size, f, "lookup table");
+		} catch(...) {
+			delete[] samples;
+			throw;
+		}
+		for(int k = 0; k < size; k++) {
+			table[k] = samples[k];
+		}
+		delete[] samples;
+	} else {
+		unsigned short *samples = new unsigned short[size];
+		try {
+			readOrFail(samples, sizeof(unsigned short), size, f, "lookup table");
+		} catch(...) {
+			delete[] samples;
+			throw;
+		}
+		for(int k = 0; k < size; k++) {
+			table[k] = encoding == ENCODING_FLOAT16
+				? halfToDouble(samples[k])
+				: offset + scale * samples[k];
+		}
+		delete[] samples;
 	}
 }
 
+// Samples are uniformly spaced step pixels apart (as for texture 
+// filtering), the last one possibly beyond the last pixel.
+void
+Projector::interpolationWeights(int pixel, int samples, int &lower, double &fraction) const {
+	if(samples == 1) {
+		lower = 0;
+		fraction = 0;
+		return;
+	}
+	lower = pixel / step;
+	if(lower > samples - 2) {
+		lower = samples - 2;
+	}
+	fraction = (double) (pixel - lower * step) / step;
+}
+
 void
 Projector::transform(int i, int j, double &azimuth, double &elevation) {
 	i -= iOffset;
 	j -= jOffset;
-	azimuth = azimuthLookupTable[i * height + j];
-	elevation = elevationLookupTable[i * height + j];
+	if(step == 1) {
+		azimuth = azimuthLookupTable[i * height + j];
+		elevation = elevationLookupTable[i * height + j];
+		return;
+	}
+
+	int i0, j0;
+	double di, dj;
+	interpolationWeights(i, sampledWidth, i0, di);
+	interpolationWeights(j, sampledHeight, j0, dj);
+	int i1 = sampledWidth > 1 ? i0 + 1 : i0;
+	int j1 = sampledHeight > 1 ? j0 + 1 : j0;
+
+	double w00 = (1 - di) * (1 - dj);
+	double w01 = (1 - di) * dj;
+	double w10 = di * (1 - dj);
+	double w11 = di * dj;
+	azimuth =
+		w00 * azimuthLookupTable[i0 * sampledHeight + j0] +
+		w01 * azimuthLookupTable[i0 * sampledHeight + j1] +
+		w10 * azimuthLookupTable[i1 * sampledHeight + j0] +
+		w11 * azimuthLookupTable[i1 * sampledHeight + j1];
+	elevation =
+		w00 * elevationLookupTable[i0 * sampledHeight + j0] +
+		w01 * elevationLookupTable[i0 * sampledHeight + j1] +
+		w10 * elevationLookupTable[i1 * sampledHeight + j0] +
+		w11 * elevationLookupTable[i1 * sampledHeight + j1];
 }
@@ -28,6 +28,7 @@
 
 class Projector {
 	public:
+		// Throws std::runtime_error if datafile cannot be read.
 		Projector(std::string datafile);
 		~Projector();
 
@@ -37,14 +38,30 @@ class Projector {
 		int getIOffset() const {return iOffset;};
 		int getJOffset() const {return jOffset;};
 
+		// Lookup tables as stored in the file, sampled every getStep()
+		// pixels (pixel x is at sample x / getStep(); the last sample may
+		// lie beyond the last pixel) and to be interpolated bilinearly in
+		// between, e.g. for uploading as textures.
+		int getStep() const {return step;};
+		int getSampledWidth() const {return sampledWidth;};
+		int getSampledHeight() const {return sampledHeight;};
+		const double *getAzimuthLookupTable() const {return azimuthLookupTable;};
+		const double *getElevationLookupTable() const {return elevationLookupTable;};
+
 	private:
+		void readTables(FILE *f);
 		void readLookupTable(FILE *f, double *ptr);
+		void readCompactLookupTable(FILE *f, int encoding, double offset, double scale, double *table);
+		void interpolationWeights(int pixel, int samples, int &lower, double &fraction) const;
 
 		char name[255];
 		int width;
 		int height;
 		int iOffset;
 		int jOffset;
+		int step;
+		int sampledWidth;
+		int sampledHeight;
 		double *azimuthLookupTable;
 		double *elevationLookupTable;
 };
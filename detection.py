@@ -23,24 +23,123 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 # ####################################################################
 
-import collections
+import time
+import threading
+import Queue
 
 import numpy
-import cv2
-import cv
 
-import instarCamera
 import code
+import grouping
+import regressDistortion
+import session
+import store
 
 import logging
 logger = logging.getLogger(__name__)
 
 windowtitle = "Projection Detection"
 
+# one entry per projector pixel found: median camera coordinates x,y of the
+# pixel's sightings, projector coordinates i,j and the number of sightings.
+mappingType = numpy.dtype([
+    ('x', float), ('y', float), ('i', int), ('j', int), ('count', int)
+])
+
+class Display(object):
+    """ 
+    Shows images full-screen in an OpenCV window.  OpenCV is imported only 
+    here, so detection without a display (eg. in benchmark.py) does not 
+    need it.
+    """
+
+    def __init__(self, screenSize):
+        """
+        screenSize -- size of the whole projection image : a tuple 
+            (width,height) of ints.
+        """
+        self.screenSize = screenSize
+        self.isOpen = False
+
+    def open(self):
+        """ open the window if it isn't open yet. """
+        if not self.isOpen:
+            import cv
+            cv.NamedWindow(windowtitle,cv.CV_WINDOW_NORMAL)
+            cv.ResizeWindow(windowtitle,self.screenSize[0],self.screenSize[1])
+            cv.SetWindowProperty(windowtitle, 0, cv.CV_WINDOW_FULLSCREEN)
+            self.isOpen = True
+
+    def show(self, image):
+        import cv2
+        cv2.imshow(windowtitle, image)
+
+    def wait(self, milliseconds):
+        """ wait and process window events. """
+        import cv2
+        cv2.waitKey(milliseconds)
+
+class DecoderThread(threading.Thread):
+    """ 
+    Feeds snapshots to a Detector's handleImage in the background, so that 
+    the next pattern can be displayed and captured while the last one is
+    being decoded.
+    """
+
+    def __init__(self, detector, queueSize=2):
+        """
+        detector -- the Detector whose handleImage to call.
+        queueSize -- maximal number of snapshots waiting to be decoded.
+        """
+        threading.Thread.__init__(self, name="decoder")
+        self.daemon = True
+        self.detector = detector
+        self.queue = Queue.Queue(queueSize)
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:
+                step,image = item
+                try:
+                    start = time.time()
+                    self.detector.handleImage(step, image)
+                    self.detector.frameTimings[step]['decode'] = time.time() - start
+                except Exception as e:
+                    logger.exception("Error decoding step %d.", step)
+                    self.error = e
+
+    def decode(self, step, image):
+        """ queue an image for decoding.  Blocks if the queue is full. """
+        self.queue.put((step, image))
+
+    def check(self):
+        """ re-raises the exception raised while decoding, if any. """
+        if self.error is not None:
+            raise self.error
+
+    def finish(self, reraise=True):
+        """ 
+        wait for all queued images to be decoded.  Re-raises any exception
+        raised while decoding unless reraise is False, eg. because another
+        exception is already being handled.
+        """
+        self.queue.put(None)
+        self.join()
+        if reraise:
+            self.check()
+
 class Detector(object):
     """ Main class for gathering data about projection distortion. """
 
-    def __init__(self, camera, screenSize, projectorSize, projectorOffset, stepsize):
+    def __init__(self, camera, screenSize, projectorSize, projectorOffset, stepsize,
+                 pipelined=True, settleTolerance=None, settleFraction=.001,
+                 minSettleTime=30, maxSettleTime=500, imageIterator=None, 
+                 display=None, recorder=None, decoding='hard', threshold=.1,
+                 minConfidence=.5):
         """ 
         parameters
         ==========
@@ -55,15 +154,76 @@ class Detector(object):
         stepsize -- size of vertical and horizontal steps between pixels 
             to be probed. (stepsize = 10 -- one pixel in a 10x10 square is 
             probed.)
+        pipelined -- if True, decode each snapshot in a background thread
+            while the next pattern is displayed and captured.
+        settleTolerance -- if given, after displaying a pattern, snapshots 
+            are taken until more than a fraction settleFraction of the pixels
+            has changed by more than settleTolerance gray levels since the 
+            previous pattern (ie. the new pattern has reached the camera), 
+            and then until no more than that fraction changes between two 
+            successive snapshots.  Otherwise, we simply wait maxSettleTime.
+        minSettleTime -- minimal time (ms) to wait before the first snapshot
+            in adaptive settling.
+        maxSettleTime -- maximal time (ms) to wait for the image to settle.
+        imageIterator -- optional object generating the patterns to display 
+            in the probed portion of the projection image.  Defaults to 
+            code.CodeImageIterator(projectorSize, stepsize).
+        display -- an object with methods open(), show(image) and 
+            wait(milliseconds) used to show the projection image.  Defaults
+            to a Display(screenSize).
+        recorder -- optional session.SessionRecorder to which to record 
+            all snapshots used for detection.
+        decoding -- 'hard': a camera pixel is lit in a step if its 
+            brightness, relative to the dark and bright baselines, exceeds
+            threshold, and only exact code words are accepted.  'soft': the
+            relative brightnesses are kept, and each camera pixel is mapped
+            to its most likely code word of a code.RobustCode.  The image
+            iterator must use such a code.
+        threshold -- threshold for hard decoding; in soft decoding, the 
+            minimal contrast of code words (see code.RobustCode.correct_many).
+        minConfidence -- minimal confidence of code words in soft decoding 
+            (see code.RobustCode.correct_many).
         """
         self.camera = camera
+        if display is None:
+            display = Display(screenSize)
+        self.display = display
+        self.recorder = recorder
+        self.pipelined = pipelined
+        self.settleTolerance = settleTolerance
+        self.settleFraction = settleFraction
+        self.minSettleTime = minSettleTime
+        self.maxSettleTime = maxSettleTime
+        # per-step timing information (in seconds):
+        self.frameTimings = []
         self.projectorSize = projectorSize
         self.projectorOffset = projectorOffset
         self.screenSize = screenSize
         self.stepsize = stepsize
-        self.mapping = collections.defaultdict(tuple)
-        self.remapping = {}
-        self.imageIterator = code.CodeImageIterator(projectorSize, stepsize)
+        self.remapping = numpy.zeros(0, dtype=mappingType)
+        # snapshots of the dark and the illuminated screen (see detect).
+        self.baselines = None
+        if decoding not in ('hard', 'soft'):
+            raise ValueError("Unknown decoding: %s" % decoding)
+        self.decoding = decoding
+        self.threshold = threshold
+        self.minConfidence = minConfidence
+        if imageIterator is None:
+            imageIterator = code.CodeImageIterator(
+                projectorSize, stepsize, robust=(decoding == 'soft')
+            )
+        if decoding == 'soft' and not hasattr(imageIterator.code, 'correct_many'):
+            raise ValueError("Soft decoding needs a code.RobustCode.")
+        self.imageIterator = imageIterator
+        # bit s of masks[y,x] is set if camera pixel (x,y) was lit in step s.
+        self.masks = None
+        # in soft decoding, intensities[s,n] is the relative brightness of 
+        # the n-th camera pixel within the mask in step s.
+        self.intensities = None
+        if self.imageIterator.code.wordlength <= 32:
+            self.maskType = numpy.uint32
+        else:
+            self.maskType = numpy.uint64
         self.projector_image = numpy.zeros(
                 (screenSize[1], screenSize[0]), dtype=numpy.float
         )
@@ -79,85 +239,903 @@ class Detector(object):
         image = numpy.average(image, axis=2)
         return image
 
+    def imagesDiffer(self, first, second):
+        """
+        True if more than a fraction settleFraction of the pixels differs by
+        more than settleTolerance gray levels between the two snapshots.
+        """
+        changed = numpy.abs(second - first) > self.settleTolerance
+        return numpy.mean(changed) > self.settleFraction
+
+    def waitForStableImage(self, before=None):
+        """
+        wait for the camera image to settle after displaying a new image and
+        return a snapshot and the number of snapshots taken.
+
+        before -- a snapshot of the image displayed before.  If given, the
+            camera image must first have changed from it before it can be
+            considered stable: otherwise, with a display latency longer than
+            minSettleTime, the old image would look stable already.
+        """
+        if self.settleTolerance is None:
+            self.display.wait(self.maxSettleTime)
+            return self.takeSnapshot(), 1
+
+        start = time.time()
+        self.display.wait(self.minSettleTime)
+        image = self.takeSnapshot()
+        snapshots = 1
+        arrived = before is None or self.imagesDiffer(before, image)
+        while (time.time() - start) * 1000 < self.maxSettleTime:
+            self.display.wait(1)
+            previous,image = image,self.takeSnapshot()
+            snapshots += 1
+            if not arrived:
+                arrived = self.imagesDiffer(before, image)
+            elif not self.imagesDiffer(previous, image):
+                break
+        else:
+            logger.debug("Image did not %s within %d ms.", 
+                         "settle" if arrived else "change", self.maxSettleTime)
+        return image, snapshots
+
+    def illuminate(self, brightness):
+        """ 
+        light up the probed portion of the projection image with the given 
+        brightness and everything else not at all.
+        """
+        self.projector_image[:] = 0
+        self.viewport[:] = brightness
+
+    def describe(self):
+        """
+        returns a dictionary of everything needed to create an equivalent
+        detector (see detectorFromDescription).
+        """
+        description = {
+            'type' : 'Detector',
+            'screenSize' : list(self.screenSize),
+            'projectorSize' : list(self.projectorSize),
+            'projectorOffset' : list(self.projectorOffset),
+            'stepsize' : self.stepsize,
+            'decoding' : self.decoding,
+            'threshold' : self.threshold,
+            'minConfidence' : self.minConfidence
+        }
+        if isinstance(self.imageIterator, code.PixelListImageIterator):
+            description['pixels'] = [
+                self.imageIterator.x.tolist(), self.imageIterator.y.tolist()
+            ]
+        return description
+
+    def record(self, kind, image=None, **metadata):
+        if self.recorder is not None:
+            self.recorder.record(kind, image, **metadata)
+
+    def setBaselines(self, dark, allpixels):
+        """
+        use snapshots of the dark screen and of the illuminated probed 
+        portion of the screen as baselines.
+        """
+        self.dark_baseline = dark
+        self.bright_baseline = allpixels - self.dark_baseline
+        self.mask = self.bright_baseline > 30
+        logger.debug("%d pixels in mask.", numpy.count_nonzero(self.mask))
+
     def handleImage(self, step, image):
         """ use the information in the given image. """
         image = (image - self.dark_baseline) / self.bright_baseline
 
-        image = (image > 0.1) & (self.mask)
-        cv2.imwrite('/tmp/pixels.png', image * 255.)
-        idx = numpy.nonzero(image)
-        logger.debug("%d white pixels.", idx[0].shape[0])
-        for idxy,idxx in zip(idx[0],idx[1]):
-            self.mapping[(idxx, idxy)] += (step,)
+        if self.decoding == 'soft':
+            if self.intensities is None:
+                self.intensities = numpy.zeros(
+                    (self.imageIterator.code.wordlength, self.mask.sum()), 
+                    dtype=numpy.float32
+                )
+            self.intensities[step] = image[self.mask]
+            return
 
-    def detect(self):
+        image = (image > self.threshold) & (self.mask)
+        logger.debug("%d white pixels.", numpy.count_nonzero(image))
+        if self.masks is None:
+            self.masks = numpy.zeros(image.shape, dtype=self.maskType)
+        self.masks[image] |= self.maskType(1 << step)
+
+    def codeMasks(self):
+        """
+        returns an array of the code words (as bitmasks, see 
+        code.CombinatorialCode.encode_many) seen in each camera pixel; zero 
+        where none was seen.
+        """
+        if self.decoding == 'soft' and self.intensities is not None:
+            words,contrast,confidence,corrected = \
+                self.imageIterator.code.correct_many(self.intensities.T)
+            rejected = (contrast <= self.threshold) | (confidence < self.minConfidence)
+            logger.debug(
+                "%d exact, %d corrected, %d rejected code words.",
+                (~corrected & ~rejected).sum(), 
+                (corrected & ~rejected).sum(), rejected.sum()
+            )
+            words[rejected] = 0
+            masks = numpy.zeros(self.mask.shape, dtype=numpy.int64)
+            masks[self.mask] = words
+            return masks
+        if self.masks is None:
+            return numpy.zeros((0,0), dtype=self.maskType)
+        return self.masks
+
+    def detect(self, baselines=None):
         """
         project images, take and process pictures to get projector pixel to 
         camera pixel mappings.
+
+        baselines -- optional tuple (dark,allpixels) of snapshots taken by 
+            an earlier detector of the same projector in the same camera 
+            pose, to use instead of taking new ones.
         """
-        cv.NamedWindow(windowtitle,cv.CV_WINDOW_NORMAL)
-        cv.ResizeWindow(windowtitle,self.screenSize[0],self.screenSize[1])
-        cv.SetWindowProperty(windowtitle, 0, cv.CV_WINDOW_FULLSCREEN)
-        cv2.imshow(windowtitle, self.projector_image)
-        cv2.waitKey(500)
-        self.dark_baseline = self.takeSnapshot()
+        self.record('detector', **self.describe())
+        self.display.open()
+        if baselines is None:
+            # whatever was displayed before; the dark image may not differ
+            # from it, in which case we wait maxSettleTime.
+            before = None
+            if self.settleTolerance is not None:
+                before = self.takeSnapshot()
+            self.display.show(self.projector_image)
+            dark = self.waitForStableImage(before)[0]
 
-        # light up only everything that's within the current projector's
-        # part of the projected image.
-        self.projector_image[:] = 0
-        self.viewport[:] = .3
-        cv2.imshow(windowtitle, self.projector_image)
-        cv2.waitKey(500)
-        allpixels = self.takeSnapshot()
-        self.bright_baseline = allpixels - self.dark_baseline
-        cv2.imwrite('/tmp/allpixels.png', allpixels)
-        self.mask = self.bright_baseline > 30
-        cv2.imwrite('/tmp/mask.png', self.mask * 250.)
+            # light up only everything that's within the current projector's
+            # part of the projected image.
+            self.illuminate(.3)
+            self.display.show(self.projector_image)
+            allpixels = self.waitForStableImage(dark)[0]
+            image = allpixels
+        else:
+            dark,allpixels = baselines
+            # the baselines were taken by an earlier detector, which may have
+            # left anything on the screen.
+            image = None
+            if self.settleTolerance is not None:
+                image = self.takeSnapshot()
+        self.record('dark', dark)
+        self.record('bright', allpixels)
+        self.setBaselines(dark, allpixels)
+        self.baselines = dark,allpixels
         
         self.projector_image[:] = 0
 
         if self.mask.any():
-            for step,im in enumerate(self.imageIterator.generator()):
-                self.viewport[:] = im
-                cv2.imshow(windowtitle, self.projector_image)
-                cv2.waitKey(500)
-                image = self.takeSnapshot()
-                self.handleImage(step, image)
+            decoder = None
+            if self.pipelined:
+                decoder = DecoderThread(self)
+                decoder.start()
+            captured = False
+            try:
+                for step in range(self.imageIterator.code.wordlength):
+                    timing = {}
+                    self.frameTimings.append(timing)
+                    start = time.time()
+                    self.imageIterator.image(step, out=self.viewport)
+                    self.display.show(self.projector_image)
+                    timing['display'] = time.time() - start
+
+                    start = time.time()
+                    image,timing['snapshots'] = self.waitForStableImage(image)
+                    timing['capture'] = time.time() - start
+                    self.record('frame', image, step=step)
+
+                    if decoder is not None:
+                        # stop capturing as soon as decoding has failed.
+                        decoder.check()
+                        decoder.decode(step, image)
+                    else:
+                        start = time.time()
+                        self.handleImage(step, image)
+                        timing['decode'] = time.time() - start
+                captured = True
+            finally:
+                # don't hide an exception raised while capturing behind one
+                # raised while decoding.
+                if decoder is not None:
+                    decoder.finish(reraise=captured)
+            for step,timing in enumerate(self.frameTimings):
+                logger.debug(
+                    "Frame %d: display %.1f ms, capture %.1f ms (%d snapshots), decode %.1f ms",
+                    step, timing['display'] * 1000, timing['capture'] * 1000, 
+                    timing['snapshots'], timing.get('decode', 0.) * 1000
+                )
             self.postProcess()
         else:
             logger.info("No visible pixels. Skipping detection for this camera pose and projector.")
     
-    def postProcess(self):
+    def decode(self):
+        """
+        decode the gathered bitmasks.
+
+        returns arrays of the camera coordinates x,y and projector 
+        coordinates i,j of all pixels with valid codes.
+        """
+        masks = self.codeMasks()
+        y,x = numpy.nonzero(masks)
+        valid,i,j = self.imageIterator.lookupPixels(
+            masks[y,x].astype(numpy.int64)
+        )
+        x,y = x[valid],y[valid]
+        inRange = (i < self.projectorSize[0]) & (j < self.projectorSize[1])
+        logger.debug(
+            "%d valid pixels within range, %d out of range, %d invalid.", 
+            inRange.sum(), (~inRange).sum(), (~valid).sum()
+        )
+        x,y = x[inRange],y[inRange]
+        i = i[inRange] + self.projectorOffset[0]
+        j = j[inRange] + self.projectorOffset[1]
+        return x,y,i,j
+
+    def reduce(self, x, y, i, j, reduction='median'):
+        """
+        combine all sightings of the same projector pixel.  See postProcess.
+        """
+        groups = grouping.Groups(i, j)
+        remapping = numpy.zeros(len(groups), dtype=mappingType)
+        remapping['i'],remapping['j'] = groups.keys
+        remapping['count'] = groups.counts
+        if reduction == 'median':
+            remapping['x'] = groups.median(x)
+            remapping['y'] = groups.median(y)
+        elif reduction == 'mean':
+            remapping['x'] = groups.mean(x)
+            remapping['y'] = groups.mean(y)
+        else:
+            raise ValueError("Unknown reduction: %s" % reduction)
+        return remapping
+
+    def postProcess(self, reduction='median'):
         """
         use the information gathered to infer projector pixel to camera pixel 
         mappings.
+
+        reduction -- how to combine the camera coordinates of all sightings
+            of one projector pixel: 'median' or 'mean'.
+
+        returns the mappings (also stored in self.remapping) as an array of 
+        type mappingType.
         """
-        tempMapping = collections.defaultdict(list)
-        discarded = 0
-        for x,y in self.mapping:
-            pixel = self.imageIterator.lookupPixel(self.mapping[x,y])
-            if pixel:
-                i,j = pixel
-                if i < self.projectorSize[0] and j < self.projectorSize[1]:
-                    logger.debug("Valid Pixel within range: %s", (pixel))
-                    i = pixel[0] + self.projectorOffset[0]
-                    j = pixel[1] + self.projectorOffset[1]
-                    tempMapping[i, j].append((x,y))
-                else:
-                    logger.debug("Invalid Pixel out of range: %s", (pixel))
-                    discarded += 1
-            else:
-                discarded += 1
+        x,y,i,j = self.decode()
+        self.remapping = self.reduce(x, y, i, j, reduction)
+        logger.debug('Found mappings for %d pixels.', len(self.remapping))
+        return self.remapping
+
+class MultiDetector(Detector):
+    """
+    Probes several projectors at once: all projectors' pixels flicker codes
+    from one shared code (see code.MultiCodeImageIterator), and sightings are
+    assigned to projectors by their code words.
+    """
 
-        for pixel in tempMapping:
-            pixx = numpy.median([i for i,j in tempMapping[pixel]])
-            pixy = numpy.median([j for i,j in tempMapping[pixel]])
-            self.remapping[pixx,pixy] = pixel
+    def __init__(self, camera, screenSize, projectors, stepsize, **kwargs):
+        """
+        projectors -- list of tuples (name, size, offset) of the projectors 
+            to probe, with size and offset as the projectorSize and 
+            projectorOffset parameters of Detector.
+
+        For the other parameters, see Detector.
+        """
+        self.projectors = projectors
+        imageIterator = code.MultiCodeImageIterator(
+            screenSize, [(offset, size) for name,size,offset in projectors], 
+            stepsize, robust=(kwargs.get('decoding') == 'soft')
+        )
+        Detector.__init__(
+            self, camera, screenSize, screenSize, (0,0), stepsize, 
+            imageIterator=imageIterator, **kwargs
+        )
+        # projector name -> remapping of that projector.
+        self.remappings = {}
 
+    def describe(self):
+        return {
+            'type' : 'MultiDetector',
+            'screenSize' : list(self.screenSize),
+            'projectors' : [
+                [name, list(size), list(offset)] 
+                    for name,size,offset in self.projectors
+            ],
+            'stepsize' : self.stepsize,
+            'decoding' : self.decoding,
+            'threshold' : self.threshold,
+            'minConfidence' : self.minConfidence
+        }
+
+    def illuminate(self, brightness):
+        self.projector_image[:] = 0
+        for view in self.imageIterator.views(self.projector_image):
+            view[:] = brightness
+
+    def decode(self):
+        """
+        decode the gathered bitmasks.
+
+        returns arrays of the camera coordinates x,y, screen coordinates i,j
+        and projector indices (into self.projectors) of all pixels with 
+        valid codes.
+        """
+        masks = self.codeMasks()
+        y,x = numpy.nonzero(masks)
+        valid,projector,i,j = self.imageIterator.lookupPixels(
+            masks[y,x].astype(numpy.int64)
+        )
+        x,y = x[valid],y[valid]
+        sizes = numpy.array([size for name,size,offset in self.projectors]).reshape(-1,2)
+        offsets = numpy.array([offset for name,size,offset in self.projectors]).reshape(-1,2)
+        inRange = (i < sizes[projector,0]) & (j < sizes[projector,1])
         logger.debug(
-            'Found mappings for %d pixels. Discarded %d.',
-            len(self.remapping), discarded
+            "%d valid pixels within range, %d out of range, %d invalid.", 
+            inRange.sum(), (~inRange).sum(), (~valid).sum()
         )
+        x,y,projector = x[inRange],y[inRange],projector[inRange]
+        i = i[inRange] + offsets[projector,0]
+        j = j[inRange] + offsets[projector,1]
+        return x,y,i,j,projector
+
+    def postProcess(self, reduction='median'):
+        """
+        like Detector.postProcess, but also stores each projector's mappings 
+        in self.remappings.
+        """
+        x,y,i,j,projector = self.decode()
+        for p,(name,size,offset) in enumerate(self.projectors):
+            mine = projector == p
+            self.remappings[name] = self.reduce(
+                x[mine], y[mine], i[mine], j[mine], reduction
+            )
+            logger.debug(
+                'Found mappings for %d pixels of projector %s.', 
+                len(self.remappings[name]), name
+            )
+        self.remapping = numpy.concatenate(
+            [self.remappings[name] for name,size,offset in self.projectors] +
+            [numpy.zeros(0, dtype=mappingType)]
+        )
+        return self.remapping
+
+def neighbourhood(grid):
+    """
+    returns a boolean grid which is True where grid or any of its eight 
+    neighbours is True.
+    """
+    result = grid.copy()
+    result[1:] |= grid[:-1]
+    result[:-1] |= grid[1:]
+    rows = result.copy()
+    result[:,1:] |= rows[:,:-1]
+    result[:,:-1] |= rows[:,1:]
+    return result
+
+def fitLocator(remapping, projectorOffset, neighbours=8):
+    """
+    fit a model of projector coordinates over camera coordinates to the 
+    given remapping (see RefinementDetector and locate).  The model keeps 
+    the sightings themselves: around each camera pixel, it is an affine 
+    function fitted to the nearest sightings, which stays accurate where 
+    there are few sightings, or where they cover part of the camera only.
+    Sightings by fewer camera pixels than half the median are left out: 
+    most of them are misdecoded.
+
+    returns the model as a dictionary of the sightings and the number of
+    neighbours.
+    """
+    if len(remapping):
+        remapping = remapping[
+            remapping['count'] >= .5 * numpy.median(remapping['count'])
+        ]
+    return {
+        'x' : remapping['x'].tolist(),
+        'y' : remapping['y'].tolist(),
+        'i' : (remapping['i'] - projectorOffset[0]).tolist(),
+        'j' : (remapping['j'] - projectorOffset[1]).tolist(),
+        'neighbours' : neighbours
+    }
+
+def locate(locator, x, y, ridge=1e-3):
+    """
+    returns the projector coordinates (i,j) which the locator (see 
+    fitLocator) predicts at the camera coordinates (x,y): the values at 
+    (x,y) of affine functions fitted to the nearest sightings.  The slopes
+    are regularized by ridge, so the fit is determined if the neighbours 
+    are few or collinear.  Needs scipy.spatial.
+    """
+    import scipy.spatial
+    anchors = numpy.column_stack((locator['x'], locator['y']))
+    targets = numpy.column_stack((locator['i'], locator['j']))
+    points = numpy.column_stack((x, y)).astype(float)
+    if len(points) == 0:
+        return numpy.zeros(0), numpy.zeros(0)
+    k = min(locator['neighbours'], len(anchors))
+    nearest = scipy.spatial.cKDTree(anchors).query(points, k=k)[1].reshape(len(points), k)
+    A = numpy.concatenate((
+        numpy.ones((len(points), k, 1)), anchors[nearest] - points[:,None,:]
+    ), axis=2)
+    AtA = numpy.einsum('nki,nkj->nij', A, A) + ridge * numpy.diag([0., 1., 1.])
+    AtB = numpy.einsum('nki,nkj->nij', A, targets[nearest])
+    coefficients = numpy.linalg.solve(AtA, AtB)
+    return coefficients[:,0,0], coefficients[:,0,1]
+
+class RefinementDetector(Detector):
+    """
+    Probes pixels within some cells of a coarse probe grid (see 
+    AdaptiveDetector).  Pixels at the same position in different cells 
+    flicker the same code word, so the code needs only as many words as 
+    there are pixels in a cell.  Sightings are assigned to cells using a 
+    model of projector coordinates over camera coordinates fitted to the 
+    coarse sightings.
+    """
+
+    def __init__(self, camera, screenSize, projectorSize, projectorOffset, stepsize,
+                 cellsize, pixels, locator, **kwargs):
+        """
+        cellsize -- size of the cells: the stepsize of the coarse grid, a 
+            multiple of stepsize.
+        pixels -- tuple (i,j) of arrays of the (local) projector coordinates
+            of the pixels to probe.  All are multiples of stepsize.
+        locator -- the model of projector coordinates over camera 
+            coordinates, as returned by fitLocator.  It must be accurate to
+            less than half a cell.
+
+        For the other parameters, see Detector.
+        """
+        i = numpy.asarray(pixels[0], dtype=int)
+        j = numpy.asarray(pixels[1], dtype=int)
+        self.cellsize = cellsize
+        self.side = cellsize // stepsize
+        numbers = (i % cellsize) // stepsize + self.side * ((j % cellsize) // stepsize)
+        Detector.__init__(
+            self, camera, screenSize, projectorSize, projectorOffset, stepsize,
+            imageIterator=code.PixelListImageIterator(
+                projectorSize, i, j, numbers, 
+                robust=(kwargs.get('decoding') == 'soft')
+            ),
+            **kwargs
+        )
+        self.probed = numpy.zeros((projectorSize[1], projectorSize[0]), dtype=bool)
+        self.probed[j,i] = True
+        self.locator = locator
+
+    def describe(self):
+        description = Detector.describe(self)
+        description.update(
+            type='RefinementDetector', cellsize=self.cellsize, locator=self.locator
+        )
+        return description
+
+    def decode(self):
+        masks = self.codeMasks()
+        y,x = numpy.nonzero(masks)
+        numbers = self.imageIterator.code.lookup_many(masks[y,x].astype(numpy.int64))
+        valid = (numbers >= 0) & (numbers < self.imageIterator.count)
+        x,y,numbers = x[valid],y[valid],numbers[valid]
+
+        # position within the cell from the code word, cell from the model.
+        di = (numbers % self.side) * self.stepsize
+        dj = (numbers // self.side) * self.stepsize
+        i,j = locate(self.locator, x, y)
+        i = numpy.round((i - di) / float(self.cellsize)).astype(int)
+        j = numpy.round((j - dj) / float(self.cellsize)).astype(int)
+        i = i * self.cellsize + di
+        j = j * self.cellsize + dj
+
+        probed = (i >= 0) & (i < self.projectorSize[0]) & \
+                 (j >= 0) & (j < self.projectorSize[1])
+        probed[probed] = self.probed[j[probed], i[probed]]
+        logger.debug(
+            "%d valid pixels in probed cells, %d elsewhere, %d invalid.", 
+            probed.sum(), (~probed).sum(), (~valid).sum()
+        )
+        return (
+            x[probed], y[probed], 
+            i[probed] + self.projectorOffset[0], j[probed] + self.projectorOffset[1]
+        )
+
+class AdaptiveDetector(object):
+    """
+    Probes a projector coarse to fine: after probing a coarse grid of 
+    pixels, a smooth model (a regressDistortion.GaussianBasis) of camera 
+    coordinates over projector coordinates is fitted to the sightings.  Only
+    grid cells in which the model predicts the probed pixel badly when it
+    is left out of the fit, in which the probed pixel was seen by few 
+    camera pixels, which are on the border of the found cells, or which 
+    border on found pixels but weren't found themselves, are probed again 
+    at the next, finer stepsize, using a RefinementDetector.
+    """
+
+    def __init__(self, camera, screenSize, projectorSize, projectorOffset, 
+                 stepsizes, tolerance=.25, density=.8, basis=None, **kwargs):
+        """
+        stepsizes -- list of stepsizes, from coarse to fine.  Each must be a
+            multiple of the next.
+        tolerance -- a cell is refined if the leave-one-out prediction of 
+            the model for its probed pixel is off by more than tolerance 
+            camera pixels.
+        density -- a cell is refined if its probed pixel was seen by fewer 
+            camera pixels than this fraction of the median over the grid.
+        basis -- the regressDistortion.GaussianBasis of the model.  Defaults
+            to five by five Gaussians over the projection image.
+
+        For the other parameters, see Detector.  Each stepsize is probed 
+        with a detector created with these parameters.
+        """
+        for coarse,fine in zip(stepsizes[:-1], stepsizes[1:]):
+            if coarse % fine != 0:
+                raise ValueError(
+                    "Stepsize %d is not a multiple of stepsize %d." % (coarse, fine)
+                )
+        self.camera = camera
+        self.screenSize = screenSize
+        self.projectorSize = projectorSize
+        self.projectorOffset = projectorOffset
+        self.stepsizes = stepsizes
+        self.tolerance = tolerance
+        self.density = density
+        if basis is None:
+            basis = regressDistortion.GaussianBasis(projectorSize, 5, .2, .1)
+        self.basis = basis
+        self.options = kwargs
+        self.detectors = []
+        self.frameTimings = []
+        self.remapping = numpy.zeros(0, dtype=mappingType)
+
+    def grid(self, stepsize):
+        """ returns the coordinates of the rows and columns of a probe grid """
+        return (
+            numpy.arange(0, self.projectorSize[1], stepsize),
+            numpy.arange(0, self.projectorSize[0], stepsize)
+        )
+
+    def refinement(self, stepsize, candidates, mask):
+        """
+        decide which cells of the probe grid with the given stepsize to 
+        probe at a finer stepsize.
+
+        candidates -- boolean (rows x columns) grid of cells which may be
+            refined.
+        mask -- the camera pixels in which the projector is visible.
+
+        returns a boolean grid of the cells to refine.
+        """
+        rows,cols = self.grid(stepsize)
+        i = self.remapping['i'] - self.projectorOffset[0]
+        j = self.remapping['j'] - self.projectorOffset[1]
+        xy = numpy.column_stack((self.remapping['x'], self.remapping['y']))
+        onGrid = (i % stepsize == 0) & (j % stepsize == 0)
+        found = numpy.zeros(candidates.shape, dtype=bool)
+        cell = j[onGrid] // stepsize, i[onGrid] // stepsize
+        found[cell] = True
+
+        if len(self.remapping) < 2 * len(self.basis):
+            # the model is not supported by the data anywhere.
+            logger.debug(
+                "Stepsize %d: too few pixels found to fit a model; refining "
+                "all %d found cells and their neighbours.", stepsize, found.sum()
+            )
+            return candidates & neighbourhood(found)
+
+        # With about as many basis functions as coarse pixels, the model 
+        # fits each pixel almost exactly if it is part of the fit, so the
+        # pixels are judged by their leave-one-out residuals r / (1 - h), 
+        # h being the leverage of the pixel (the diagonal of the hat 
+        # matrix).
+        A = self.basis.apply(i, j)
+        AtA = numpy.dot(A.T, A)
+        parameters = regressDistortion.solveNormalEquations(AtA, numpy.dot(A.T, xy))
+        leverage = (A * regressDistortion.solveNormalEquations(AtA, A.T).T).sum(axis=1)
+        residuals = numpy.hypot(*(numpy.dot(A, parameters) - xy).T) / \
+            numpy.maximum(1 - leverage, 1e-6)
+
+        looResiduals = numpy.zeros(candidates.shape)
+        sightings = numpy.zeros(candidates.shape)
+        looResiduals[cell] = residuals[onGrid]
+        sightings[cell] = self.remapping['count'][onGrid]
+
+        # cells which weren't found, but should have been visible.
+        gridj,gridi = numpy.broadcast_arrays(rows[:,None], cols[None,:])
+        predicted = numpy.dot(
+            self.basis.apply(gridi.ravel(), gridj.ravel()), parameters
+        )
+        x = numpy.round(predicted[:,0]).reshape(found.shape)
+        y = numpy.round(predicted[:,1]).reshape(found.shape)
+        visible = (x >= 0) & (x < mask.shape[1]) & (y >= 0) & (y < mask.shape[0])
+        visible[visible] = mask[y[visible].astype(int), x[visible].astype(int)]
+        missing = ~found & visible & neighbourhood(found)
+        # found cells next to cells without sightings, or at the edge of the
+        # projection image: beyond their probed pixel, the model is 
+        # extrapolated.
+        border = found & neighbourhood(
+            numpy.pad(~found, 1, 'constant', constant_values=True)
+        )[1:-1,1:-1]
+
+        badFit = found & (looResiduals > self.tolerance)
+        sparse = found & (sightings < self.density * numpy.median(sightings[found]))
+        logger.debug(
+            "Stepsize %d: %d cells fit badly, %d are seen by few camera "
+            "pixels, %d are on the border, %d are missing.", stepsize, 
+            (badFit & candidates).sum(), (sparse & candidates).sum(), 
+            (border & candidates).sum(), (missing & candidates).sum()
+        )
+        return candidates & (badFit | sparse | border | missing)
+
+    def detect(self):
+        """
+        probe the projector at all stepsizes, refining only where necessary.
+        """
+        probed = numpy.zeros(
+            (self.projectorSize[1], self.projectorSize[0]), dtype=bool
+        )
+        refine = None
+        for level,stepsize in enumerate(self.stepsizes):
+            rows,cols = self.grid(stepsize)
+            if level == 0:
+                candidates = numpy.ones((len(rows), len(cols)), dtype=bool)
+                detector = Detector(camera=self.camera,
+                                    screenSize=self.screenSize,
+                                    projectorSize=self.projectorSize,
+                                    projectorOffset=self.projectorOffset,
+                                    stepsize=stepsize,
+                                    **self.options)
+                detector.detect()
+            else:
+                cellsize = self.stepsizes[level - 1]
+                candidates = refine[
+                    (rows // cellsize)[:,None], (cols // cellsize)[None,:]
+                ]
+                new = candidates & ~probed[rows[:,None], cols[None,:]]
+                if not new.any():
+                    break
+                r,c = numpy.nonzero(new)
+                logger.info(
+                    "Refining %d pixels at stepsize %d.", len(r), stepsize
+                )
+                detector = RefinementDetector(
+                    camera=self.camera,
+                    screenSize=self.screenSize,
+                    projectorSize=self.projectorSize,
+                    projectorOffset=self.projectorOffset,
+                    stepsize=stepsize,
+                    cellsize=cellsize,
+                    pixels=(cols[c], rows[r]),
+                    locator=fitLocator(self.remapping, self.projectorOffset),
+                    **self.options
+                )
+                detector.detect(self.detectors[0].baselines)
+            probed[rows[:,None], cols[None,:]] |= candidates
+
+            self.detectors.append(detector)
+            self.frameTimings.extend(detector.frameTimings)
+            self.remapping = numpy.concatenate(
+                (self.remapping, detector.remapping)
+            )
+            if level == 0 and not detector.mask.any():
+                break
+            if level + 1 < len(self.stepsizes):
+                refine = self.refinement(
+                    stepsize, candidates, self.detectors[0].mask
+                )
+        return self.remapping
+
+def sightingsArray(remapping, angles):
+    """
+    returns an (N x 6) array with rows (x,y,i,j,yaw,verg) from the given 
+    remapping (see mappingType) and the nominal camera angles of its shot.
+    """
+    sightings = numpy.empty((len(remapping), 6))
+    for column,field in enumerate(('x', 'y', 'i', 'j')):
+        sightings[:,column] = remapping[field]
+    sightings[:,4:6] = angles
+    return sightings
+
+def detectorOptions(config):
+    """ returns keyword arguments for Detector as configured in config. """
+    settle = config['detection'].get('settle', {})
+    return dict(
+        pipelined=config['detection'].get('pipelined', True),
+        settleTolerance=settle.get('tolerance'),
+        settleFraction=settle.get('fraction', .001),
+        minSettleTime=settle.get('minwait', 30),
+        maxSettleTime=settle.get('maxwait', 500),
+        decoding=config['detection'].get('decoding', 'hard'),
+        threshold=config['detection'].get('threshold', .1),
+        minConfidence=config['detection'].get('minconfidence', .5)
+    )
+
+def detectorFromDescription(description, **kwargs):
+    """
+    returns a new detector as described by description (see 
+    Detector.describe).  kwargs are passed on to the detector's constructor.
+    """
+    for key in ('decoding', 'threshold', 'minConfidence'):
+        if key in description:
+            kwargs.setdefault(key, description[key])
+    if description['type'] == 'MultiDetector':
+        return MultiDetector(
+            screenSize=tuple(description['screenSize']),
+            projectors=[
+                (name, tuple(size), tuple(offset)) 
+                    for name,size,offset in description['projectors']
+            ],
+            stepsize=description['stepsize'],
+            **kwargs
+        )
+    if description['type'] == 'RefinementDetector':
+        return RefinementDetector(
+            screenSize=tuple(description['screenSize']),
+            projectorSize=tuple(description['projectorSize']),
+            projectorOffset=tuple(description['projectorOffset']),
+            stepsize=description['stepsize'],
+            cellsize=description['cellsize'],
+            pixels=description['pixels'],
+            locator=description['locator'],
+            **kwargs
+        )
+    if 'pixels' in description:
+        kwargs['imageIterator'] = code.PixelListImageIterator(
+            tuple(description['projectorSize']), *description['pixels']
+        )
+    return Detector(
+        screenSize=tuple(description['screenSize']),
+        projectorSize=tuple(description['projectorSize']),
+        projectorOffset=tuple(description['projectorOffset']),
+        stepsize=description['stepsize'],
+        **kwargs
+    )
+
+def replaySession(path):
+    """
+    decode a session recorded with session.SessionRecorder again, without
+    camera or display.
+
+    returns the same as detectShots.
+    """
+    start = time.time()
+    data = []
+    statistics = {'frames' : 0, 'snapshots' : 0}
+    angles = None
+    detector = detectorAngles = None
+    def finish(detector, angles):
+        if detector is not None and detector.mask.any():
+            detector.postProcess()
+            data.append(sightingsArray(detector.remapping, angles))
+
+    for metadata,image in session.readSession(path):
+        kind = metadata.pop('kind')
+        if kind == 'shot':
+            angles = metadata['angles']
+        elif kind == 'detector':
+            finish(detector, detectorAngles)
+            detector = detectorFromDescription(metadata, camera=None)
+            detectorAngles = angles
+        elif kind == 'dark':
+            dark = image
+        elif kind == 'bright':
+            detector.setBaselines(dark, image)
+        elif kind == 'frame':
+            detector.handleImage(metadata['step'], image)
+            statistics['frames'] += 1
+            statistics['snapshots'] += 1
+    finish(detector, detectorAngles)
+
+    statistics['time'] = time.time() - start
+    data = numpy.concatenate(data) if data else numpy.zeros((0,6))
+    return data, statistics
+
+def detectShots(config, camera, display, recorder=None, store=None):
+    """
+    run detection for all shots and projectors listed in config.
+
+    camera -- camera object as for Detector, which also has a method 
+        rotateTo(angles).
+    display -- display object as for Detector.
+    recorder -- optional session.SessionRecorder to record the session to.
+    store -- optional store.DetectionStore to write the sightings of each 
+        shot and projector to as soon as they are detected.  Shots and 
+        projectors already in the store are skipped, so an interrupted run
+        can be resumed.
+
+    returns an (N x 6) array of all sightings (see sightingsArray) -- or None
+    if a store is given -- and a dictionary of statistics (numbers of frames 
+    and snapshots, time taken).
+    """
+    start = time.time()
+    stepsize = config['detection']['stepsize']
+    simultaneous = config['detection'].get('simultaneous', False)
+    adaptive = config['detection'].get('adaptive', {})
+    if simultaneous and adaptive.get('enabled', False):
+        logger.warning("Adaptive detection is not available in simultaneous mode.")
+    screenSize = config['screen']['width'],config['screen']['height']
+    options = detectorOptions(config)
+    options.update(display=display, recorder=recorder)
+
+    def projectorGeometry(projector):
+        projectorConfig = config['projectors'][projector]
+        projectorSize = projectorConfig['width'],projectorConfig['height']
+        projectorOffset = projectorConfig['iOffset'],projectorConfig['jOffset']
+        return projectorSize, projectorOffset
+
+    data = []
+    statistics = {'frames' : 0, 'snapshots' : 0}
+    def collect(number, projector, remapping, angles):
+        sightings = sightingsArray(remapping, angles)
+        if store is not None:
+            store.write(number, projector, sightings)
+        else:
+            data.append(sightings)
+
+    def count(detector):
+        statistics['frames'] += len(detector.frameTimings)
+        statistics['snapshots'] += sum(
+            timing['snapshots'] for timing in detector.frameTimings
+        )
+
+    for number,shot in enumerate(config['detection']['shots']):
+        projectors = []
+        for projector in shot['projectors']:
+            if projector not in projectors:
+                if store is None or not store.has(number, projector):
+                    projectors.append(projector)
+        if not projectors:
+            logger.info("Shot %d is already in the store.", number)
+            continue
+
+        camera.rotateTo(shot['angles'])
+        if recorder is not None:
+            recorder.record('shot', angles=list(shot['angles']))
+        if simultaneous:
+            detector = MultiDetector(camera=camera,
+                                     screenSize=screenSize,
+                                     projectors=[
+                                         (projector,) + projectorGeometry(projector)
+                                             for projector in projectors
+                                     ],
+                                     stepsize=stepsize,
+                                     **options)
+            detector.detect()
+            count(detector)
+            for projector in projectors:
+                remapping = detector.remappings.get(
+                    projector, numpy.zeros(0, dtype=mappingType)
+                )
+                collect(number, projector, remapping, shot['angles'])
+            continue
+
+        for projector in projectors:
+            projectorSize,projectorOffset = projectorGeometry(projector)
+            if adaptive.get('enabled', False):
+                detector = AdaptiveDetector(
+                    camera=camera,
+                    screenSize=screenSize,
+                    projectorSize=projectorSize,
+                    projectorOffset=projectorOffset,
+                    stepsizes=adaptive['stepsizes'],
+                    tolerance=adaptive.get('tolerance', .25),
+                    density=adaptive.get('density', .8),
+                    basis=regressDistortion.basisFromConfig(
+                        adaptive, projectorSize
+                    ),
+                    **options
+                )
+            else:
+                detector = Detector(camera=camera, 
+                                    screenSize=screenSize, 
+                                    projectorSize=projectorSize, 
+                                    projectorOffset=projectorOffset, 
+                                    stepsize=stepsize,
+                                    **options)
+            detector.detect()
+            count(detector)
+            collect(number, projector, detector.remapping, shot['angles'])
+
+    statistics['time'] = time.time() - start
+    if store is not None:
+        return None, statistics
+    data = numpy.concatenate(data) if data else numpy.zeros((0,6))
+    return data, statistics
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -165,40 +1143,51 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', dest = 'config', default = 'config.yaml')
+    parser.add_argument('-r', dest = 'record', default = None,
+                        help = 'directory to record the session to')
+    parser.add_argument('--replay', dest = 'replay', default = None,
+                        help = 'decode a recorded session instead of capturing')
+    parser.add_argument('-o', dest = 'output', default = 'distortion.npz',
+                        help = 'output file, or a directory to write the '
+                               'output to incrementally (and resume from)')
     args = parser.parse_args()
 
     import yaml
     config = yaml.load(open(args.config))
-    stepsize = config['detection']['stepsize']
     screenSize = config['screen']['width'],config['screen']['height']
-    cameraSize = config['camera']['width'], config['camera']['height']
-    cam = instarCamera.instarCamera()
 
-    blank_image = numpy.zeros((screenSize[1], screenSize[0]), dtype=numpy.float)
-    cv.NamedWindow(windowtitle,cv.CV_WINDOW_NORMAL)
-    cv.ResizeWindow(windowtitle,screenSize[0],screenSize[1])
-    cv.SetWindowProperty(windowtitle, 0, cv.CV_WINDOW_FULLSCREEN)
-    cv2.imshow(windowtitle, blank_image)
-    cv2.waitKey(50)
+    detectionStore = None
+    if not args.output.endswith('.npz'):
+        if args.replay:
+            parser.error("Replayed sessions can only be written to .npz files.")
+        detectionStore = store.DetectionStore(args.output, config)
+        config = detectionStore.config
+        logger.info("%d chunks missing in %s.", len(detectionStore.missing()), args.output)
 
-    data = []
-    for shot in config['detection']['shots']:
-        cam.rotateTo(shot['angles'])
-        for projector in shot['projectors']:
-            projectorConfig = config['projectors'][projector]
-            projectorSize = projectorConfig['width'],projectorConfig['height']
-            projectorOffset = projectorConfig['iOffset'],projectorConfig['jOffset']
-            detector = Detector(camera=cam, 
-                                screenSize=screenSize, 
-                                projectorSize=projectorSize, 
-                                projectorOffset=projectorOffset, 
-                                stepsize=stepsize)
-            detector.detect()
+    if args.replay:
+        config = session.readConfig(args.replay)
+        data,statistics = replaySession(args.replay)
+    else:
+        import instarCamera
+        cam = instarCamera.instarCamera()
+
+        blank_image = numpy.zeros((screenSize[1], screenSize[0]), dtype=numpy.float)
+        display = Display(screenSize)
+        display.open()
+        display.show(blank_image)
+        display.wait(50)
 
-            for x,y in detector.remapping:
-                i,j = detector.remapping[x,y]
-                data.append((x,y,i,j) + tuple(shot['angles']))
+        recorder = None
+        if args.record:
+            recorder = session.SessionRecorder(args.record, config)
+        try:
+            data,statistics = detectShots(config, cam, display, recorder, detectionStore)
+        finally:
+            if recorder is not None:
+                recorder.close()
 
-    outfilename = 'distortion.npz'
-    logger.info("Done.  Writing data to %s.", outfilename)
-    numpy.savez(outfilename, data=data, config=yaml.dump(config))
+    if detectionStore is not None:
+        logger.info("Done.  Data is in %s.", args.output)
+    else:
+        logger.info("Done.  Writing data to %s.", args.output)
+        numpy.savez(args.output, data=data, config=yaml.dump(config))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# ####################################################################
+#  Copyright (C) 2013-2014 by Johannes Bauer, The University of 
+#  Hamburg
+#  http://www.tatome.de
+#  This file is part of the projection correction project.
+#
+#  This is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as 
+#  published by the Free Software Foundation; either  version 2 
+#  of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public  License 
+#  along with this file; if not, write to the
+#  Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+# ####################################################################
+
+import numpy
+
+class Groups(object):
+    """
+    Groups the elements of one or more equally long key arrays by equal keys
+    by sorting them once, so that per-group reductions of value arrays can be
+    computed with a few array operations instead of a Python loop over 
+    groups.
+    """
+    def __init__(self, *keys):
+        """
+        keys -- one or more 1D arrays of equal length.  Elements with equal 
+            entries in all key arrays form one group.  Groups are ordered
+            lexicographically by their keys, the first array being the 
+            primary key.
+        """
+        keys = [numpy.asarray(k) for k in keys]
+        self.size = len(keys[0])
+        self.order = numpy.lexsort(keys[::-1])
+        sortedKeys = [k[self.order] for k in keys]
+        boundaries = numpy.zeros(self.size, dtype=bool)
+        boundaries[:1] = True
+        for k in sortedKeys:
+            boundaries[1:] |= k[1:] != k[:-1]
+        self.starts = numpy.nonzero(boundaries)[0]
+        self.counts = numpy.diff(numpy.append(self.starts, self.size))
+        self.keys = tuple(k[self.starts] for k in sortedKeys)
+        # group index of every element, in sorted order:
+        self.sortedGroup = numpy.cumsum(boundaries) - 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def inverse(self):
+        """ returns the group index of every element, in original order. """
+        inverse = numpy.empty(self.size, dtype=int)
+        inverse[self.order] = self.sortedGroup
+        return inverse
+
+    def sort(self, values):
+        """ returns values sorted such that groups are contiguous. """
+        return numpy.asarray(values)[self.order]
+
+    def split(self, values):
+        """ 
+        returns a list with the values in each group.  The list items are
+        views of one sorted copy of values.
+        """
+        return numpy.split(self.sort(values), self.starts[1:])
+
+    def sum(self, values):
+        if self.size == 0:
+            return numpy.zeros((0,) + numpy.shape(values)[1:])
+        return numpy.add.reduceat(self.sort(values), self.starts, axis=0)
+
+    def mean(self, values):
+        s = self.sum(values)
+        return s / self.counts.reshape((-1,) + (1,) * (s.ndim - 1))
+
+    def median(self, values):
+        """ returns the median of the 1D array values within each group. """
+        values = numpy.asarray(values)
+        within = values[self.order][
+            numpy.lexsort((values[self.order], self.sortedGroup))
+        ]
+        lower = within[self.starts + (self.counts - 1) // 2]
+        upper = within[self.starts + self.counts // 2]
+        return (lower + upper) / 2.
@@ -25,25 +25,174 @@
 
 import struct
 import numpy
+import logging
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-i', dest='infile', required=True)
-parser.add_argument('-o', dest='outfile', required=True)
-args = parser.parse_args()
+logger = logging.getLogger(__name__)
 
-data = numpy.load(args.infile)
-tables = data['tables']
-ioffset,joffset = data['offsets']
+# Compact files start with this magic, which cannot be mistaken for the
+# table width that starts a legacy file.
+MAGIC = b'PTBL'
+VERSION = 1
 
-with open(args.outfile, 'wb') as outfile:
+# Encodings of the table samples.  Fixed-point samples store
+# (value - offset) / scale as unsigned 16 bit integers, with offset and
+# scale recorded per table in the header.
+encodings = {
+    'float64' : (0, numpy.float64),
+    'float32' : (1, numpy.float32),
+    'float16' : (2, numpy.float16),
+    'fixed16' : (3, numpy.uint16),
+}
+
+# Interpolation the reader has to use to get from the sampled table back to
+# the full one.
+INTERPOLATION_NONE = 0
+INTERPOLATION_BILINEAR = 1
+
+def samplePositions(length, step):
+    """
+    Positions along one axis at which a table downsampled by step is sampled:
+    every step pixels from the first pixel up to the first position at or 
+    beyond the last pixel.  The samples are thus uniformly spaced, as 
+    texture filtering assumes (pixel x is at sample x / step), and 
+    interpolation never has to extrapolate.
+    """
+    count = int(numpy.ceil((length - 1) / float(step))) + 1 if length > 1 else 1
+    return numpy.arange(count) * step
+
+def interpolationMatrix(length, step):
+    """
+    Linear interpolation weights (length x samples) from the sample positions
+    along one axis to every pixel along that axis.
+    """
+    count = len(samplePositions(length, step))
+    matrix = numpy.zeros((length, count))
+    if count == 1:
+        matrix[:,0] = 1.0
+        return matrix
+    pixels = numpy.arange(length)
+    lower = numpy.minimum(pixels // step, count - 2)
+    fraction = (pixels - lower * step) / float(step)
+    matrix[pixels, lower] = 1.0 - fraction
+    matrix[pixels, lower + 1] += fraction
+    return matrix
+
+def sampleAxis(table, step, axis):
+    """
+    Samples a table every step pixels along one axis (see samplePositions).
+    A last sample beyond the table pads it such that interpolating between 
+    that sample and the one before yields the value at the last pixel.
+    """
+    length = table.shape[axis]
+    positions = samplePositions(length, step)
+    if positions[-1] == length - 1:
+        return numpy.take(table, positions, axis=axis)
+    before = numpy.take(table, positions[-2:-1], axis=axis)
+    last = numpy.take(table, [length - 1], axis=axis)
+    padding = before + (last - before) * step / float(length - 1 - positions[-2])
+    return numpy.concatenate(
+        (numpy.take(table, positions[:-1], axis=axis), padding), axis=axis
+    )
+
+def downsample(table, step):
+    """Samples a single (width x height) table every step pixels."""
+    return sampleAxis(sampleAxis(table, step, 0), step, 1)
+
+def upsample(samples, width, height, step):
+    """Bilinearly interpolates sampled values back to (width x height)."""
+    return interpolationMatrix(width, step).dot(samples).dot(
+        interpolationMatrix(height, step).T)
+
+def quantize(samples, encoding):
+    """
+    Encodes samples as the given encoding.  Returns the encoded array and the
+    offset and scale needed to decode it again.
+    """
+    dtype = encodings[encoding][1]
+    if encoding != 'fixed16':
+        return samples.astype(dtype), 0.0, 1.0
+    offset = float(samples.min())
+    scale = (float(samples.max()) - offset) / numpy.iinfo(dtype).max
+    if scale == 0:
+        scale = 1.0
+    encoded = numpy.round((samples - offset) / scale).astype(dtype)
+    return encoded, offset, scale
+
+def dequantize(encoded, offset, scale):
+    return encoded.astype(numpy.float64) * scale + offset
+
+def compact(table, encoding, step):
+    """
+    Encodes a single table.  Returns the encoded samples, their offset and
+    scale, and the worst-case absolute error of the table the reader will
+    reconstruct from them against the full table.
+    """
+    encoded, offset, scale = quantize(downsample(table, step), encoding)
+    reconstructed = upsample(dequantize(encoded, offset, scale),
+                             table.shape[0], table.shape[1], step)
+    error = numpy.abs(reconstructed - table).max()
+    return encoded, offset, scale, error
+
+def writeLegacy(outfile, tables, ioffset, joffset):
+    """Writes both tables as native float64 in the original format."""
     outfile.write(struct.pack(
         '=iiii', tables.shape[0], tables.shape[1], ioffset, joffset)
     )
+    numpy.ascontiguousarray(tables[:,:,0], numpy.float64).tofile(outfile)
+    numpy.ascontiguousarray(tables[:,:,1], numpy.float64).tofile(outfile)
+
+def writeCompact(outfile, tables, ioffset, joffset, encoding, step):
+    """
+    Writes both tables in the compact format: magic, version, full width and
+    height, offsets, encoding, step, interpolation, sampled width and
+    height, then offset, scale and worst-case error of either table,
+    followed by the sampled tables in native byte order (see 
+    samplePositions).  Returns the worst-case errors.
+    """
+    width, height = tables.shape[:2]
+    compacted = [compact(tables[:,:,k], encoding, step) for k in range(2)]
+    samples = compacted[0][0]
+    interpolation = INTERPOLATION_BILINEAR if step > 1 else INTERPOLATION_NONE
+
+    outfile.write(MAGIC)
+    outfile.write(struct.pack('=iiiiiiiiii',
+        VERSION, width, height, ioffset, joffset, encodings[encoding][0],
+        step, interpolation, samples.shape[0], samples.shape[1]))
+    for _, offset, scale, error in compacted:
+        outfile.write(struct.pack('=ddd', offset, scale, error))
+    for encoded, _, _, _ in compacted:
+        numpy.ascontiguousarray(encoded).tofile(outfile)
+    return [error for _, _, _, error in compacted]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', dest='infile', required=True)
+    parser.add_argument('-o', dest='outfile', required=True)
+    parser.add_argument('-e', '--encoding', dest='encoding',
+        choices=sorted(encodings), default=None,
+        help='write the compact format with samples in this encoding '
+             '(default: the original float64 format)')
+    parser.add_argument('-d', '--downsample', dest='step', type=int, default=1,
+        help='keep only every STEP-th pixel of the tables along either axis; '
+             'the reader interpolates bilinearly in between')
+    args = parser.parse_args()
+    if args.step < 1:
+        parser.error('downsampling step must be positive')
+
+    logging.basicConfig(level=logging.INFO)
+
+    data = numpy.load(args.infile)
+    tables = data['tables']
+    ioffset,joffset = data['offsets']
 
-    linefmt = '=' + ('d' * tables.shape[1])
     print(tables.shape)
-    for line in tables[:,:,0]:
-        outfile.write(struct.pack(linefmt, *line))
-    for line in tables[:,:,1]:
-        outfile.write(struct.pack(linefmt, *line))
+    with open(args.outfile, 'wb') as outfile:
+        if args.encoding is None and args.step == 1:
+            writeLegacy(outfile, tables, ioffset, joffset)
+        else:
+            errors = writeCompact(outfile, tables, ioffset, joffset,
+                                  args.encoding or 'float64', args.step)
+            logger.info('%s: worst-case error against the full table: '
+                        'yaw %g, vergence %g (texture units)',
+                        args.outfile, errors[0], errors[1])
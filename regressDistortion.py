@@ -23,210 +23,1260 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 # ####################################################################
 
+import math
 import random
 import numpy
 import time
 import logging
 import argparse
 import yaml
-import csv
 import itertools
-import collections
 
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s')
+import grouping
+import store
 
 logger = logging.getLogger(__name__)
 
-parser = argparse.ArgumentParser("Generates a lookup table for distortion correction.")
-parser.add_argument('-i', dest='infilename', type=str, required=True)
-parser.add_argument('-n', dest='numpyOutfilename', type=str, required=True)
-args = parser.parse_args()
+### Want to approximate a function which maps each point on the screen to 
+### angles from the camera using a linear combination of 2D Gaussians 
+### and a constant.
 
-config = yaml.load(open('config.yaml'))
-iOffset = config['projectors'][args.infilename]['iOffset']
-jOffset = config['projectors'][args.infilename]['jOffset']
+class GaussianBasis(object):
+    """
+    A set of 2D Gaussians on a regular grid over the projection image, plus 
+    a constant.
+    """
+    sparse = False
 
-projectionImageSize = (
-    config['projectors'][args.infilename]['width'], 
-    config['projectors'][args.infilename]['height']
-)
+    def __init__(self, projectionImageSize, blobsteps, sigma, blobspread):
+        """
+        projectionImageSize -- size (width,height) of the projection image.
+        blobsteps -- how many 2D Gaussians to use horizontally and vertically.
+        sigma -- how wide to make the 2D Gaussians, relative to the size of
+            the projection image.
+        blobspread -- how far outside of the image to place the outermost 
+            2D Gaussian, relative to the size of the projection image.
+        """
+        self.blobsteps = blobsteps
+        sigma = (
+            sigma*projectionImageSize[0], 
+            sigma*projectionImageSize[1]
+        )
 
-logger.info("loading distortion")
+        # compute center of 2D Gaussians:
+        gaussianCentersHorizontal = numpy.linspace(
+            -blobspread * projectionImageSize[0], 
+            (1 + blobspread) * projectionImageSize[0], 
+            blobsteps
+        )
 
-distortion = None
-with open("correctedDistortion-" + args.infilename + ".csv", "r") as distfile:
-    reader = csv.reader(distfile)
-    distortion = numpy.array([map(float, line) for line in reader], dtype=float)
-    distortion[:,2] -= iOffset
-    distortion[:,3] -= jOffset
-    
-logger.info("Preprocessing")
+        gaussianCentersVertical = numpy.linspace(
+            -blobspread*projectionImageSize[1], 
+            (1 + blobspread) * projectionImageSize[1], 
+            blobsteps
+        )
 
-# get unique ij -> xy mappings
-pointsToX = collections.defaultdict(list)
-pointsToY = collections.defaultdict(list)
-for x in distortion:
-    pointsToX[(x[2],x[3])].append(x[0])
-    pointsToY[(x[2],x[3])].append(x[1])
+        self.centers = gaussianCentersHorizontal, gaussianCentersVertical
+        gaussianCenters = numpy.meshgrid(gaussianCentersHorizontal, gaussianCentersVertical)
+        self.gaussianCenters = (
+            gaussianCenters[0].reshape((blobsteps**2,1)),
+            gaussianCenters[1].reshape((blobsteps**2,1))
+        )
+        self.twoSigmaSq = (2*sigma[0]**2), (2*sigma[1]**2)
 
-distortion = numpy.array([
-    (numpy.median(pointsToX[k]),numpy.median(pointsToY[k]), k[0], k[1]) 
-        for k in pointsToX
-])
+    def __len__(self):
+        """ number of basis functions, including the constant. """
+        return self.blobsteps**2 + 1
 
+    def apply(self, i, j):
+        """ Applies basis functions unweighted, doesn't aggregate """
+        idiffs = i-self.gaussianCenters[0]
+        jdiffs = j-self.gaussianCenters[1]
+        g = numpy.exp(-(idiffs**2 / self.twoSigmaSq[0] + jdiffs**2 / self.twoSigmaSq[1])).T
+        if len(g.shape) == 2:
+            p0 = numpy.ones((g.shape[0],1))
+        else:
+            p0 = 1
+        return numpy.concatenate((p0, g), axis=1)
 
-### Want to approximate a function which maps each point on the screen to 
-### angles from the camera using a linear combination of 2D Gaussians 
-### and a constant.
+    def axisSquares(self, i, j):
+        """
+        returns the (N x blobsteps) squared distances of the horizontal 
+        coordinates i and of the vertical coordinates j from the centers of
+        the Gaussians along each axis.  They are the same for all values of
+        sigma (see axisValues).
+        """
+        return tuple(
+            (numpy.asarray(x, dtype=float)[:,None] - centers)**2
+                for x,centers in zip((i, j), self.centers)
+        )
+
+    def axisValues(self, i, j, squares=None):
+        """
+        returns the (N x blobsteps) values of the 1D Gaussians along each 
+        axis at the horizontal coordinates i and at the vertical coordinates
+        j.  The basis functions are their products (see designFromAxes); 
+        keeping these instead of the design matrix saves memory and the 
+        exponentials when fitting to the same points several times.
 
-# how many 2D Gaussians to use to approximate that function:
-blobsteps = config['regression']['blobsteps']
-
-# how wide to make the 2D Gaussians
-sigma = (
-    config['regression']['sigma']*projectionImageSize[0], 
-    config['regression']['sigma']*projectionImageSize[1]
-)
-
-# how far outside of the image to place the outermost 2D Gaussian
-blobspread = config['regression']['blobspread']
-
-# compute center of 2D Gaussians:
-gaussianCentersHorizontal = numpy.linspace(
-    -blobspread * projectionImageSize[0], 
-    (1 + blobspread) * projectionImageSize[0], 
-    blobsteps
-)
-
-gaussianCentersVertical = numpy.linspace(
-    -blobspread*projectionImageSize[1], 
-    (1 + blobspread) * projectionImageSize[1], 
-    blobsteps
-)
-
-gaussianCenters = numpy.meshgrid(gaussianCentersHorizontal, gaussianCentersVertical)
-gaussianCenters = (
-    gaussianCenters[0].reshape((blobsteps**2,1)),
-    gaussianCenters[1].reshape((blobsteps**2,1))
-)
-
-
-### Mashinery to apply basis functions to data
-twoSigmaSq = (2*sigma[0]**2), (2*sigma[1]**2)
-def applyBasisFunctions(i,j):
-    """ Applies basis functions unweighted, doesn't aggregate """
-    idiffs = i-gaussianCenters[0]
-    jdiffs = j-gaussianCenters[1]
-    g = numpy.exp(-(idiffs**2 / twoSigmaSq[0] + jdiffs**2 / twoSigmaSq[1])).T
-    if len(g.shape) == 2:
-        p0 = numpy.ones((g.shape[0],1))
+        squares -- optional squared distances of the coordinates from the 
+            centers (see axisSquares), eg. shared by bases differing only 
+            in sigma.
+        """
+        if squares is None:
+            squares = self.axisSquares(i, j)
+        return tuple(
+            numpy.exp(-square / twoSigmaSq)
+                for square,twoSigmaSq in zip(squares, self.twoSigmaSq)
+        )
+
+    def axesSubset(self, axes, rows):
+        """
+        returns the values of axisValues at some of its points.
+
+        rows -- boolean mask or increasing indices of the points.
+        """
+        return tuple(G[rows] for G in axes)
+
+    def designFromAxes(self, axes, start, stop):
+        """ 
+        returns the rows start to stop of the design matrix (see apply) of
+        the points of axes (see axisValues).
+        """
+        Gi,Gj = axes
+        A = numpy.empty((len(Gi[start:stop]), len(self)))
+        A[:,0] = 1
+        # the Gaussian of vertical center v and horizontal center h is 
+        # column 1 + v * blobsteps + h.
+        A[:,1:] = (Gj[start:stop,:,None] * Gi[start:stop,None,:]).reshape(
+            (len(A), self.blobsteps**2)
+        )
+        return A
+
+    def normalEquationsFromAxes(self, axes, targets, weights=None, chunksize=65536):
+        """
+        returns the normal equations A^T W A and A^T W B of the weighted 
+        least-squares fit of the parameters to the targets B ((N x 2)) at
+        the points of axes (see axisValues), accumulated in chunks.
+        """
+        AtA = numpy.zeros((len(self), len(self)))
+        AtB = numpy.zeros((len(self), 2))
+        accumulateNormalEquations(
+            AtA, AtB, lambda start, stop: self.designFromAxes(axes, start, stop),
+            targets, weights, chunksize
+        )
+        return AtA, AtB
+
+    def valuesFromAxes(self, axes, parameters, chunksize=65536):
+        """
+        returns the (N x 2) values of the models with the given 
+        (len(self) x 2) parameters at the points of axes (see axisValues).
+        """
+        values = numpy.empty((len(axes[0]), 2))
+        for start in range(0, len(axes[0]), chunksize):
+            values[start:start + chunksize] = numpy.dot(
+                self.designFromAxes(axes, start, start + chunksize), parameters
+            )
+        return values
+
+    def grid(self, parameters, i, j, chunksize=256, threads=1):
+        """
+        returns the (len(i) x len(j)) values of the linear model with the 
+        given parameters (see linmodel) at all combinations of horizontal
+        coordinates i and vertical coordinates j.
+
+        The Gaussians are separable: with Gi and Gj the 1D Gaussians along 
+        each axis and W the parameters of the Gaussians on their grid, the 
+        values are Gi^T W^T Gj plus the constant.  W^T Gj is computed once;
+        the product with Gi in chunks of chunksize values of i, by the given 
+        number of threads.
+        """
+        i = numpy.asarray(i, dtype=float)
+        j = numpy.asarray(j, dtype=float)
+        weights = numpy.asarray(parameters[1:]).reshape((self.blobsteps, self.blobsteps))
+        Gj = numpy.exp(-(j - self.centers[1][:,None])**2 / self.twoSigmaSq[1])
+        WGj = numpy.dot(weights.T, Gj)
+
+        def Gi(start, stop):
+            chunk = i[start:stop]
+            return numpy.exp(-(chunk - self.centers[0][:,None])**2 / self.twoSigmaSq[0]).T
+        return gridProduct(Gi, WGj, len(i), chunksize, threads) + parameters[0]
+
+def gridProduct(left, right, length, chunksize=256, threads=1):
+    """
+    returns the product of a (length x n) matrix, given as a function 
+    left(start, stop) of its rows start to stop, with the (n x m) matrix
+    right, computed in chunks of chunksize rows by the given number of 
+    threads.
+    """
+    values = numpy.empty((length, right.shape[1]))
+    def evaluateChunk(start):
+        stop = min(start + chunksize, length)
+        values[start:stop] = numpy.dot(left(start, stop), right)
+    starts = range(0, length, chunksize)
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            pool.map(evaluateChunk, starts)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
     else:
-        p0 = 1
-    return numpy.concatenate((p0, g), axis=1)
+        for start in starts:
+            evaluateChunk(start)
+    return values
+
+class BSplineBasis(object):
+    """
+    Tensor-product uniform cubic B-splines on a regular grid of control 
+    points over the projection image.  Unlike the Gaussians of a 
+    GaussianBasis, each basis function is non-zero only on a 4 x 4 cell 
+    neighbourhood, so every mapping touches 16 of them and the design 
+    matrix is sparse (see design and fitSparse).  The B-splines sum to one
+    everywhere, so there is no separate constant.  Needs scipy.sparse.
+    """
+    sparse = True
+    degree = 3
+
+    def __init__(self, projectionImageSize, blobsteps):
+        """
+        projectionImageSize -- size (width,height) of the projection image.
+        blobsteps -- number of control points horizontally and vertically
+            (at least 4).
+        """
+        if blobsteps <= self.degree:
+            raise ValueError(
+                "B-splines need at least %d control points per axis." % (self.degree + 1)
+            )
+        self.blobsteps = blobsteps
+        # width of the intervals between knots along each axis.
+        self.spacing = tuple(
+            float(size) / (blobsteps - self.degree) for size in projectionImageSize
+        )
+
+    def __len__(self):
+        """ number of basis functions. """
+        return self.blobsteps**2
+
+    def axisWeights(self, coordinates, axis):
+        """
+        returns the (N x 4) indices of the control points along the given 
+        axis whose B-splines are non-zero at the coordinates, and their 
+        values there.
+        """
+        position = numpy.asarray(coordinates, dtype=float) / self.spacing[axis]
+        interval = numpy.clip(
+            numpy.floor(position), 0, self.blobsteps - self.degree - 1
+        ).astype(int)
+        u = position - interval
+        u2 = u * u
+        u3 = u2 * u
+        weights = numpy.empty((len(u), self.degree + 1))
+        weights[:,0] = 1 - 3 * u + 3 * u2 - u3
+        weights[:,1] = 3 * u3 - 6 * u2 + 4
+        weights[:,2] = -3 * u3 + 3 * u2 + 3 * u + 1
+        weights[:,3] = u3
+        weights /= 6.
+        return interval[:,None] + numpy.arange(self.degree + 1), weights
+
+    def axisMatrix(self, coordinates, axis):
+        """ 
+        returns the dense (N x blobsteps) values of the B-splines along one
+        axis at the coordinates. 
+        """
+        indices,weights = self.axisWeights(coordinates, axis)
+        values = numpy.zeros((len(indices), self.blobsteps))
+        values[numpy.arange(len(indices))[:,None], indices] = weights
+        return values
+
+    def design(self, i, j):
+        """
+        returns the sparse (N x len(self)) matrix (scipy.sparse.csr_matrix) 
+        of the values of all basis functions at the points i,j.  The 
+        function of vertical control point v and horizontal control point 
+        h is column v * blobsteps + h.
+        """
+        import scipy.sparse
+        iIndices,iWeights = self.axisWeights(numpy.ravel(i), 0)
+        jIndices,jWeights = self.axisWeights(numpy.ravel(j), 1)
+        columns = jIndices[:,:,None] * self.blobsteps + iIndices[:,None,:]
+        values = jWeights[:,:,None] * iWeights[:,None,:]
+        count = len(iIndices)
+        return scipy.sparse.csr_matrix(
+            (values.ravel(), columns.ravel(), 
+             numpy.arange(0, count * 16 + 1, 16)), 
+            shape=(count, len(self))
+        )
+
+    def cellColumns(self):
+        """
+        returns the columns (see design) of the 16 basis functions non-zero
+        in each cell between knots, cells numbered row by row.
+        """
+        cells = self.blobsteps - self.degree
+        first = numpy.arange(cells**2)
+        corner = (first // cells) * self.blobsteps + first % cells
+        offsets = (numpy.arange(4)[:,None] * self.blobsteps + numpy.arange(4)).ravel()
+        return corner[:,None] + offsets
+
+    def axisValues(self, i, j):
+        """
+        returns the values of the basis functions at the points i,j in a 
+        form for normalEquationsFromAxes and valuesFromAxes, to be reused 
+        for several fits to the same points: the points sorted by the cell
+        between knots they lie in, the bounds of the cells in that order, 
+        and the values of the 16 basis functions non-zero in its cell at 
+        each point.
+        """
+        cells = self.blobsteps - self.degree
+        iIndices,iWeights = self.axisWeights(i, 0)
+        jIndices,jWeights = self.axisWeights(j, 1)
+        cell = jIndices[:,0] * cells + iIndices[:,0]
+        order = numpy.argsort(cell)
+        bounds = numpy.searchsorted(cell[order], numpy.arange(cells**2 + 1))
+        values = (jWeights[order,:,None] * iWeights[order,None,:]).reshape((-1, 16))
+        return order, bounds, values
+
+    def axesSubset(self, axes, rows):
+        """
+        returns the values of axisValues at some of its points, still 
+        sorted by cell.
+
+        rows -- boolean mask or increasing indices of the points.
+        """
+        order,bounds,values = axes
+        selected = numpy.zeros(len(order), dtype=bool)
+        selected[rows] = True
+        # index of each selected point among the selected points.
+        index = numpy.cumsum(selected) - 1
+        keep = selected[order]
+        cell = numpy.repeat(numpy.arange(len(bounds) - 1), numpy.diff(bounds))[keep]
+        return (
+            index[order[keep]], 
+            numpy.searchsorted(cell, numpy.arange(len(bounds))), 
+            values[keep]
+        )
+
+    def normalEquationsFromAxes(self, axes, targets, weights=None):
+        """
+        returns the sparse normal equations A^T W A (scipy.sparse.csr_matrix)
+        and A^T W B ((len(self) x 2) array) of the weighted least-squares fit 
+        of the parameters to the targets B at the points of axes (see 
+        axisValues).  
+
+        All points in a cell touch the same 16 basis functions, so the 16 x
+        16 block of each cell is one matrix product before all blocks are 
+        assembled into A^T W A.
+
+        targets -- (N x 2) array of values at the points.
+        weights -- optional weight of each point.
+        """
+        import scipy.sparse
+        order,bounds,values = axes
+        targets = numpy.asarray(targets, dtype=float)[order]
+        weighted = values if weights is None else \
+            values * numpy.asarray(weights, dtype=float)[order,None]
+        gram = numpy.zeros((len(bounds) - 1, 16, 16))
+        rhs = numpy.zeros((len(bounds) - 1, 16, 2))
+        for c in numpy.flatnonzero(bounds[1:] > bounds[:-1]):
+            mine = slice(bounds[c], bounds[c + 1])
+            gram[c] = numpy.dot(weighted[mine].T, values[mine])
+            rhs[c] = numpy.dot(weighted[mine].T, targets[mine])
+
+        columns = self.cellColumns()
+        AtA = scipy.sparse.coo_matrix((
+            gram.ravel(), 
+            (numpy.repeat(columns, 16, axis=1).ravel(), numpy.tile(columns, 16).ravel())
+        ), shape=(len(self), len(self))).tocsr()
+        AtB = numpy.column_stack([
+            numpy.bincount(columns.ravel(), rhs[:,:,axis].ravel(), minlength=len(self))
+                for axis in (0, 1)
+        ])
+        return AtA, AtB
+
+    def normalEquations(self, distortion, weights=None):
+        """
+        returns the sparse normal equations of the weighted least-squares 
+        fit to the mappings (see normalEquationsFromAxes).
+
+        distortion -- (N x 4) array of mappings (x,y,i,j).
+        weights -- optional weight of each mapping.
+        """
+        return self.normalEquationsFromAxes(
+            self.axisValues(distortion[:,2], distortion[:,3]), 
+            distortion[:,0:2], weights
+        )
+
+    def valuesFromAxes(self, axes, parameters):
+        """
+        returns the (N x 2) values of the models with the given 
+        (len(self) x 2) parameters at the points of axes (see axisValues).
+        """
+        order,bounds,values = axes
+        cell = numpy.repeat(numpy.arange(len(bounds) - 1), numpy.diff(bounds))
+        columns = self.cellColumns()[cell]
+        result = numpy.empty((len(order), 2))
+        for axis in (0, 1):
+            result[order,axis] = (values * parameters[columns,axis]).sum(axis=1)
+        return result
+
+    def apply(self, i, j):
+        """ Applies basis functions unweighted, doesn't aggregate """
+        values = self.design(numpy.atleast_1d(i), numpy.atleast_1d(j)).toarray()
+        return values[0] if numpy.ndim(i) == 0 else values
+
+    def grid(self, parameters, i, j, chunksize=256, threads=1):
+        """
+        returns the (len(i) x len(j)) values of the linear model with the 
+        given parameters at all combinations of horizontal coordinates i 
+        and vertical coordinates j (see GaussianBasis.grid).
+        """
+        weights = numpy.asarray(parameters).reshape((self.blobsteps, self.blobsteps))
+        WBj = numpy.dot(weights.T, self.axisMatrix(j, 1).T)
+        Bi = self.axisMatrix(i, 0)
+        return gridProduct(
+            lambda start, stop: Bi[start:stop], WBj, len(Bi), chunksize, threads
+        )
+
+def basisFromConfig(regressionConfig, projectionImageSize):
+    """ 
+    returns the GaussianBasis, or the BSplineBasis with basis 'bspline', 
+    described by a regression section of the config.
+    """
+    if regressionConfig.get('basis', 'gaussian') == 'bspline':
+        return BSplineBasis(projectionImageSize, regressionConfig['blobsteps'])
+    elif regressionConfig.get('basis', 'gaussian') != 'gaussian':
+        raise ValueError("Unknown basis: %s" % regressionConfig['basis'])
+    return GaussianBasis(
+        projectionImageSize,
+        regressionConfig['blobsteps'],
+        regressionConfig['sigma'],
+        regressionConfig['blobspread']
+    )
 
-def linmodel(parameters):
+def linmodel(parameters, basis):
     """ 
     Creates a function mapping image coordinates to _one_ 
     (vertical or horizontal) angle.
     """
     def model(i,j):
-        d = parameters * applyBasisFunctions(i,j)
+        d = parameters * basis.apply(i,j)
         # sum over last axis (axis 0 if i and j are scalars,
         # axis 1 otherwise)
         return d.sum(axis=len(d.shape)-1)
     return model
 
-# prepare input to least-squares approximation (lstsq):
-# lstsq finds good parameters P to solve A * P = B approximately
-A = applyBasisFunctions(distortion[:,2], distortion[:,3])
-B = distortion[:,0:2]
-
-logger.info("starting regression/outlier removal cycle.")
-iterations = config['regression']['iterations']
-good_entries = numpy.arange(len(distortion))
-for iteration in range(iterations):
-    logger.info("iteration %d of %d", iteration + 1, iterations)
-    logger.info("carrying out linear regression.")
-    logger.info("Number of samples: %d", len(good_entries))
-    samplesize = 200000
-
-    sample = good_entries
-    if len(good_entries) > samplesize:
-        logger.info("Sampling down to %s" % samplesize)
-        # numpy <  1.7.0 doesn't have random.choice and I don't have 
-        # numpy >= 1.7.0
-        sample = numpy.random.permutation(sample)[:samplesize]
-
-    Asmall = A[sample]
-    Bsmall = B[sample]
-    
-    b = numpy.linalg.lstsq(Asmall,Bsmall)[0]
-
-    yawparams = b[:,0]
-    vergparams = b[:,1]
-
-    logger.debug('x parameters: %s', yawparams)
-    logger.debug('y parameters: %s', vergparams)
-
-    # yawmodel and vergmodel are models for the transformation of pixels in 
-    # projector space to angles in camera space.
-    yawmodel = linmodel(yawparams)
-    vergmodel = linmodel(vergparams)
-
-    if iteration < iterations:
-        # calculate error, remove data points which don't fit the model
-        # (possible outliers.)
-        d = distortion[good_entries]
-        absYawError = numpy.abs(yawmodel(d[:,2], d[:,3]) - d[:,0])
-        meanAbsYawError = numpy.mean(absYawError)
-        logger.debug("Yaw error: %f", meanAbsYawError)
-        absVergError = numpy.abs(vergmodel(d[:,2], d[:,3]) - d[:,1])
-        meanAbsVergError = numpy.mean(absVergError)
-        logger.debug("Verg error: %f", meanAbsVergError)
-
-        bad_entries = (2 * meanAbsYawError < absYawError) & \
-                        (2 * meanAbsVergError < absVergError)
-
-        logger.debug("Removing %d entries from data.", bad_entries.sum())
-        good_entries = good_entries[(1-bad_entries).astype(bool)]
+def consolidate(distortion, hits=None):
+    """
+    replace all mappings of the same projection image coordinates by one, 
+    with the median of their values.
+
+    distortion -- (N x 4) array of mappings (x,y,i,j).
+    hits -- number of sightings each mapping stands for.  Defaults to one.
+
+    returns an (M x 4) array of the unique mappings, sorted by i,j, and, for
+    each of them, the number of sightings and the spread (rms distance of 
+    the values of its mappings from their mean).
+    """
+    groups = grouping.Groups(distortion[:,2], distortion[:,3])
+    unique = numpy.column_stack((
+        groups.median(distortion[:,0]), groups.median(distortion[:,1]),
+        groups.keys[0], groups.keys[1]
+    ))
+    counts = groups.counts if hits is None else groups.sum(hits)
+    mean = groups.mean(distortion[:,0:2])
+    meanSquare = groups.mean(numpy.square(distortion[:,0:2]).sum(axis=1))
+    spread = numpy.sqrt(numpy.maximum(
+        meanSquare - numpy.square(mean).sum(axis=1), 0
+    ))
+    return unique, counts, spread
+
+class NormalEquations(object):
+    """
+    The normal equations A^T W A P = A^T W B of the weighted least-squares
+    fit of the parameters P of a basis to the values B of mappings (A being
+    the basis functions applied to the mappings' coordinates), accumulated 
+    over chunks of mappings so that A is never held in memory as a whole.
+    Mappings can be removed again (eg. outliers) by subtracting their part.
+    """
+    def __init__(self, basis, chunksize=65536):
+        """
+        basis -- a GaussianBasis.
+        chunksize -- number of mappings whose basis function values are 
+            computed at a time.
+        """
+        self.basis = basis
+        self.chunksize = chunksize
+        self.AtA = numpy.zeros((len(basis), len(basis)))
+        self.AtB = numpy.zeros((len(basis), 2))
+        self.count = 0
+
+    def __accumulate__(self, distortion, weights, sign, axes=None):
+        def design(start, stop):
+            if axes is not None:
+                return self.basis.designFromAxes(axes, start, stop)
+            return self.basis.apply(distortion[start:stop,2], distortion[start:stop,3])
+        accumulateNormalEquations(
+            self.AtA, self.AtB, design, distortion[:,0:2], weights, 
+            self.chunksize, sign
+        )
+        self.count += int(sign) * len(distortion)
+
+    def add(self, distortion, weights=None, axes=None):
+        """
+        distortion -- (N x 4) array of mappings (x,y,i,j).
+        weights -- optional weight of each mapping.
+        axes -- optional values of the basis at the mappings (see 
+            GaussianBasis.axisValues), if they are known already.
+        """
+        self.__accumulate__(distortion, weights, 1., axes)
+
+    def remove(self, distortion, weights=None):
+        """ remove mappings added before (see add). """
+        self.__accumulate__(distortion, weights, -1.)
+
+    def solve(self):
+        """ returns the (len(basis) x 2) parameters for x and y. """
+        return solveNormalEquations(self.AtA, self.AtB)
+
+def accumulateNormalEquations(AtA, AtB, design, targets, weights=None, 
+        chunksize=65536, sign=1.):
+    """
+    add sign times the normal equations A^T W A and A^T W B of the weighted
+    least-squares fit to the (N x 2) targets B to the arrays AtA and AtB, 
+    computing the design matrix A chunksize rows at a time.
+
+    design -- function design(start, stop) returning the rows start to stop
+        of the design matrix.
+    weights -- optional weight of each row.
+    """
+    for start in range(0, len(targets), chunksize):
+        stop = min(start + chunksize, len(targets))
+        A = design(start, stop)
+        weighted = A if weights is None else \
+            A * numpy.asarray(weights[start:stop], dtype=float)[:,None]
+        AtA += sign * numpy.dot(weighted.T, A)
+        AtB += sign * numpy.dot(weighted.T, targets[start:stop])
+
+def solveNormalEquations(AtA, AtB, ridge=1e-12):
+    """
+    solve dense normal equations AtA P = AtB.  AtA is symmetric positive 
+    semi-definite, so it is solved by Cholesky decomposition 
+    (scipy.linalg.cho_solve), falling back to least squares only if AtA is
+    singular.
+
+    ridge -- added to the diagonal, relative to its mean, so that AtA stays
+        positive definite if basis functions are (nearly) linearly 
+        dependent, as wide Gaussians are, or reach no mapping.
+    """
+    import scipy.linalg
+    AtA = AtA + ridge * numpy.mean(numpy.diag(AtA)) * numpy.eye(len(AtA))
+    try:
+        return scipy.linalg.cho_solve(scipy.linalg.cho_factor(AtA), AtB)
+    except numpy.linalg.LinAlgError:
+        logger.debug("Normal equations are singular; solving by least squares.")
+        return numpy.linalg.lstsq(AtA, AtB, rcond=-1)[0]
+
+def evaluate(basis, parameters, i, j, chunksize=65536):
+    """
+    returns the (N x 2) values of the models with the given (len(basis) x 2)
+    parameters at the coordinates i,j, computed chunk by chunk.
+    """
+    values = numpy.empty((len(i), parameters.shape[1]))
+    for start in range(0, len(i), chunksize):
+        stop = start + chunksize
+        values[start:stop] = numpy.dot(
+            basis.apply(i[start:stop], j[start:stop]), parameters
+        )
+    return values
+
+def fit(basis, distortion, iterations, weights=None, chunksize=65536, axes=None):
+    """
+    fit the weights of the basis functions to the data, removing outliers.
+
+    basis -- a GaussianBasis.
+    distortion -- (N x 4) array of unique mappings (x,y,i,j), x,y being the
+        values to approximate at projection image coordinates i,j.
+    iterations -- number of regression/outlier removal cycles.
+    weights -- optional weight of each mapping in the regression, eg. its 
+        number of sightings (see consolidate).
+    chunksize -- number of mappings processed at a time (see 
+        NormalEquations).
+    axes -- optional values of the basis at the mappings (see axisValues),
+        if they are known already.
+
+    returns the parameters of the models for x and y.
+    """
+    if basis.sparse:
+        return fitSparse(basis, distortion, iterations, weights, axes=axes)
+
+    # All mappings go into the normal equations once; outliers found in 
+    # later iterations are subtracted from them again.
+    equations = NormalEquations(basis, chunksize)
+    equations.add(distortion, weights, axes)
+
+    logger.info("starting regression/outlier removal cycle.")
+    good_entries = numpy.arange(len(distortion))
+    for iteration in range(iterations):
+        logger.info("iteration %d of %d", iteration + 1, iterations)
+        logger.info("carrying out linear regression.")
+        logger.info("Number of samples: %d", equations.count)
+
+        parameters = equations.solve()
+        yawparams = parameters[:,0]
+        vergparams = parameters[:,1]
+
+        logger.debug('x parameters: %s', yawparams)
+        logger.debug('y parameters: %s', vergparams)
+
+        if iteration < iterations - 1:
+            # calculate error, remove data points which don't fit the model
+            # (possible outliers.)
+            d = distortion[good_entries]
+            if axes is None:
+                values = evaluate(basis, parameters, d[:,2], d[:,3], chunksize)
+            else:
+                values = basis.valuesFromAxes(
+                    basis.axesSubset(axes, good_entries), parameters, chunksize
+                )
+            absError = numpy.abs(values - d[:,0:2])
+            meanAbsError = absError.mean(axis=0)
+            logger.debug("Yaw error: %f", meanAbsError[0])
+            logger.debug("Verg error: %f", meanAbsError[1])
+
+            bad_entries = (2 * meanAbsError < absError).all(axis=1)
+
+            logger.debug("Removing %d entries from data.", bad_entries.sum())
+            equations.remove(
+                d[bad_entries], 
+                None if weights is None else numpy.asarray(weights)[good_entries[bad_entries]]
+            )
+            good_entries = good_entries[~bad_entries]
+
+    return yawparams, vergparams
+
+def conjugateGradient(A, b, x0=None, tolerance=1e-10):
+    """
+    returns the solution of the sparse symmetric positive (semi-)definite 
+    system A x = b by conjugate gradients (scipy.sparse.linalg.cg) with a 
+    Jacobi preconditioner, starting from x0, and the number of iterations.
+    """
+    import scipy.sparse
+    import scipy.sparse.linalg
+    diagonal = A.diagonal()
+    preconditioner = scipy.sparse.diags(
+        numpy.where(diagonal > 0, 1. / numpy.where(diagonal > 0, diagonal, 1), 1.), 0
+    )
+    iterations = []
+    options = dict(
+        x0=x0, atol=0., maxiter=10 * A.shape[0], M=preconditioner, 
+        callback=lambda xk: iterations.append(1)
+    )
+    try:
+        x,info = scipy.sparse.linalg.cg(A, b, rtol=tolerance, **options)
+    except TypeError:
+        # scipy < 1.12 calls rtol tol.
+        x,info = scipy.sparse.linalg.cg(A, b, tol=tolerance, **options)
+    if info > 0:
+        logger.warn("CG did not converge within %d iterations.", info)
+    return x, len(iterations)
+
+def fitSparse(basis, distortion, iterations, weights=None, tolerance=1e-10, 
+        axes=None):
+    """
+    fit for bases with sparse normal equations (see BSplineBasis): like 
+    fit, but the normal equations are assembled as a sparse matrix and 
+    solved iteratively (conjugateGradient), so time and memory are linear
+    in the number of mappings also for bases with many functions.  Each 
+    iteration starts from the solution of the one before.  Needs 
+    scipy.sparse.
+
+    tolerance -- relative tolerance of the conjugate gradients.
+    axes -- optional values of the basis at the mappings (see axisValues).
+    """
+    if axes is None:
+        axes = basis.axisValues(distortion[:,2], distortion[:,3])
+    AtA,AtB = basis.normalEquationsFromAxes(axes, distortion[:,0:2], weights)
+    parameters = numpy.zeros((len(basis), 2))
+
+    logger.info("starting regression/outlier removal cycle.")
+    good_entries = numpy.arange(len(distortion))
+    for iteration in range(iterations):
+        logger.info("iteration %d of %d", iteration + 1, iterations)
+        logger.info("carrying out sparse linear regression.")
+        logger.info("Number of samples: %d", len(good_entries))
+
+        for axis in (0, 1):
+            parameters[:,axis],steps = conjugateGradient(
+                AtA, AtB[:,axis], parameters[:,axis], tolerance
+            )
+            logger.debug("CG converged in %d steps.", steps)
+        yawparams = parameters[:,0].copy()
+        vergparams = parameters[:,1].copy()
+
+        if iteration < iterations - 1:
+            # calculate error, remove data points which don't fit the model
+            # (possible outliers.)
+            d = distortion[good_entries]
+            absError = numpy.abs(
+                basis.valuesFromAxes(basis.axesSubset(axes, good_entries), parameters) - d[:,0:2]
+            )
+            meanAbsError = absError.mean(axis=0)
+            logger.debug("Yaw error: %f", meanAbsError[0])
+            logger.debug("Verg error: %f", meanAbsError[1])
+
+            bad_entries = (2 * meanAbsError < absError).all(axis=1)
+
+            logger.debug("Removing %d entries from data.", bad_entries.sum())
+            badAtA,badAtB = basis.normalEquations(
+                d[bad_entries], 
+                None if weights is None else numpy.asarray(weights)[good_entries[bad_entries]]
+            )
+            AtA = AtA - badAtA
+            AtB = AtB - badAtB
+            good_entries = good_entries[~bad_entries]
+
+    return yawparams, vergparams
+
+def huberWeights(residuals, k):
+    """ IRLS weights of the Huber estimator for standardized residuals. """
+    return k / numpy.maximum(residuals, k)
+
+def tukeyWeights(residuals, c):
+    """ IRLS weights of Tukey's biweight for standardized residuals. """
+    return numpy.square(numpy.maximum(1 - numpy.square(residuals / c), 0))
+
+# weight functions and their default tuning constants.  The constants of 
+# the one-dimensional estimators (95% efficiency for normal errors) are 
+# scaled by sqrt(2) because they are applied to the length of the 
+# standardized 2D residual (yaw, vergence).
+robustEstimators = {
+    'huber' : (huberWeights, 1.345 * math.sqrt(2)),
+    'tukey' : (tukeyWeights, 4.685 * math.sqrt(2)),
+}
+
+def fitRobust(basis, distortion, estimator='huber', weights=None, 
+        tolerance=1e-3, maxIterations=20, tuning=None, report=None, axes=None):
+    """
+    fit the weights of the basis functions to the data by iteratively 
+    reweighted least squares with a robust estimator, instead of removing
+    outliers by a fixed rule (as fit does).
+
+    Each iteration standardizes the residuals of the last fit by their 
+    median absolute deviation (per axis), weights each mapping by the 
+    estimator's weight of the length of its standardized residual, and 
+    solves the weighted problem, starting from the last solution for sparse
+    bases (conjugateGradient).  The values of the basis functions at the 
+    mappings are computed once (see axisValues).  Iteration stops when the
+    robust weights (between 0 and 1) change by less than tolerance (rms)
+    from one iteration to the next.
+
+    basis -- a GaussianBasis or BSplineBasis.
+    distortion -- (N x 4) array of unique mappings (x,y,i,j).
+    estimator -- 'huber' or 'tukey'.
+    weights -- optional weight of each mapping, multiplied with the robust
+        weights.
+    tolerance -- rms change of the robust weights at which to stop.
+    maxIterations -- maximal number of reweighting iterations.
+    tuning -- tuning constant of the estimator.  Defaults to the one in 
+        robustEstimators.
+    report -- optional list to which a dictionary per iteration is appended:
+        the rms of the weighted residuals, the scale of the residuals, the 
+        number of mappings down-weighted and rejected (weight 0), the 
+        change of the robust weights and the time.
+    axes -- optional values of the basis at the mappings (see axisValues),
+        if they are known already.
+
+    returns the parameters of the models for x and y.
+    """
+    if estimator not in robustEstimators:
+        raise ValueError("Unknown robust estimator: %s" % estimator)
+    weightFunction,defaultTuning = robustEstimators[estimator]
+    tuning = defaultTuning if tuning is None else tuning
+
+    targets = numpy.asarray(distortion[:,0:2], dtype=float)
+    if axes is None:
+        started = time.time()
+        axes = basis.axisValues(distortion[:,2], distortion[:,3])
+        logger.info("Evaluated the basis at %d mappings in %f s.", len(targets), time.time() - started)
+
+    def solve(robustWeights, previous):
+        combined = robustWeights if weights is None else \
+            robustWeights * numpy.asarray(weights, dtype=float)
+        AtA,AtB = basis.normalEquationsFromAxes(axes, targets, combined)
+        if not basis.sparse:
+            return solveNormalEquations(AtA, AtB)
+        return numpy.column_stack([
+            conjugateGradient(AtA, AtB[:,axis], previous[:,axis])[0]
+                for axis in (0, 1)
+        ])
 
+    robustWeights = numpy.ones(len(targets))
+    parameters = solve(robustWeights, numpy.zeros((len(basis), 2)))
+    values = basis.valuesFromAxes(axes, parameters)
+    for iteration in range(maxIterations):
+        started = time.time()
+        residuals = values - targets
+        deviation = numpy.abs(residuals - numpy.median(residuals, axis=0))
+        scale = 1.4826 * numpy.median(deviation, axis=0)
+        scale = numpy.where(scale > 0, scale, 1.)
+        previous = robustWeights
+        robustWeights = weightFunction(
+            numpy.hypot(*(residuals / scale).transpose()), tuning
+        )
+        change = numpy.sqrt(numpy.mean(numpy.square(robustWeights - previous)))
+
+        parameters = solve(robustWeights, parameters)
+        values = basis.valuesFromAxes(axes, parameters)
+
+        rms = numpy.sqrt(
+            numpy.sum(robustWeights[:,None] * numpy.square(values - targets), axis=0) / 
+            max(robustWeights.sum(), 1e-300)
+        )
+        entry = {
+            'iteration' : iteration + 1, 
+            'rms' : rms.tolist(), 'scale' : scale.tolist(),
+            'downweighted' : int((robustWeights < 1).sum()),
+            'rejected' : int((robustWeights == 0).sum()),
+            'change' : float(change), 'time' : time.time() - started
+        }
+        logger.info(
+            "IRLS iteration %d: weighted rms (%f, %f), scale (%f, %f), %d "
+            "down-weighted, %d rejected, change %g, %f s.",
+            entry['iteration'], rms[0], rms[1], scale[0], scale[1], 
+            entry['downweighted'], entry['rejected'], change, entry['time']
+        )
+        if report is not None:
+            report.append(entry)
+        if change < tolerance:
+            break
+    else:
+        logger.warn("IRLS did not converge in %d iterations.", maxIterations)
+
+    return parameters[:,0], parameters[:,1]
 
 # Ultimately, we want to know where in the projected image to put each
 # pixel in a 3D rendered image (a texture in OpenGL).
-def projectorToAngleToTexture(model):
+def projectorToAngleToTexture(model, aperture):
     """
     Returns a function which maps a given position in projector space to a 
     position in the texture to be pre-distorted.
+
+    aperture -- aperture of the OpenGL camera in degrees.
     """
-    aperture = numpy.radians(config['opengl_setup']['aperture'])
-    scale = .5/numpy.tan(.5*aperture)
     def conversion(i,j):
         # determine the angles to which the projector space position is projected
         angles = model(i,j)
         # return the coordinates in source image space corresponding to those angles
-        return numpy.tan(angles) * scale + .5
+        return angleToTexture(angles, aperture)
     return conversion
 
-# Use the linear models generated above to pre-compute lookup tables for
-# later use in OpenGL code.
-indices = numpy.mgrid[0:projectionImageSize[0], 0:projectionImageSize[1]]
-i = indices[0].ravel()
-j = indices[1].ravel()
-logger.info("Calculating horizontal mapping.")
-xmodel = projectorToAngleToTexture(yawmodel)
-xtable = xmodel(i,j).reshape(projectionImageSize)
-logger.debug("Extremal values: %f, %f", xtable.min(), xtable.max())
-
-logger.info("Calculating vertical mapping.")
-ymodel = projectorToAngleToTexture(vergmodel)
-ytable = ymodel(i,j).reshape(projectionImageSize)
-logger.debug("Extremal values: %f, %f", ytable.min(), ytable.max())
-
-# Save our hard work's fruit.
-if args.numpyOutfilename:
-    with open(args.numpyOutfilename, 'wb') as outfile:
-        numpy.savez(outfile, offsets = (iOffset,jOffset), tables = numpy.dstack((xtable,ytable)))
-
-logger.info("Done.")
+def angleToTexture(angles, aperture):
+    """
+    Returns the positions in the texture to be pre-distorted corresponding 
+    to the given angles.
+
+    aperture -- aperture of the OpenGL camera in degrees.
+    """
+    scale = .5/numpy.tan(.5*numpy.radians(aperture))
+    return numpy.tan(angles) * scale + .5
+
+def loadDistortion(config, projector):
+    """
+    returns the consolidated mappings (see consolidate) of the given 
+    projector, with coordinates relative to the projector, and the numbers
+    of sightings and spreads of the mappings.  The combined mapping is 
+    memory-mapped; if there is none, the CSV export is read.
+    """
+    iOffset = config['projectors'][projector]['iOffset']
+    jOffset = config['projectors'][projector]['jOffset']
+
+    logger.info("loading distortion")
+
+    mappingPath = store.mappingPattern(config) % projector
+    hits = None
+    if store.isMapping(mappingPath):
+        header,columns = store.readMapping(mappingPath)
+        distortion = numpy.column_stack([
+            columns[name] for name in ('yaw', 'vergence', 'i', 'j')
+        ]).astype(float)
+        hits = columns['hits']
+    else:
+        # mappings exported as CSV, or written by older versions.
+        distortion = numpy.loadtxt(
+            config['combinedDistortionFilePattern'] % projector, 
+            delimiter=',', ndmin=2
+        )
+    distortion[:,2] -= iOffset
+    distortion[:,3] -= jOffset
+        
+    logger.info("Preprocessing")
+
+    # get unique ij -> xy mappings
+    distortion,counts,spread = consolidate(distortion, hits)
+    logger.info(
+        "%d unique mappings, %d sightings, median spread %f.", 
+        len(distortion), counts.sum(), numpy.median(spread) if len(spread) else 0
+    )
+    return distortion, counts, spread
+
+def weightsFromConfig(regressionConfig, counts):
+    """
+    returns the weights of the mappings chosen by the weighting of a 
+    regression section of the config: None, or the numbers of sightings 
+    counts with weighting 'sightings'.
+    """
+    weighting = regressionConfig.get('weighting', 'none')
+    if weighting == 'sightings':
+        return counts
+    elif weighting != 'none':
+        raise ValueError("Unknown weighting: %s" % weighting)
+    return None
+
+def fitFromConfig(basis, distortion, regressionConfig, weights=None, axes=None):
+    """
+    fit the basis to the mappings as chosen by a regression section of the
+    config: by fitRobust with its robust estimator, or by fit (outlier 
+    removal) with robust 'none', the default for configs without it.
+
+    axes -- optional values of the basis at the mappings (see axisValues).
+
+    returns the parameters of the models for x and y.
+    """
+    robust = regressionConfig.get('robust', 'none')
+    if robust == 'none':
+        return fit(
+            basis, distortion, regressionConfig['iterations'], weights=weights,
+            axes=axes
+        )
+    return fitRobust(
+        basis, distortion, robust, weights, 
+        regressionConfig.get('tolerance', 1e-3), 
+        regressionConfig.get('maxiterations', 20), axes=axes
+    )
+
+def regress(distortion, regressionConfig, projectionImageSize, aperture, 
+        counts=None, threads=1):
+    """
+    fit models of the viewing angles of the pixels of one projector and 
+    compute the lookup tables for OpenGL from them.
+
+    distortion -- (N x 4) array of unique mappings (x,y,i,j), relative to 
+        the projector (see loadDistortion).
+    regressionConfig -- the regression section of the config.
+    projectionImageSize -- size (width,height) of the projector's image.
+    aperture -- aperture of the OpenGL camera in degrees.
+    counts -- number of sightings of each mapping; required for weighting 
+        'sightings'.
+    threads -- threads for computing the lookup tables.
+
+    returns the parameters of the models of yaw and vergence and the 
+    (width x height x 2) lookup tables.
+    """
+    weights = weightsFromConfig(regressionConfig, counts)
+    basis = basisFromConfig(regressionConfig, projectionImageSize)
+    yawparams,vergparams = fitFromConfig(basis, distortion, regressionConfig, weights)
+    # Use the linear models generated above to pre-compute lookup tables for
+    # later use in OpenGL code.
+    i = numpy.arange(projectionImageSize[0])
+    j = numpy.arange(projectionImageSize[1])
+    logger.info("Calculating horizontal mapping.")
+    xtable = angleToTexture(
+        basis.grid(yawparams, i, j, threads=threads), aperture
+    )
+    logger.debug("Extremal values: %f, %f", xtable.min(), xtable.max())
+
+    logger.info("Calculating vertical mapping.")
+    ytable = angleToTexture(
+        basis.grid(vergparams, i, j, threads=threads), aperture
+    )
+    logger.debug("Extremal values: %f, %f", ytable.min(), ytable.max())
+
+    return yawparams, vergparams, numpy.dstack((xtable,ytable))
+
+def regressProjector(config, projector, numpyOutfilename=None, threads=1):
+    """
+    load the combined mapping of a projector, fit its models and compute 
+    its lookup tables, and save them to numpyOutfilename (if given).
+
+    returns the parameters of the models of yaw and vergence and the 
+    lookup tables.
+    """
+    pconfig = config['projectors'][projector]
+    distortion,counts,spread = loadDistortion(config, projector)
+    yawparams,vergparams,tables = regress(
+        distortion, config['regression'], 
+        (pconfig['width'], pconfig['height']), 
+        config['opengl_setup']['aperture'], counts, threads
+    )
+
+    # Save our hard work's fruit.
+    if numpyOutfilename:
+        with open(numpyOutfilename, 'wb') as outfile:
+            numpy.savez(
+                outfile, offsets = (pconfig['iOffset'],pconfig['jOffset']), 
+                tables = tables
+            )
+    return yawparams, vergparams, tables
+
+def regressProjectorToFile(arguments):
+    """ 
+    regressProjector for a Pool: arguments are config, projector, 
+    numpyOutfilename and threads.  Returns only the model parameters. 
+    """
+    config,projector,numpyOutfilename,threads = arguments
+    yawparams,vergparams,tables = regressProjector(
+        config, projector, numpyOutfilename, threads
+    )
+    return yawparams, vergparams
+
+def regressAll(config, numpyOutfilePattern, processes=None, threads=1):
+    """
+    regressProjector for all projectors in the config at once, one process
+    per projector.  The processes memory-map the combined mappings, so the 
+    data is shared rather than copied.
+
+    numpyOutfilePattern -- file name of the lookup tables, with %s for the 
+        projector.
+    processes -- size of the process pool.  Defaults to the number of CPUs.
+
+    returns a dictionary of projectors to the parameters of their models of
+    yaw and vergence.
+    """
+    projectors = sorted(config['projectors'])
+    pool = Pool(processes)
+    try:
+        parameters = pool.map(regressProjectorToFile, [
+            (config, projector, numpyOutfilePattern % projector, threads)
+                for projector in projectors
+        ])
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return dict(zip(projectors, parameters))
+
+def crossValidate(distortion, regressionConfig, projectionImageSize, folds=5, 
+        weights=None, seed=0, squares=None):
+    """
+    k-fold cross-validation of the model described by a regression section
+    of the config: its basis (see basisFromConfig) fit as regress fits it 
+    (see fitFromConfig).  The basis is evaluated at all mappings once; each
+    fold's training and held-out rows are taken from these values (see 
+    axesSubset).  The cost of the model is measured separately, evaluating
+    the basis and fitting it to all mappings and computing the lookup 
+    tables (grid) for the whole projection image.
+
+    distortion -- (N x 4) array of unique mappings (x,y,i,j).
+    folds -- number of folds.
+    weights -- optional weight of each mapping (see weightsFromConfig).
+    seed -- seed of the random assignment of mappings to folds.
+    squares -- optional squared distances of the mappings from the centers
+        of a GaussianBasis (see GaussianBasis.axisSquares), shared by all 
+        values of sigma.
+
+    returns a dictionary of the basis parameters, the rms and median 
+    held-out error (degrees, distance in yaw and vergence), and the times 
+    (seconds) to fit and to compute the lookup tables.
+    """
+    basis = basisFromConfig(regressionConfig, projectionImageSize)
+    fold = numpy.random.RandomState(seed).permutation(len(distortion)) % folds
+
+    started = time.time()
+    if squares is None:
+        axes = basis.axisValues(distortion[:,2], distortion[:,3])
+    else:
+        axes = basis.axisValues(distortion[:,2], distortion[:,3], squares)
+    axesTime = time.time() - started
+
+    errors = numpy.empty(len(distortion))
+    for f in range(folds):
+        training = fold != f
+        heldOut = ~training
+        parameters = numpy.column_stack(fitFromConfig(
+            basis, distortion[training], regressionConfig,
+            None if weights is None else numpy.asarray(weights)[training],
+            basis.axesSubset(axes, training)
+        ))
+        residuals = basis.valuesFromAxes(
+            basis.axesSubset(axes, heldOut), parameters
+        ) - distortion[heldOut,0:2]
+        errors[heldOut] = numpy.hypot(residuals[:,0], residuals[:,1])
+
+    started = time.time()
+    yawparams,vergparams = fitFromConfig(
+        basis, distortion, regressionConfig, weights, axes
+    )
+    fitTime = axesTime + time.time() - started
+    i = numpy.arange(projectionImageSize[0])
+    j = numpy.arange(projectionImageSize[1])
+    started = time.time()
+    basis.grid(yawparams, i, j)
+    basis.grid(vergparams, i, j)
+    tableTime = time.time() - started
+
+    errors = numpy.degrees(errors)
+    result = {
+        'basis' : regressionConfig.get('basis', 'gaussian'),
+        'blobsteps' : regressionConfig['blobsteps'],
+        'blobspread' : None if basis.sparse else regressionConfig['blobspread'],
+        'sigma' : None if basis.sparse else regressionConfig['sigma'],
+        'rms' : float(numpy.sqrt(numpy.mean(errors**2))),
+        'median' : float(numpy.median(errors)),
+        'fit time' : fitTime, 'table time' : tableTime
+    }
+    logger.info(
+        "%s basis, blobsteps %d, blobspread %s, sigma %s: held-out error %f degrees rms.",
+        result['basis'], result['blobsteps'], result['blobspread'], 
+        result['sigma'], result['rms']
+    )
+    return result
+
+sweepData = {}
+
+def initSweep(distortion, weights):
+    sweepData['distortion'] = distortion
+    sweepData['weights'] = weights
+
+def crossValidateTask(arguments):
+    """ 
+    crossValidate for a Pool initialized with initSweep, for all given 
+    sigmas.  The squared distances of the mappings from the centers of the
+    Gaussians are computed once for all of them.
+    """
+    regressionConfig,sigmas,projectionImageSize,folds = arguments
+    distortion = sweepData['distortion']
+    basis = basisFromConfig(dict(regressionConfig, sigma=sigmas[0]), projectionImageSize)
+    squares = None if basis.sparse else \
+        basis.axisSquares(distortion[:,2], distortion[:,3])
+    return [
+        crossValidate(
+            distortion, dict(regressionConfig, sigma=sigma), 
+            projectionImageSize, folds, sweepData['weights'], squares=squares
+        ) for sigma in sigmas
+    ]
+
+def sweep(distortion, regressionConfig, projectionImageSize, blobsteps, 
+        sigmas, blobspreads, folds=5, weights=None, processes=None):
+    """
+    cross-validate the model described by the regression section of the 
+    config with all combinations of the given values of blobsteps, sigma 
+    and blobspread (see crossValidate) in a process pool.  Each process 
+    gets the data once and handles all sigmas of a combination of 
+    blobsteps and blobspread at a time.  Sigma and blobspread are not 
+    swept for B-spline bases, which ignore them.
+
+    returns the results of crossValidate for all combinations, ordered by 
+    held-out rms error.
+    """
+    if basisFromConfig(regressionConfig, projectionImageSize).sparse:
+        sigmas,blobspreads = [regressionConfig.get('sigma')],[regressionConfig.get('blobspread')]
+    tasks = [
+        (dict(regressionConfig, blobsteps=steps, blobspread=spread), sigmas,
+            projectionImageSize, folds)
+            for steps in blobsteps for spread in blobspreads
+    ]
+    pool = Pool(processes, initializer=initSweep, initargs=(distortion, weights))
+    try:
+        results = pool.map(crossValidateTask, tasks)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return sorted(
+        [result for group in results for result in group], 
+        key=lambda result: result['rms']
+    )
+
+def printSweep(results):
+    def optional(value):
+        return '-' if value is None else '%.3f' % value
+    print("%8s %9s %10s %8s %12s %12s %10s %10s" % (
+        'basis', 'blobsteps', 'blobspread', 'sigma', 'rms (deg)', 
+        'median (deg)', 'fit (s)', 'table (s)'
+    ))
+    for result in results:
+        print("%8s %9d %10s %8s %12.4f %12.4f %10.3f %10.4f" % (
+            result['basis'], result['blobsteps'], 
+            optional(result['blobspread']), optional(result['sigma']), 
+            result['rms'], result['median'], result['fit time'], 
+            result['table time']
+        ))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s')
+
+    parser = argparse.ArgumentParser("Generates a lookup table for distortion correction.")
+    parser.add_argument('-c', dest='configfile', type=str, default='config.yaml')
+    parser.add_argument('-i', dest='infilename', type=str, default=None,
+                        help='projector to fit')
+    parser.add_argument('-a', dest='all', action='store_true',
+                        help='fit all projectors in parallel')
+    parser.add_argument('-n', dest='numpyOutfilename', type=str, required=True,
+                        help='output file; with -a, a pattern with %%s for the '
+                             'projector; with --sweep, the report (yaml)')
+    parser.add_argument('-p', dest='processes', type=int, default=None,
+                        help='processes for fitting all projectors (-a) or '
+                             'for the sweep')
+    parser.add_argument('--sweep', dest='sweep', action='store_true',
+                        help='cross-validate combinations of basis parameters '
+                             'for the projector (-i) instead of fitting')
+    parser.add_argument('--blobsteps', dest='blobsteps', type=int, nargs='+',
+                        default=None, help='values of blobsteps to sweep')
+    parser.add_argument('--sigmas', dest='sigmas', type=float, nargs='+',
+                        default=None, help='values of sigma to sweep')
+    parser.add_argument('--blobspreads', dest='blobspreads', type=float, 
+                        nargs='+', default=None, 
+                        help='values of blobspread to sweep')
+    parser.add_argument('--folds', dest='folds', type=int, default=5,
+                        help='folds of the cross-validation')
+    parser.add_argument('-t', dest='threads', type=int, default=1,
+                        help='threads for computing the lookup tables')
+    args = parser.parse_args()
+    if args.all == (args.infilename is not None):
+        parser.error("Give either a projector (-i) or -a.")
+    if args.sweep and args.all:
+        parser.error("Sweep one projector (-i) at a time.")
+
+    config = yaml.load(open(args.configfile))
+
+    if args.sweep:
+        # by default, sweep the values of the regression and lens_regression
+        # sections.
+        sections = [config['regression'], config.get('lens_regression') or {}]
+        def candidates(values, key):
+            if values:
+                return values
+            return sorted(set(section[key] for section in sections if key in section))
+        pconfig = config['projectors'][args.infilename]
+        distortion,counts,spread = loadDistortion(config, args.infilename)
+        results = sweep(
+            distortion, config['regression'], 
+            (pconfig['width'], pconfig['height']), 
+            candidates(args.blobsteps, 'blobsteps'), 
+            candidates(args.sigmas, 'sigma'), 
+            candidates(args.blobspreads, 'blobspread'), 
+            args.folds, weightsFromConfig(config['regression'], counts),
+            args.processes
+        )
+        printSweep(results)
+        with open(args.numpyOutfilename, 'w') as outfile:
+            yaml.dump({'projector' : args.infilename, 'sweep' : results}, outfile)
+    elif args.all:
+        regressAll(config, args.numpyOutfilename, args.processes, args.threads)
+    else:
+        regressProjector(
+            config, args.infilename, args.numpyOutfilename, args.threads
+        )
+
+    logger.info("Done.")
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# ####################################################################
+#  Copyright (C) 2013-2014 by Johannes Bauer, The University of 
+#  Hamburg
+#  http://www.tatome.de
+#  This file is part of the projection correction project.
+#
+#  This is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as 
+#  published by the Free Software Foundation; either  version 2 
+#  of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public  License 
+#  along with this file; if not, write to the
+#  Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+# ####################################################################
+
+
+import os
+import glob
+import threading
+import Queue
+
+import numpy
+import yaml
+
+import logging
+logger = logging.getLogger(__name__)
+
+headerFilename = 'session.yaml'
+chunkPattern = 'chunk-%05d.npz'
+
+class SessionRecorder(object):
+    """
+    Records a capture session (snapshots and what was shown when they were
+    taken) to a directory, so that it can be decoded again later without a
+    camera or display (see detection.replaySession).
+
+    Records are handed to a background thread through a bounded queue and 
+    written in compressed chunks of several snapshots each, so that 
+    recording doesn't hold up capturing.  record() only blocks if the 
+    writer falls behind by more than queueSize records.
+    """
+
+    def __init__(self, path, config=None, chunkSize=32, queueSize=64):
+        """
+        path -- directory to write the session to.  Is created if necessary.
+        config -- configuration to store with the session.
+        chunkSize -- number of snapshots per chunk file.
+        queueSize -- maximal number of records waiting to be written.
+        """
+        self.path = path
+        self.chunkSize = chunkSize
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if glob.glob(os.path.join(path, 'chunk-*.npz')):
+            raise ValueError("There already is a session in %s." % path)
+        with open(os.path.join(path, headerFilename), 'w') as header:
+            yaml.dump({'version' : 1, 'config' : config}, header)
+
+        self.queue = Queue.Queue(queueSize)
+        self.error = None
+        self.chunks = 0
+        self.thread = threading.Thread(target=self.write, name="session recorder")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, kind, image=None, **metadata):
+        """
+        record an event.
+
+        kind -- a string describing the event, eg. 'shot' or 'frame'.
+        image -- optional snapshot taken.
+        metadata -- anything else worth knowing about the event (must be 
+            representable in YAML).
+        """
+        if self.error is not None:
+            raise self.error
+        metadata['kind'] = kind
+        self.queue.put((metadata, image))
+
+    def close(self):
+        """ write all pending records and stop the writer. """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def write(self):
+        records,images = [],[]
+        while True:
+            item = self.queue.get()
+            if item is None or self.error is not None:
+                if item is None:
+                    break
+                continue
+            metadata,image = item
+            if image is not None:
+                metadata['image'] = len(images)
+                images.append(numpy.asarray(image, dtype=numpy.float32))
+            records.append(metadata)
+            if len(images) >= self.chunkSize:
+                self.writeChunk(records, images)
+                records,images = [],[]
+        if records:
+            self.writeChunk(records, images)
+
+    def writeChunk(self, records, images):
+        filename = os.path.join(self.path, chunkPattern % self.chunks)
+        try:
+            # write to a temporary file first, so a crash never leaves a 
+            # partial chunk behind.
+            with open(filename + '.tmp', 'wb') as chunkfile:
+                numpy.savez_compressed(
+                    chunkfile, 
+                    images=numpy.array(images, dtype=numpy.float32),
+                    metadata=yaml.safe_dump(records)
+                )
+                # make sure the data is on disk before the rename is.
+                chunkfile.flush()
+                os.fsync(chunkfile.fileno())
+            os.rename(filename + '.tmp', filename)
+            self.chunks += 1
+        except Exception as e:
+            logger.exception("Could not write %s.", filename)
+            self.error = e
+
+def readConfig(path):
+    """ returns the configuration stored with the session in path. """
+    with open(os.path.join(path, headerFilename)) as header:
+        return yaml.load(header)['config']
+
+def readSession(path):
+    """
+    returns a generator of the records in the session in path, in the order
+    in which they were recorded: tuples (metadata, image), where image is None
+    for records without a snapshot.
+    """
+    for n in range(len(glob.glob(os.path.join(path, 'chunk-*.npz')))):
+        chunk = numpy.load(os.path.join(path, chunkPattern % n))
+        images = chunk['images']
+        for metadata in yaml.safe_load(str(chunk['metadata'])):
+            image = None
+            if 'image' in metadata:
+                image = images[metadata.pop('image')]
+            yield metadata, image
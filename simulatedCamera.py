@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# ####################################################################
+#  Copyright (C) 2013-2014 by Johannes Bauer, The University of 
+#  Hamburg
+#  http://www.tatome.de
+#  This file is part of the projection correction project.
+#
+#  This is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as 
+#  published by the Free Software Foundation; either  version 2 
+#  of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public  License 
+#  along with this file; if not, write to the
+#  Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+# ####################################################################
+
+
+import math
+
+import numpy
+
+import conversion
+
+import logging
+logger = logging.getLogger(__name__)
+
+class SyntheticDistortion(object):
+    """
+    A smooth ground-truth mapping from screen pixels to viewing angles, for 
+    use with SimulatedCamera.
+    """
+    def __init__(self, screenSize, fov=(150., 60.), barrel=0.1, wobble=0.01):
+        """
+        screenSize -- size of the whole projection image : a tuple 
+            (width,height) of ints.
+        fov -- horizontal and vertical angle (in degrees) covered by the 
+            screen.
+        barrel -- strength of the barrel distortion.
+        wobble -- amplitude (in radians) of a sinusoidal distortion.
+        """
+        self.screenSize = screenSize
+        self.fov = numpy.radians(fov)
+        self.barrel = barrel
+        self.wobble = wobble
+
+    def angles(self, i, j):
+        """
+        i,j -- arrays of horizontal and vertical screen coordinates.
+        returns arrays of the viewing angles (yaw and vergence, in radians) 
+        at which the screen pixels are seen from the origin.
+        """
+        u = (numpy.asarray(i) + .5) / self.screenSize[0] - .5
+        v = (numpy.asarray(j) + .5) / self.screenSize[1] - .5
+        yaw = self.fov[0] * u * (1 + self.barrel * v**2) + \
+            self.wobble * numpy.sin(2 * math.pi * v)
+        vergence = self.fov[1] * v * (1 + self.barrel * u**2) + \
+            self.wobble * numpy.sin(2 * math.pi * u)
+        return yaw, vergence
+
+def gaussianBlur(image, sigma):
+    """ returns image blurred with a separable Gaussian kernel. """
+    if sigma <= 0:
+        return image
+    radius = int(math.ceil(3 * sigma))
+    kernel = numpy.exp(-numpy.arange(-radius, radius + 1)**2 / (2. * sigma**2))
+    kernel /= kernel.sum()
+    for axis in (0, 1):
+        padded = numpy.pad(image, [(radius, radius) if a == axis else (0, 0) 
+                                   for a in (0, 1)], mode='edge')
+        blurred = numpy.zeros(image.shape)
+        for k,weight in enumerate(kernel):
+            index = [slice(None), slice(None)]
+            index[axis] = slice(k, k + image.shape[axis])
+            blurred += weight * padded[tuple(index)]
+        image = blurred
+    return image
+
+class SimulatedCamera(object):
+    """
+    Stands in for both the camera and the display in detection.Detector: it
+    remembers the images shown and renders what a camera would see of them
+    on a screen with a synthetic distortion, including blur, vignetting and 
+    noise.
+    """
+    def __init__(self, screenSize, cameraSize, focallength, distortion, 
+                 gain=200., ambient=10., noise=2., vignetting=.3, blur=1.,
+                 poseError=0., latency=50., frameTime=33., seed=None):
+        """
+        screenSize -- size of the whole projection image : a tuple 
+            (width,height) of ints.
+        cameraSize -- size of the camera image : a tuple (width,height).
+        focallength -- focal length of the camera in pixels.
+        distortion -- an object with a method angles(i,j) mapping screen
+            coordinates to viewing angles, eg. a SyntheticDistortion.
+        gain -- gray level of a fully lit screen pixel in the image center.
+        ambient -- gray level of the dark screen.
+        noise -- standard deviation of the (Gaussian) noise in gray levels.
+        vignetting -- relative loss of brightness in the image corners.
+        blur -- standard deviation (in camera pixels) of the optical blur.
+        poseError -- standard deviation (in degrees) of the deviation of the 
+            actual from the nominal camera angles.  The pose (0,0) is always
+            exact, as it defines the frame of reference.
+        latency -- time (in ms) after which an image shown is seen by the 
+            camera.
+        frameTime -- time (in ms) taken by each snapshot.
+
+        Time is simulated: it only passes in wait() and takeSnapshot().
+        seed -- seed for the random number generator.
+        """
+        self.screenSize = screenSize
+        self.cameraSize = cameraSize
+        self.focallength = focallength
+        self.distortion = distortion
+        self.gain = gain
+        self.ambient = ambient
+        self.noise = noise
+        self.blur = blur
+        self.poseError = poseError
+        self.latency = latency
+        self.frameTime = frameTime
+        self.clock = 0.
+        self.random = numpy.random.RandomState(seed)
+        self.screen = numpy.zeros((screenSize[1], screenSize[0]))
+        # images shown but not yet seen by the camera, with the times they 
+        # will be seen.
+        self.pending = []
+
+        y,x = numpy.mgrid[0:cameraSize[1], 0:cameraSize[0]]
+        r = numpy.hypot(x - cameraSize[0] / 2., y - cameraSize[1] / 2.)
+        self.vignette = 1 - vignetting * (r / r.max())**2
+
+        self.rotateTo((0., 0.))
+
+    # display interface:
+
+    def open(self):
+        pass
+
+    def show(self, image):
+        self.pending.append((self.clock + self.latency, numpy.array(image, dtype=float)))
+
+    def wait(self, milliseconds):
+        self.clock += milliseconds
+
+    # camera interface:
+
+    def rotateTo(self, angles):
+        """ 
+        angles -- nominal yaw and vergence of the camera in degrees.
+        """
+        yaw,vergence = numpy.radians(angles)
+        if tuple(angles) != (0, 0):
+            yaw,vergence = (yaw,vergence) + \
+                numpy.radians(self.poseError) * self.random.randn(2)
+        self.pose = yaw, vergence
+        view = conversion.Conversion(
+            self.cameraSize, yaw, vergence, 0., self.focallength
+        )
+
+        # camera coordinates of all screen pixels, computed in blocks of rows
+        # to limit memory usage.
+        width,height = self.screenSize
+        self.cameraCoordinates = numpy.empty((2, height * width), dtype=numpy.float32)
+        rows = max(1, 2**20 // width)
+        for top in range(0, height, rows):
+            j,i = numpy.mgrid[top:min(top + rows, height), 0:width]
+            view.invert(
+                self.distortion.angles(i.ravel(), j.ravel()),
+                out=self.cameraCoordinates[:, top * width:top * width + i.size]
+            )
+
+        x,y = numpy.nan_to_num(self.cameraCoordinates)
+        self.visible = numpy.flatnonzero(
+            (x > 0) & (x < self.cameraSize[0] - 1) & 
+            (y > 0) & (y < self.cameraSize[1] - 1)
+        )
+        logger.debug(
+            "Camera at (%f, %f) degrees sees %d screen pixels.",
+            math.degrees(yaw), math.degrees(vergence), len(self.visible)
+        )
+        self.coverage = self.render(self.visible, numpy.ones(len(self.visible)))
+        self.coverageFloor = .5 * numpy.median(self.coverage[self.coverage > 0]) \
+            if (self.coverage > 0).any() else 1.
+
+    def render(self, pixels, brightness):
+        """
+        returns the blurred camera image of the given screen pixels (flat 
+        indices) with the given brightness, splatting each screen pixel
+        bilinearly onto the camera pixels around its image.
+        """
+        x,y = self.cameraCoordinates[:, pixels]
+        x0 = numpy.floor(x).astype(int)
+        y0 = numpy.floor(y).astype(int)
+        fx = x - x0
+        fy = y - y0
+        image = numpy.zeros(self.cameraSize[0] * self.cameraSize[1])
+        for dx,dy,weight in ((0, 0, (1 - fx) * (1 - fy)), (1, 0, fx * (1 - fy)),
+                             (0, 1, (1 - fx) * fy), (1, 1, fx * fy)):
+            image += numpy.bincount(
+                (y0 + dy) * self.cameraSize[0] + x0 + dx, 
+                weights=weight * brightness, minlength=image.size
+            )
+        image = image.reshape((self.cameraSize[1], self.cameraSize[0]))
+        return gaussianBlur(image, self.blur)
+
+    def takeSnapshot(self):
+        """ returns the camera image of the screen as a color image. """
+        self.clock += self.frameTime
+        while self.pending and self.pending[0][0] <= self.clock:
+            self.screen = self.pending.pop(0)[1]
+        screen = self.screen.ravel()
+        lit = self.visible[screen[self.visible] > 0]
+        radiance = self.render(lit, screen[lit]) / \
+            numpy.maximum(self.coverage, self.coverageFloor)
+        image = self.ambient + self.gain * self.vignette * radiance
+        image = image[:,:,None] + self.noise * self.random.randn(*(radiance.shape + (3,)))
+        return numpy.clip(image, 0, 255)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# ####################################################################
+#  Copyright (C) 2013-2014 by Johannes Bauer, The University of 
+#  Hamburg
+#  http://www.tatome.de
+#  This file is part of the projection correction project.
+#
+#  This is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as 
+#  published by the Free Software Foundation; either  version 2 
+#  of the License, or (at your option) any later version.
+#
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public  License 
+#  along with this file; if not, write to the
+#  Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+# ####################################################################
+
+
+import os
+import re
+import glob
+
+import numpy
+import yaml
+
+import logging
+logger = logging.getLogger(__name__)
+
+headerFilename = 'store.yaml'
+chunkPattern = 'shot-%04d-%s.npy'
+chunkRegex = re.compile(r'shot-(?P<shot>[0-9]+)-(?P<projector>.+)\.npy$')
+
+def writeAtomically(filename, array):
+    """ 
+    save array to filename such that the file is either complete or not 
+    there at all, even if we crash while writing.
+    """
+    with open(filename + '.tmp', 'wb') as outfile:
+        numpy.save(outfile, array)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(filename + '.tmp', filename)
+
+class DetectionStore(object):
+    """
+    Detection output written incrementally to a directory: one chunk (an 
+    (N x 6) array of sightings as in distortion.npz) per shot and projector, 
+    each written as soon as it is available.  Chunks are plain .npy files, 
+    so they can be memory-mapped, and read while detection is still 
+    running.
+    """
+
+    def __init__(self, path, config=None):
+        """
+        path -- directory of the store.  Is created if necessary.
+        config -- configuration of the detection run.  Written to a new 
+            store; ignored when reopening an existing one (to resume).
+        """
+        self.path = path
+        header = os.path.join(path, headerFilename)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if os.path.exists(header):
+            with open(header) as headerfile:
+                self.config = yaml.load(headerfile)['config']
+        else:
+            self.config = config
+            with open(header + '.tmp', 'w') as headerfile:
+                yaml.dump({'version' : 1, 'config' : config}, headerfile)
+            os.rename(header + '.tmp', header)
+
+    def filename(self, shot, projector):
+        return os.path.join(self.path, chunkPattern % (shot, projector))
+
+    def has(self, shot, projector):
+        """ 
+        returns True if the chunk of the given shot (its index in the list of 
+        shots) and projector is complete.
+        """
+        return os.path.exists(self.filename(shot, projector))
+
+    def write(self, shot, projector, sightings):
+        writeAtomically(self.filename(shot, projector), sightings)
+
+    def chunks(self):
+        """ returns a sorted list of (shot, projector) of complete chunks. """
+        chunks = []
+        for filename in glob.glob(os.path.join(self.path, 'shot-*.npy')):
+            match = chunkRegex.match(os.path.basename(filename))
+            if match:
+                chunks.append((int(match.group('shot')), match.group('projector')))
+        return sorted(chunks)
+
+    def missing(self):
+        """
+        returns a list of (shot, projector) of all chunks listed in the 
+        configuration but not complete, in the order in which they would be 
+        detected.
+        """
+        done = set(self.chunks())
+        return [
+            (shot, projector)
+                for shot,description in enumerate(self.config['detection']['shots'])
+                    for projector in description['projectors']
+                        if (shot, projector) not in done
+        ]
+
+    def iterChunks(self, mmap=True):
+        """
+        returns a generator of tuples (shot, projector, sightings) of all
+        complete chunks.  With mmap, the sightings are memory-mapped rather 
+        than read.
+        """
+        for shot,projector in self.chunks():
+            yield shot, projector, numpy.load(
+                self.filename(shot, projector), mmap_mode='r' if mmap else None
+            )
+
+    def load(self):
+        """ returns all sightings in the store in one (N x 6) array. """
+        return numpy.concatenate(
+            [sightings for shot,projector,sightings in self.iterChunks()] + 
+            [numpy.zeros((0,6))]
+        )
+
+mappingHeaderFilename = 'mapping.yaml'
+mappingColumnPattern = '%s.npy'
+
+def mappingPattern(config):
+    """
+    returns the pattern of the combined mapping directories of the 
+    configuration.  Configurations written before combined mappings were 
+    stored as columns have no combinedMappingPattern; for them, it is the 
+    combinedDistortionFilePattern without its extension.
+    """
+    if 'combinedMappingPattern' in config:
+        return config['combinedMappingPattern']
+    return os.path.splitext(config['combinedDistortionFilePattern'])[0]
+
+def writeMapping(path, columns, header):
+    """
+    write the combined mapping of one projector to the directory path: one 
+    .npy file per column and a header (mapping.yaml) with the names, types 
+    and lengths of the columns and the given header entries (configuration, 
+    provenance).  The header is written last, so a mapping with a header is 
+    complete.
+
+    columns -- list of (name, 1D array), all of the same length.
+    header -- dictionary of further header entries.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    lengths = set(len(column) for name,column in columns)
+    if len(lengths) > 1:
+        raise ValueError("Columns of a mapping differ in length: %s." % sorted(lengths))
+    header = dict(header)
+    header['version'] = 1
+    header['columns'] = []
+    for name,column in columns:
+        column = numpy.ascontiguousarray(column)
+        writeAtomically(os.path.join(path, mappingColumnPattern % name), column)
+        header['columns'].append({
+            'name' : name, 'dtype' : column.dtype.str, 'length' : len(column)
+        })
+    headerfile = os.path.join(path, mappingHeaderFilename)
+    with open(headerfile + '.tmp', 'w') as outfile:
+        yaml.dump(header, outfile)
+    os.rename(headerfile + '.tmp', headerfile)
+
+def isMapping(path):
+    """ returns True if path is a complete mapping written by writeMapping. """
+    return os.path.exists(os.path.join(path, mappingHeaderFilename))
+
+def readMapping(path, mmap=True):
+    """
+    returns the header and a dictionary of the columns of the mapping in 
+    the directory path.  With mmap, the columns are memory-mapped rather 
+    than read.
+    """
+    with open(os.path.join(path, mappingHeaderFilename)) as headerfile:
+        header = yaml.load(headerfile)
+    columns = {}
+    for description in header['columns']:
+        column = numpy.load(
+            os.path.join(path, mappingColumnPattern % description['name']),
+            mmap_mode='r' if mmap else None
+        )
+        if len(column) != description['length']:
+            raise ValueError(
+                "Column %s of mapping %s has %d entries, header says %d." % 
+                (description['name'], path, len(column), description['length'])
+            )
+        columns[description['name']] = column
+    return header, columns